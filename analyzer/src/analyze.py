@@ -1,20 +1,18 @@
+import math
+from datetime import datetime, timedelta
+import numpy as np
+import thresholds
 import upload
-from simulation.simulation import get_quartiles
+from history import get_history
+from simulation.conditional import ConditionalTable
+from simulation.distribution import Distribution
+from simulation.forecast import get_forecaster
+from simulation.simulation import get_conditional_table, get_distribution, sim_settings
+from simulation.cache import cache_key
 from config import conf
 from enum import Enum
 from logger import log
-
-MAPPING = {
-    0.01: 0,
-    0.05: 1,
-    0.1: 2,
-    0.25: 3,
-    0.5: 4,
-    0.75: 5,
-    0.9: 6,
-    0.95: 7,
-    0.99: 8
-}
+from metrics import metrics
 
 
 class GoodState(Enum):
@@ -30,18 +28,106 @@ SYMBOLS = [
 ]
 SYMBOL_TO_INDEX = {s: i for i, s in enumerate(SYMBOLS)}
 
+# Buy and sell quantile of every good
+buy_quantiles = [conf.BUY_QUARTILE] * len(SYMBOLS)
+sell_quantiles = [conf.SELL_QUARTILE] * len(SYMBOLS)
+
 # Track previous state by symbol
 prev_good_state = {s: GoodState.SHOULD_WAIT for s in SYMBOLS}
+# Track previous value and timestamp by symbol, to measure how the goods changed
+# when the history is not recorded
+prev_values = {}
+
 
+def load_thresholds():
+    """Use the per-good quantiles found by `main.py optimize`, if enabled in the config."""
+    if not conf.PER_GOOD_THRESHOLDS:
+        return
+    table = thresholds.load(cache_key(sim_settings()), len(SYMBOLS))
+    if table is None:
+        log.warn("Using the buy and sell quantiles of the config for all goods")
+        return
+    buy_quantiles[:], sell_quantiles[:] = table
+    log.info("Using per-good buy and sell quantiles")
 
-def sell_thresh(index: int):
+
+def sell_thresh(index: int, dist: Distribution = None):
     """Get the sell threshold for a good by index."""
-    return get_quartiles()[index][MAPPING[conf.SELL_QUARTILE]]
+    return (dist or get_distribution()).quantile(index, sell_quantiles[index])
 
 
-def buy_thresh(index: int):
+def buy_thresh(index: int, dist: Distribution = None):
     """Get the buy threshold for a good by index."""
-    return get_quartiles()[index][MAPPING[conf.BUY_QUARTILE]]
+    return (dist or get_distribution()).quantile(index, buy_quantiles[index])
+
+
+def classify(value: float, buy_threshold: float, sell_threshold: float) -> GoodState:
+    """Get the state of a good from its value."""
+    if value < buy_threshold:
+        return GoodState.SHOULD_BUY
+    elif value > sell_threshold:
+        return GoodState.SHOULD_SELL
+    else:
+        return GoodState.SHOULD_WAIT
+
+
+def next_action(prev_state: GoodState, cur_state: GoodState, bought: bool) -> str | None:
+    """
+    Get the type of the action to send when a good changes from `prev_state` to
+    `cur_state`, or `None` if no action should be sent.
+    """
+    if bought:
+        if prev_state != GoodState.SHOULD_SELL and cur_state == GoodState.SHOULD_SELL:
+            # Good changed to SHOULD_SELL so post a send action
+            return "sell"
+        elif prev_state == GoodState.SHOULD_SELL and cur_state != GoodState.SHOULD_SELL:
+            # Good went out of SHOULD_SELL state, so post a missed sell action
+            return "missed_sell"
+        elif prev_state == GoodState.SHOULD_SELL and cur_state == GoodState.SHOULD_SELL:
+            return "still_sell"
+    else:
+        if prev_state != GoodState.SHOULD_BUY and cur_state == GoodState.SHOULD_BUY:
+            # Good changed to SHOULD_BUY so post a buy action
+            return "buy"
+        elif prev_state == GoodState.SHOULD_BUY and cur_state != GoodState.SHOULD_BUY:
+            # Good went out of SHOULD_BUY state, so post a missed buy action
+            return "missed_buy"
+        elif prev_state == GoodState.SHOULD_BUY and cur_state == GoodState.SHOULD_BUY:
+            return "still_buy"
+    return None
+
+
+def lookback_snapshot(timestamp: datetime, lookback: int) -> tuple[np.ndarray, datetime] | None:
+    """
+    The values of all goods in the last recorded screenshot that was taken at
+    least about `lookback` ticks before `timestamp`, and when it was taken.
+    Returns `None` if the history is not recorded or has no such screenshot.
+    """
+    history = get_history()
+    if history is None:
+        return None
+    record = history.at(timestamp - timedelta(minutes=lookback - 0.5))
+    if record is None:
+        return None
+    return record["values"], datetime.fromtimestamp(record["timestamp"], timestamp.tzinfo)
+
+
+def expected_return(index: int, value: float, prev: tuple | None, timestamp,
+                    table: ConditionalTable) -> float | None:
+    """
+    The median return of a good over the next `conf.CONDITIONAL_HORIZON` ticks,
+    given its current value and how it changed since `prev`, the value and the
+    timestamp of an earlier screenshot. The change is measured like in the table,
+    so the screenshot must be about `table.lookback` ticks old.
+    Returns `None` if it is not known.
+    """
+    if prev is None or not conf.CONDITIONAL_HORIZON:
+        return None
+    prev_value, prev_timestamp = prev
+    ticks = (timestamp - prev_timestamp).total_seconds() / 60
+    if not table.lookback - 0.5 <= ticks <= 2 * table.lookback:
+        return None
+    return table.quantile(index, value, (value - prev_value) / ticks, 0.5)
 
 
 def analyze_values(goods: dict, timestamp):
@@ -53,6 +139,15 @@ def analyze_values(goods: dict, timestamp):
         timestamp: Datetime object representing when the screenshot was taken
     """
     actions = []
+    uploaded_goods = {}
+    # Use the same results for all goods, even if they are swapped in the meantime
+    dist = get_distribution()
+    table = get_conditional_table()
+    values = np.full(len(SYMBOLS), np.nan)
+    bought_goods = np.zeros(len(SYMBOLS), dtype=bool)
+    # The threshold of the next action of every good
+    next_thresholds = np.full(len(SYMBOLS), np.nan)
+    past = lookback_snapshot(timestamp, table.lookback)
 
     for symbol, data in goods.items():
         index = SYMBOL_TO_INDEX.get(symbol)
@@ -60,42 +155,96 @@ def analyze_values(goods: dict, timestamp):
             log.warn(f"Symbol {symbol} not recognized, skipping analysis.")
             continue
         value, bought = data['value'], data['bought']
-        sell_threshold = sell_thresh(index)
-        buy_threshold = buy_thresh(index)
+        values[index], bought_goods[index] = value, bought
+        uploaded_goods[symbol] = {
+            "value": value,
+            "bought": bought,
+            "percentile": round(dist.percentile(index, value), 4)
+        }
+        sell_threshold = sell_thresh(index, dist)
+        buy_threshold = buy_thresh(index, dist)
+        next_thresholds[index] = sell_threshold if bought else buy_threshold
         prev_state = prev_good_state[symbol]
-        if value < buy_threshold:
-            cur_state = GoodState.SHOULD_BUY
-        elif value > sell_threshold:
-            cur_state = GoodState.SHOULD_SELL
-        else:
-            cur_state = GoodState.SHOULD_WAIT
-
-        def action(threshold: float, action_type: str):
+        cur_state = classify(value, buy_threshold, sell_threshold)
+
+        if cur_state != GoodState.SHOULD_WAIT and cur_state != prev_state:
+            # Wait while the good is likely to keep moving in our favor
+            prev = prev_values.get(symbol)
+            if past is not None and not np.isnan(past[0][index]):
+                prev = (float(past[0][index]), past[1])
+            ret = expected_return(index, value, prev, timestamp, table)
+            if ret is not None and (ret < 0 if cur_state == GoodState.SHOULD_BUY else ret > 0):
+                cur_state = GoodState.SHOULD_WAIT
+        prev_values[symbol] = (value, timestamp)
+
+        action_type = next_action(prev_state, cur_state, bought)
+        if action_type is not None:
+            sell = action_type.endswith("sell")
             actions.append({
                 "symbol": symbol,
                 "value": value,
-                "thresh": threshold,
+                "thresh": sell_threshold if sell else buy_threshold,
                 "type": action_type
             })
+        prev_good_state[symbol] = cur_state
+
+    history = get_history()
+    if history is not None:
+        with metrics.timer("record"):
+            history.append(timestamp, values, bought_goods)
+    add_forecasts(uploaded_goods, actions, values, next_thresholds, bought_goods)
+    upload.push_values(uploaded_goods, actions, timestamp)
+
 
-        if bought:
-            if prev_state != GoodState.SHOULD_SELL and cur_state == GoodState.SHOULD_SELL:
-                # Good changed to SHOULD_SELL so post a send action
-                action(sell_threshold, "sell")
-            elif prev_state == GoodState.SHOULD_SELL and cur_state != GoodState.SHOULD_SELL:
-                # Good went out of SHOULD_SELL state, so post a missed sell action
-                action(sell_threshold, "missed_sell")
-            elif prev_state == GoodState.SHOULD_SELL and cur_state == GoodState.SHOULD_SELL:
-                action(sell_threshold, "still_sell")
+def threshold_distance(goods: dict) -> float | None:
+    """
+    How close the good that is closest to the threshold of its next action is to
+    it, in quantiles: the sell threshold for bought goods, the buy threshold for
+    the others. 0 if a good is past its threshold, `None` without goods.
+    """
+    dist = get_distribution()
+    distances = []
+    for symbol, data in goods.items():
+        index = SYMBOL_TO_INDEX.get(symbol)
+        if index is None:
+            continue
+        percentile = dist.percentile(index, data['value'])
+        if data['bought']:
+            distances.append(sell_quantiles[index] - percentile)
         else:
-            if prev_state != GoodState.SHOULD_BUY and cur_state == GoodState.SHOULD_BUY:
-                # Good changed to SHOULD_BUY so post a buy action
-                action(buy_threshold, "buy")
-            elif prev_state == GoodState.SHOULD_BUY and cur_state != GoodState.SHOULD_BUY:
-                # Good went out of SHOULD_BUY state, so post a missed buy action
-                action(buy_threshold, "missed_buy")
-            elif prev_state == GoodState.SHOULD_BUY and cur_state == GoodState.SHOULD_BUY:
-                action(buy_threshold, "still_buy")
-        prev_good_state[symbol] = cur_state
+            distances.append(percentile - buy_quantiles[index])
+    return max(min(distances), 0.0) if distances else None
+
 
-    upload.push_values(goods, actions, timestamp)
+def add_forecasts(goods: dict, actions: list[dict], values: np.ndarray,
+                  thresholds: np.ndarray, bought: np.ndarray):
+    """
+    Add a forecast to every good of how likely it is to reach the threshold of its
+    next action within the next ticks, and how many ticks that takes: the sell
+    threshold for bought goods, the buy threshold for the others. Goods that are
+    already past it get no forecast. Actions get the forecast of their good, so
+    actions that have already fired get none.
+    """
+    forecaster = get_forecaster()
+    if forecaster is None:
+        return
+
+    past = np.where(bought, values >= thresholds, values <= thresholds)
+    thresholds = np.where(np.isnan(values) | past, np.nan, thresholds)
+    if np.isnan(thresholds).all():
+        return
+    result = forecaster.forecast(np.nan_to_num(values, nan=1.0), thresholds, bought,
+                                 conf.FORECAST_HORIZON, conf.FORECAST_BUDGET)
+    for symbol, data in goods.items():
+        index = SYMBOL_TO_INDEX[symbol]
+        if np.isnan(thresholds[index]):
+            continue
+        expected_ticks = float(result["expectedTicks"][index])
+        data["forecast"] = {
+            "probability": float(result["probability"][index]),
+            "expectedTicks": None if math.isnan(expected_ticks) else expected_ticks,
+            "horizon": result["horizon"],
+        }
+    for action in actions:
+        if "forecast" in goods[action["symbol"]]:
+            action["forecast"] = goods[action["symbol"]]["forecast"]
@@ -0,0 +1,301 @@
+import csv
+import time
+from datetime import datetime
+import numpy as np
+from analyze import SYMBOLS, GoodState, next_action
+from config import conf
+from history import History
+from logger import log
+from simulation import engine
+from simulation.conditional import ConditionalTable
+from simulation.simulation import get_conditional_table, get_distribution
+
+ACTION_TYPES = ["buy", "sell", "missed_buy", "missed_sell", "still_buy", "still_sell"]
+
+
+def _action_table() -> np.ndarray:
+    """
+    The action sent for every combination of previous state, current state and
+    bought status, as an index into `ACTION_TYPES` or -1 for no action.
+    Built from `next_action()`, so the backtest follows the same transitions as
+    `analyze_values()`.
+    """
+    table = np.full((len(GoodState), len(GoodState), 2), -1, dtype=np.int8)
+    for prev_state in GoodState:
+        for cur_state in GoodState:
+            for bought in (False, True):
+                action_type = next_action(prev_state, cur_state, bought)
+                if action_type is not None:
+                    table[prev_state.value, cur_state.value, int(bought)] = \
+                        ACTION_TYPES.index(action_type)
+    return table
+
+
+def _run_ends(states: np.ndarray) -> np.ndarray:
+    """For every snapshot, the index of the last snapshot in which the state stays the same."""
+    steps = np.arange(len(states))[:, None]
+    last = np.ones(states.shape, dtype=bool)
+    last[:-1] = states[1:] != states[:-1]
+    ends = np.where(last, steps, len(states) - 1)
+    return np.minimum.accumulate(ends[::-1], axis=0)[::-1]
+
+
+def _hold_back(states: np.ndarray, held: np.ndarray) -> np.ndarray:
+    """
+    The states after waiting while goods are likely to keep moving in our favor,
+    like `analyze_values()`: a good only enters SHOULD_BUY or SHOULD_SELL at the
+    first snapshot of a run of that state that is not `held`, and is in
+    SHOULD_WAIT until then.
+    """
+    steps = np.arange(len(states))[:, None]
+    start = np.ones(states.shape, dtype=bool)
+    start[1:] = states[1:] != states[:-1]
+    released = np.cumsum(~held, axis=0)
+    # Number of released snapshots before the start of the run of every snapshot
+    run_start = np.maximum.accumulate(np.where(start, steps, 0), axis=0)
+    before = np.take_along_axis(released - ~held, run_start, axis=0)
+    waiting = (released == before) & (states != GoodState.SHOULD_WAIT.value)
+    return np.where(waiting, GoodState.SHOULD_WAIT.value, states)
+
+
+def expected_returns(values: np.ndarray, goods: np.ndarray, table: ConditionalTable,
+                     ticks: np.ndarray) -> np.ndarray | None:
+    """
+    The median return over the next ticks that `analyze_values()` expects for
+    every snapshot of series of values. Like there, the change of every value is
+    measured since the last snapshot taken at least about `table.lookback` ticks
+    before, if that snapshot is not much older. NaN where it is not known.
+    Returns `None` if `analyze_values()` does not wait for expected returns.
+
+    Args:
+        values: Array of shape `(snapshots, series)`.
+        goods: The index of the good of every series.
+        ticks: The time of every snapshot in ticks, in increasing order. They do
+            not have to be evenly spaced.
+    """
+    if not conf.CONDITIONAL_HORIZON:
+        return None
+    ticks = np.asarray(ticks, dtype=np.float64)
+    past = np.searchsorted(ticks, ticks - (table.lookback - 0.5), side="right") - 1
+    elapsed = ticks - ticks[np.maximum(past, 0)]
+    known = (past >= 0) & (elapsed <= 2 * table.lookback)
+    deltas = np.full(values.shape, np.nan)
+    deltas[known] = (values[known] - values[past[known]]) / elapsed[known, None]
+    return table.lookup(np.broadcast_to(goods, values.shape), values, deltas, 0.5)
+
+
+def backtest(values: np.ndarray, buy_thresholds: np.ndarray, sell_thresholds: np.ndarray,
+             delay: int = 1, overhead: float = 0.0, expected: np.ndarray = None,
+             ticks: np.ndarray = None) -> dict:
+    """
+    Replay series of values through the buy/sell state machine of `analyze_values()`.
+
+    The user is assumed to follow every buy and sell action `delay` snapshots after
+    it is sent, if the good is still past the threshold by then. Otherwise the
+    opportunity is missed. Buying costs `overhead` times the value on top of the
+    value, like the overhead of the stock market in the game. All series are
+    evaluated at once.
+
+    Args:
+        values: Array of shape `(snapshots, series)`.
+        buy_thresholds: The buy threshold of every series.
+        sell_thresholds: The sell threshold of every series.
+        expected: The expected returns of `expected_returns()`, to wait while goods
+            are likely to keep moving in our favor like `analyze_values()`, or
+            `None` to act as soon as a good is past its threshold.
+        ticks: The time of every snapshot in ticks, if it is known.
+    Returns:
+        A dict of arrays with one entry per series: the number of completed `trades`,
+        their total `profit` per unit bought, the sum of their relative `returns`, of
+        their `holdSnapshots` and, with `ticks`, of their `holdTicks`, whether a
+        position is still `open` at the end, and the count of every type of action
+        in `ACTION_TYPES`.
+    """
+    steps, series = values.shape
+    states = np.where(values < buy_thresholds, GoodState.SHOULD_BUY.value,
+                      np.where(values > sell_thresholds, GoodState.SHOULD_SELL.value,
+                               GoodState.SHOULD_WAIT.value)).astype(np.intp)
+    if expected is not None:
+        held = np.where(states == GoodState.SHOULD_BUY.value, expected < 0,
+                        (states == GoodState.SHOULD_SELL.value) & (expected > 0))
+        states = _hold_back(states, held)
+    # Every good starts out in the SHOULD_WAIT state, like in `analyze_values()`
+    prev_states = np.empty_like(states)
+    prev_states[0] = GoodState.SHOULD_WAIT.value
+    prev_states[1:] = states[:-1]
+
+    # Trades are made when the state entered by an action lasts until the user acts
+    entered = states != prev_states
+    acted = entered & (_run_ends(states) - np.arange(steps)[:, None] >= delay)
+    acted &= states != GoodState.SHOULD_WAIT.value
+    step, column = np.nonzero(acted)
+    is_buy = states[step, column] == GoodState.SHOULD_BUY.value
+    step = step + delay
+
+    # Sort by series, then time. Actions of the same type in a row are made while
+    # the good is already bought (or not bought), so only the first one is a trade.
+    order = np.lexsort((step, column))
+    step, column, is_buy = step[order], column[order], is_buy[order]
+    new_series = np.ones(len(step), dtype=bool)
+    new_series[1:] = column[1:] != column[:-1]
+    keep = new_series.copy()
+    keep[1:] |= is_buy[1:] != is_buy[:-1]
+    step, column, is_buy, new_series = step[keep], column[keep], is_buy[keep], new_series[keep]
+    # A series can only start with a buy
+    new_series[1:] = column[1:] != column[:-1]
+    keep = ~(new_series & ~is_buy)
+    step, column, is_buy = step[keep], column[keep], is_buy[keep]
+
+    # Trades now alternate between buying and selling in every series
+    buys = np.nonzero(is_buy)[0]
+    closed = buys[(buys + 1 < len(step))]
+    closed = closed[column[closed + 1] == column[closed]]
+    buy_step, sell_step, trade_column = step[closed], step[closed + 1], column[closed]
+    buy_value = values[buy_step, trade_column] * (1 + overhead)
+    sell_value = values[sell_step, trade_column]
+
+    # The good is bought from the snapshot after it was bought until the snapshot
+    # after it was sold
+    change = np.zeros((steps + 1, series), dtype=np.int8)
+    np.add.at(change, (step + 1, column), np.where(is_buy, 1, -1))
+    bought = np.cumsum(change[:steps], axis=0, dtype=np.int8) > 0
+
+    actions = _action_table()[prev_states, states, bought.astype(np.intp)]
+    result = {
+        "trades": np.bincount(trade_column, minlength=series),
+        "profit": np.bincount(trade_column, sell_value - buy_value, minlength=series),
+        "returns": np.bincount(trade_column, sell_value / buy_value - 1, minlength=series),
+        "holdSnapshots": np.bincount(trade_column, sell_step - buy_step, minlength=series),
+        "open": change.sum(axis=0) > 0,
+    }
+    if ticks is not None:
+        result["holdTicks"] = np.bincount(
+            trade_column, ticks[sell_step] - ticks[buy_step], minlength=series)
+    for i, action_type in enumerate(ACTION_TYPES):
+        result[action_type] = (actions == i).sum(axis=0)
+    return result
+
+
+def simulate_values(years: float, replicas: int, step: int, bank_level: int,
+                    has_supreme_intellect: bool, seed=None) -> np.ndarray:
+    """
+    Simulate the values of every good in `replicas` markets for `years` in-game years
+    in total, keeping every `step`th tick.
+    Returns an array of shape `(snapshots, replicas, GOOD_COUNT)`.
+    """
+    ticks = int(years * engine.TICKS_PER_YEAR / replicas) // step * step
+    market = engine.Market(replicas, bank_level, int(has_supreme_intellect),
+                           np.random.default_rng(seed))
+    for _ in range(2000):
+        market.tick()
+
+    values = np.empty((ticks // step, replicas, conf.GOOD_COUNT))
+    done = 0
+
+    def on_block(block: np.ndarray):
+        nonlocal done
+        values[done // step:(done + len(block)) // step] = block[step - 1::step]
+        done += len(block)
+
+    market.run(ticks, on_block, block_size=step * max(1, 1024 // step))
+    return values
+
+
+def _parse_time(text: str) -> float:
+    """Seconds since the epoch of a time given like that or as an ISO 8601 date."""
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def load_values(path: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Load recorded values from a CSV file with one column per symbol and one row
+    per snapshot. Goods without a column are never bought or sold. The time of
+    every snapshot is read from a `timestamp` column, as seconds since the epoch
+    or an ISO 8601 date, if there is one.
+    Returns an array of shape `(snapshots, 1, GOOD_COUNT)`, and the time of every
+    snapshot in ticks since the first one or `None` if it is not known.
+    """
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    values = np.full((len(rows), 1, conf.GOOD_COUNT), np.nan)
+    for i, symbol in enumerate(SYMBOLS):
+        if rows and symbol in rows[0]:
+            values[:, 0, i] = [float(row[symbol]) for row in rows]
+    if not rows or "timestamp" not in rows[0]:
+        return values, None
+    seconds = np.array([_parse_time(row["timestamp"]) for row in rows])
+    if np.any(np.diff(seconds) <= 0):
+        raise ValueError("The timestamps of the snapshots must increase")
+    return values, (seconds - seconds[0]) / 60
+
+
+def load_history(since: datetime | None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Load the values recorded by the analyzer since `since`, or all of them if it
+    is `None`. Goods that were not read are never bought or sold.
+    Returns an array of shape `(snapshots, 1, GOOD_COUNT)`, and the time of every
+    snapshot in ticks since the first one.
+    """
+    records = History().records(since)
+    seconds = records["timestamp"]
+    start = seconds[0] if len(seconds) else 0.0
+    return records["values"][:, None, :], (seconds - start) / 60
+
+
+def report(values: np.ndarray, buy_quartile: float, sell_quartile: float, delay: int,
+           overhead: float, ticks: np.ndarray | None, hold_back: bool = True):
+    """
+    Backtest the given quantiles on `values` and print the results per good.
+    `ticks` is the time of every snapshot in ticks, or `None` if it is not known.
+    With `hold_back`, goods are held while they are likely to keep moving in our
+    favor, like in `analyze_values()`. This needs the time of the snapshots, and
+    is turned off without it.
+    """
+    dist = get_distribution()
+    snapshots, replicas, goods = values.shape
+    buy = np.tile([dist.quantile(i, buy_quartile) for i in range(goods)], replicas)
+    sell = np.tile([dist.quantile(i, sell_quartile) for i in range(goods)], replicas)
+    if hold_back and ticks is None:
+        log.warn("The time of the snapshots is not known, so goods are not held back")
+        hold_back = False
+
+    start = time.perf_counter()
+    values = values.reshape(snapshots, replicas * goods)
+    expected = None
+    if hold_back:
+        expected = expected_returns(values, np.tile(np.arange(goods), replicas),
+                                    get_conditional_table(), ticks)
+    result = backtest(values, buy, sell, delay, overhead, expected, ticks)
+    log.info(f"Backtested {values.size} values in {time.perf_counter() - start:.2f}s")
+    # Sum the results of all markets per good
+    result = {k: v.reshape(replicas, goods).sum(axis=0) for k, v in result.items()}
+
+    if ticks is None:
+        hold, unit = result["holdSnapshots"], "snapshots"
+        print(f"Buy quantile {buy_quartile}, sell quantile {sell_quartile}, "
+              f"{snapshots} snapshots of unknown time per good, "
+              f"reacting after {delay} snapshots, not holding back")
+    else:
+        hold, unit = result["holdTicks"], "ticks"
+        spacing = float(np.median(np.diff(ticks))) if snapshots > 1 else 0.0
+        print(f"Buy quantile {buy_quartile}, sell quantile {sell_quartile}, "
+              f"{(ticks[-1] - ticks[0] + spacing) * replicas:.0f} ticks per good, "
+              f"reacting after {delay} snapshots (about {delay * spacing:.0f} ticks), "
+              f"{'holding back' if hold_back else 'not holding back'}")
+    print(f"{'Good':<5}{'Trades':>8}{'Profit':>10}{'Return':>9}{'Hold':>9}"
+          f"{'Buys':>7}{'Sells':>7}{'Missed buys':>13}{'Missed sells':>14}")
+    for i, symbol in enumerate(SYMBOLS):
+        trades = max(result["trades"][i], 1)
+        buys, sells = result["buy"][i], result["sell"][i]
+        print(f"{symbol:<5}{result['trades'][i]:>8}{result['profit'][i]:>10.1f}"
+              f"{result['returns'][i] / trades:>9.1%}"
+              f"{hold[i] / trades:>9.0f}"
+              f"{buys:>7}{sells:>7}"
+              f"{result['missed_buy'][i] / max(buys, 1):>13.1%}"
+              f"{result['missed_sell'][i] / max(sells, 1):>14.1%}")
+    total = result["profit"].sum()
+    print(f"Total profit per unit: {total:.1f} ({result['trades'].sum()} trades, "
+          f"{result['open'].sum()} still open). Return and hold time (in {unit}) are per trade.")
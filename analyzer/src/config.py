@@ -19,12 +19,44 @@ class Config:
     API_KEY: str
     SESSION_TOKEN: str
     USER_AGENT: str
+    BANK_LEVEL: int
+    HAS_SUPREME_INTELLECT: bool
+    SIMULATION_YEARS: float
+    SIMULATION_REPLICAS: int
+    SIMULATION_SHARDS: int
+    SIMULATION_CACHE_SIZE: int
+    SIMULATION_TOLERANCE: float
+    PER_GOOD_THRESHOLDS: bool
+    CONDITIONAL_LOOKBACK: int
+    CONDITIONAL_HORIZON: int
+    CONDITIONAL_YEARS: float
+    FORECAST_PATHS: int
+    FORECAST_HORIZON: int
+    FORECAST_BUDGET: float
+    OCR_MODE: str
+    OCR_MIN_CONFIDENCE: float
+    FORCE_REFRESH_INTERVAL: float
+    IMAGE_FORMAT: str
+    IMAGE_COLORS: str
+    IMAGE_PALETTE_SIZE: int
+    IMAGE_TEXT_HEIGHT: int
+    IMAGE_COMPRESS_LEVEL: int
+    CAPTURE_BACKEND: str
+    TRACK_PANEL: bool
+    TRACK_MARGIN: int
+    COMPRESS_REQUESTS: bool
+    ADAPTIVE_INTERVAL: bool
+    CAPTURE_BUDGET: int
+    OUTBOX_MAX_BYTES: int
+    DELTA_UPDATES: bool
+    RECORD_HISTORY: bool
 
     GOOD_COUNT = 18
 
     class Endpoints:
         def __init__(self, server_url):
             self.UPDATE = f"{server_url}/api/update"
+            self.UPDATE_BATCH = f"{server_url}/api/updateBatch"
             self.IMG_PROCESS = f"{server_url}/api/process"
             self.CREATE_INSTANCE = f"{server_url}/api/auth/instance"
             self.CREATE_SESSION = f"{server_url}/api/auth/session"
@@ -60,10 +92,75 @@ class Config:
         # Trading thresholds
         self._set_config_prop(config, "SELL_QUARTILE", "sellQuartile")
         self._set_config_prop(config, "BUY_QUARTILE", "buyQuartile")
+        self._set_config_prop(config, "PER_GOOD_THRESHOLDS",
+                              "perGoodThresholds", default=lambda: False)
+
+        # Simulation settings
+        self._set_config_prop(config, "BANK_LEVEL", "bankLevel")
+        self._set_config_prop(
+            config, "HAS_SUPREME_INTELLECT", "hasSupremeIntellect")
+        self._set_config_prop(config, "SIMULATION_YEARS", "simulationYears")
+        self._set_config_prop(config, "SIMULATION_REPLICAS",
+                              "simulationReplicas", default=lambda: 256)
+        self._set_config_prop(config, "SIMULATION_SHARDS",
+                              "simulationShards", default=lambda: 0)
+        if not self.SIMULATION_SHARDS:
+            self.SIMULATION_SHARDS = os.cpu_count() or 1
+        self._set_config_prop(config, "SIMULATION_CACHE_SIZE",
+                              "simulationCacheSize", default=lambda: 4)
+        self._set_config_prop(config, "SIMULATION_TOLERANCE",
+                              "simulationTolerance", default=lambda: 0)
+        self._set_config_prop(config, "CONDITIONAL_LOOKBACK",
+                              "conditionalLookback", default=lambda: 10)
+        self._set_config_prop(config, "CONDITIONAL_HORIZON",
+                              "conditionalHorizon", default=lambda: 30)
+        self._set_config_prop(config, "CONDITIONAL_YEARS",
+                              "conditionalYears", default=lambda: 1)
+        self._set_config_prop(config, "FORECAST_PATHS",
+                              "forecastPaths", default=lambda: 1024)
+        self._set_config_prop(config, "FORECAST_HORIZON",
+                              "forecastHorizon", default=lambda: 15)
+        self._set_config_prop(config, "FORECAST_BUDGET",
+                              "forecastBudget", default=lambda: 0.1)
+
+        # OCR settings
+        self._set_config_prop(config, "OCR_MODE", "ocrMode", default=lambda: "local")
+        self._set_config_prop(config, "OCR_MIN_CONFIDENCE",
+                              "ocrMinConfidence", default=lambda: 0.85)
+
+        # Encoding of screenshots sent to the server
+        self._set_config_prop(config, "IMAGE_FORMAT", "imageFormat", default=lambda: "png")
+        self._set_config_prop(config, "IMAGE_COLORS", "imageColors", default=lambda: "rgb")
+        self._set_config_prop(config, "IMAGE_PALETTE_SIZE",
+                              "imagePaletteSize", default=lambda: 32)
+        self._set_config_prop(config, "IMAGE_TEXT_HEIGHT",
+                              "imageTextHeight", default=lambda: 0)
+        self._set_config_prop(config, "IMAGE_COMPRESS_LEVEL",
+                              "imageCompressLevel", default=lambda: 6)
 
         # System settings
         self._set_config_prop(config, "SERVER_URL", "serverUrl")
         self._set_config_prop(config, "CHECK_INTERVAL", "checkInterval")
+        self._set_config_prop(config, "FORCE_REFRESH_INTERVAL",
+                              "forceRefreshInterval", default=lambda: 3600)
+        self._set_config_prop(config, "ADAPTIVE_INTERVAL",
+                              "adaptiveInterval", default=lambda: True)
+        self._set_config_prop(config, "CAPTURE_BUDGET",
+                              "captureBudget", default=lambda: 30)
+        self._set_config_prop(config, "CAPTURE_BACKEND",
+                              "captureBackend", default=lambda: "auto")
+        self._set_config_prop(config, "TRACK_PANEL",
+                              "trackPanel", default=lambda: True)
+        self._set_config_prop(config, "TRACK_MARGIN",
+                              "trackMargin", default=lambda: 64)
+        self._set_config_prop(config, "COMPRESS_REQUESTS",
+                              "compressRequests", default=lambda: False)
+        self._set_config_prop(config, "OUTBOX_MAX_BYTES",
+                              "outboxMaxBytes", default=lambda: 10_000_000)
+        self._set_config_prop(config, "DELTA_UPDATES",
+                              "deltaUpdates", default=lambda: True)
+        self._set_config_prop(config, "RECORD_HISTORY",
+                              "recordHistory", default=lambda: True)
         self._set_config_prop(config, "USE_TEST_IMAGE", "useTestImage")
         self._set_config_prop(
             config, "BOUNDS_SERVER_PORT", "boundsServerPort")
@@ -0,0 +1,82 @@
+import base64
+import time
+from io import BytesIO
+from PIL import Image
+import local_ocr
+from config import conf
+
+# MIME type of every image format that the server accepts
+MIME_TYPES = {"png": "image/png", "webp": "image/webp"}
+
+
+def preprocess(image: Image.Image, colors: str, palette_size: int,
+               text_height: int) -> Image.Image:
+    """
+    Make a screenshot cheaper to encode and send, without making its text harder
+    to read.
+
+    Args:
+        colors: "rgb" to keep all colors, "gray" for grayscale, or "palette" for
+            the `palette_size` most important colors.
+        text_height: If not 0, scale the image down so that its text is this many
+            pixels high. Images with smaller text are not scaled.
+    """
+    if text_height:
+        height = local_ocr.text_height(image)
+        if height is not None and height > text_height:
+            factor = text_height / height
+            size = (max(1, round(image.width * factor)), max(1, round(image.height * factor)))
+            image = image.convert("RGB").resize(size, Image.LANCZOS)
+    if colors == "gray":
+        return image.convert("L")
+    if colors == "palette":
+        return image.convert("RGB").quantize(palette_size)
+    return image.convert("RGB")
+
+
+def encode(image: Image.Image, image_format: str, compress_level: int) -> bytes:
+    """
+    Encode an image losslessly.
+    `compress_level` is between 0 (fastest) and 9 (smallest), like for zlib.
+    """
+    buffer = BytesIO()
+    if image_format == "webp":
+        image.save(buffer, format="WEBP", lossless=True, method=round(compress_level * 6 / 9))
+    else:
+        image.save(buffer, format="PNG", compress_level=compress_level)
+    return buffer.getvalue()
+
+
+def encode_screenshot(image: Image.Image) -> tuple[bytes, str]:
+    """
+    Preprocess and encode a screenshot with the configured settings.
+    Returns the encoded image and its MIME type.
+    """
+    image = preprocess(image, conf.IMAGE_COLORS, conf.IMAGE_PALETTE_SIZE, conf.IMAGE_TEXT_HEIGHT)
+    data = encode(image, conf.IMAGE_FORMAT, conf.IMAGE_COMPRESS_LEVEL)
+    return data, MIME_TYPES[conf.IMAGE_FORMAT]
+
+
+def benchmark(image: Image.Image, frames: int):
+    """
+    Measure the size and time per frame of encoding a screenshot in every supported
+    way, including the base64 encoding, compared to a full-color PNG at default
+    settings.
+    """
+    variants = [("rgb", 0, "png", 6, "current")]
+    for colors in ("rgb", "gray", "palette"):
+        for text_height in sorted({0, conf.IMAGE_TEXT_HEIGHT or 10}):
+            for image_format, levels in (("png", (1, 6, 9)), ("webp", (0, 4, 9))):
+                for level in levels:
+                    variants.append((colors, text_height, image_format, level, ""))
+
+    print(f"{image.width}x{image.height} pixels, {frames} frames per variant")
+    print(f"{'Colors':<9}{'Text':>5}{'Format':>8}{'Level':>7}{'Bytes':>10}{'ms':>8}")
+    for colors, text_height, image_format, level, note in variants:
+        start = time.perf_counter()
+        for _ in range(frames):
+            processed = preprocess(image, colors, conf.IMAGE_PALETTE_SIZE, text_height)
+            size = len(base64.b64encode(encode(processed, image_format, level)))
+        elapsed = (time.perf_counter() - start) * 1000 / frames
+        print(f"{colors:<9}{text_height or '-':>5}{image_format:>8}{level:>7}"
+              f"{size:>10}{elapsed:>8.1f}  {note}")
@@ -0,0 +1,154 @@
+import bisect
+import os
+import struct
+import threading
+from datetime import datetime
+import numpy as np
+from config import conf
+from logger import log
+
+HISTORY_FILE = "history.bin"
+
+MAGIC = b"CCSWHIST"
+VERSION = 1
+# Magic, version, number of goods, size of a record and number of records
+HEADER = struct.Struct("<8sIIIxxxxQ")
+HEADER_SIZE = 64
+# The file grows by this many records at once, so that it is not remapped for every one
+GROW_RECORDS = 4096
+
+# One snapshot of the stock market: when it was taken, the value of every good
+# (NaN if it was not read) and which goods were bought, one bit per good
+RECORD = np.dtype([
+    ("timestamp", "<f8"),
+    ("values", "<f8", (conf.GOOD_COUNT,)),
+    ("bought", "<u4"),
+], align=True)
+_BITS = np.uint32(1) << np.arange(conf.GOOD_COUNT, dtype=np.uint32)
+
+
+class History:
+    """
+    The values of all goods read from every screenshot, appended to a memory-mapped
+    file of fixed-size records that are sorted by time.
+
+    Records are NumPy views of the file, so that even months of snapshots are read
+    without copying them. Snapshots are found by time with a binary search over the
+    timestamps, which only increase.
+    """
+
+    def __init__(self, path: str = HISTORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.exists(path) or os.path.getsize(path) < HEADER_SIZE:
+            with open(path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, VERSION, conf.GOOD_COUNT, RECORD.itemsize, 0)
+                           .ljust(HEADER_SIZE, b"\0"))
+        with open(path, "rb") as file:
+            magic, version, goods, size, count = HEADER.unpack(file.read(HEADER.size))
+        if (magic, version, goods, size) != (MAGIC, VERSION, conf.GOOD_COUNT, RECORD.itemsize):
+            raise ValueError(f"{path} is not a history of this version of the analyzer")
+        self._header = np.memmap(path, dtype=np.uint8, mode="r+", shape=(HEADER_SIZE,))
+        # The number of records, updated after every record is written, so that
+        # a record is only counted once it is complete
+        self._count = self._header[HEADER.size - 8:HEADER.size].view("<u8")
+        self._map(max(GROW_RECORDS, (os.path.getsize(path) - HEADER_SIZE) // RECORD.itemsize))
+        if count > len(self._records):
+            log.warn(f"{path} is shorter than expected, some snapshots are lost")
+            self._count[0] = count = len(self._records)
+        self._last = self._records["timestamp"][count - 1] if count else -np.inf
+
+    def _map(self, capacity: int):
+        """Map the records of the file, growing it to hold `capacity` records."""
+        size = HEADER_SIZE + capacity * RECORD.itemsize
+        if os.path.getsize(self.path) < size:
+            with open(self.path, "r+b") as file:
+                file.truncate(size)
+        # Views of the previous mapping stay valid, since the file only grows
+        self._records = np.memmap(self.path, dtype=RECORD, mode="r+", offset=HEADER_SIZE,
+                                  shape=(capacity,))
+
+    def __len__(self) -> int:
+        return int(self._count[0])
+
+    def append(self, timestamp: datetime, values: np.ndarray, bought: np.ndarray) -> bool:
+        """
+        Record the values of all goods of a screenshot, NaN for goods that were not
+        read, and whether they were bought. Returns `False` if a snapshot that was
+        taken at the same time or later is already recorded.
+        """
+        seconds = timestamp.timestamp()
+        mask = int(np.dot(np.asarray(bought, dtype=np.uint32), _BITS))
+        with self._lock:
+            if seconds <= self._last:
+                return False
+            count = int(self._count[0])
+            if count == len(self._records):
+                self._map(count + GROW_RECORDS)
+            self._records[count] = (seconds, values, mask)
+            self._count[0] = count + 1
+            self._last = seconds
+        return True
+
+    def records(self, start: datetime = None, end: datetime = None) -> np.ndarray:
+        """
+        The snapshots taken from `start` (inclusive) until `end` (exclusive), or
+        since the first or until the last one if they are `None`, as a view of the file.
+        """
+        with self._lock:
+            records = self._records[:int(self._count[0])]
+        times = records["timestamp"]
+        low = 0 if start is None else bisect.bisect_left(times, start.timestamp())
+        high = len(records) if end is None else bisect.bisect_left(times, end.timestamp())
+        return records[low:max(low, high)]
+
+    def at(self, timestamp: datetime) -> np.void | None:
+        """The last snapshot taken at or before `timestamp`, or `None` if there is none."""
+        with self._lock:
+            records = self._records[:int(self._count[0])]
+        i = bisect.bisect_right(records["timestamp"], timestamp.timestamp())
+        return records[i - 1] if i else None
+
+    def last(self) -> np.void | None:
+        """The most recent snapshot, or `None` if there is none."""
+        with self._lock:
+            count = int(self._count[0])
+            return self._records[count - 1] if count else None
+
+    def flush(self):
+        """Write the recorded snapshots to the disk."""
+        with self._lock:
+            self._records.flush()
+            self._header.flush()
+
+
+def bought(records: np.ndarray) -> np.ndarray:
+    """Whether every good was bought, as an array of shape `(snapshots, GOOD_COUNT)`."""
+    return records["bought"][:, None] & _BITS != 0
+
+
+def timestamps(records: np.ndarray) -> np.ndarray:
+    """The times at which the snapshots were taken, as NumPy datetimes."""
+    return (records["timestamp"] * 1e6).astype("datetime64[us]")
+
+
+_HISTORY: History = None
+_FAILED = False
+
+
+def get_history() -> History | None:
+    """The history of the analyzer, or `None` if it is disabled or cannot be opened."""
+    global _HISTORY, _FAILED
+    if _HISTORY is None and conf.RECORD_HISTORY and not _FAILED:
+        try:
+            _HISTORY = History()
+        except (OSError, ValueError) as e:
+            _FAILED = True
+            log.error(f"Not recording the history of the values: {e}")
+    return _HISTORY
+
+
+def set_history(history: History | None):
+    """Record the values in `history` instead of the history of the analyzer."""
+    global _HISTORY
+    _HISTORY = history
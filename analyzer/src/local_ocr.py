@@ -0,0 +1,659 @@
+import functools
+import hashlib
+import os
+import re
+import threading
+import time
+import numpy as np
+from PIL import Image
+from analyze import SYMBOLS
+from logger import log
+
+GLYPHS_FILE = "glyphs.npz"
+
+# Glyphs are scaled so that a typical word is 3/4 of this many pixels high, and
+# compared on a canvas that is twice as wide, so that it fits two characters
+# that touch
+GLYPH_SIZE = 16
+GLYPH_WIDTH = 2 * GLYPH_SIZE
+GLYPH_PIXELS = GLYPH_SIZE * GLYPH_WIDTH
+
+# Two glyphs that differ in at most this fraction of their ink are the same glyph
+SAME_GLYPH = 0.1
+
+# Maximum number of words tried when matching server results to a screenshot
+_MAX_ALIGN_STEPS = 100000
+
+_VALUE = re.compile(r"^\$?(\d+\.\d\d)$")
+_STOCK = re.compile(r"^(\d+)/(\d+)$")
+
+# A slash, alone or touching a digit on either side
+_SLASH_LABELS = ["/"] + [f"{d}/" for d in range(10)] + [f"/{d}" for d in range(10)]
+
+# The glyphs are learned in one thread of the pipeline while another one reads them
+_LOCK = threading.Lock()
+
+
+def _locked(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _LOCK:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _threshold(gray: np.ndarray) -> float:
+    """The brightness that separates text from the darker background, by Otsu's method."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * np.arange(256))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mean[-1] * weight - mean * weight[-1]) ** 2 / (weight * (weight[-1] - weight))
+    return np.nanargmax(between[:-1])
+
+
+def _runs(mask: np.ndarray, min_gap: int = 1) -> list[tuple[int, int]]:
+    """The `(start, end)` of every run of `True`, joining runs with gaps below `min_gap`."""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    runs = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        if runs and start - runs[-1][1] < min_gap:
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+    return runs
+
+
+def _glyph_bitmap(glyph: np.ndarray, scale: float) -> np.ndarray:
+    """Crop a glyph to its ink and scale it onto the top left of the comparison canvas."""
+    rows = np.flatnonzero(glyph.any(axis=1))
+    glyph = glyph[rows[0]:rows[-1] + 1]
+    height, width = glyph.shape
+    size = (max(1, min(GLYPH_WIDTH, round(width * scale))),
+            max(1, min(GLYPH_SIZE, round(height * scale))))
+    scaled = Image.fromarray(glyph.astype(np.uint8) * 255).resize(size, Image.BILINEAR)
+    canvas = np.zeros((GLYPH_SIZE, GLYPH_WIDTH), dtype=bool)
+    canvas[:size[1], :size[0]] = np.asarray(scaled) >= 128
+    return canvas.ravel()
+
+
+def _word_boxes(ink: np.ndarray) -> list[tuple[int, int, int, int]]:
+    """
+    Find the words in reading order, by recursively cutting the image along empty
+    rows and columns.
+    Returns the `(top, left, bottom, right)` box of every word.
+    """
+    boxes = []
+
+    def cut(top: int, left: int, region: np.ndarray):
+        bands = _runs(region.any(axis=1))
+        if len(bands) > 1:
+            for a, b in bands:
+                cut(top + a, left, region[a:b])
+            return
+        a, b = bands[0]
+        band = region[a:b]
+        height = b - a
+        # Gaps between words are wider than gaps between the glyphs of a word
+        chunks = _runs(band.any(axis=0), min_gap=max(2, round(height * 0.6)))
+        if len(chunks) > 1:
+            for c, d in chunks:
+                cut(top + a, left + c, band[:, c:d])
+            return
+        if height >= 4:
+            c, d = chunks[0]
+            boxes.append((top + a, left + c, top + b, left + d))
+
+    if ink.any():
+        cut(0, 0, ink)
+    return boxes
+
+
+def _text_height(boxes: list[tuple[int, int, int, int]]) -> float:
+    return float(np.median([bottom - top for top, _, bottom, _ in boxes]))
+
+
+def _word_glyphs(ink: np.ndarray, box: tuple[int, int, int, int], scale: float) -> np.ndarray:
+    """The glyphs of a word, as an array of shape `(glyphs, GLYPH_PIXELS)`."""
+    top, left, bottom, right = box
+    word = ink[top:bottom, left:right]
+    return np.stack([_glyph_bitmap(word[:, a:b], scale) for a, b in _runs(word.any(axis=0))])
+
+
+def text_height(image: Image.Image) -> float | None:
+    """The typical height of the words in an image in pixels, or `None` if it has no text."""
+    gray = np.asarray(image.convert("RGB")).max(axis=2)
+    boxes = _word_boxes(gray > _threshold(gray))
+    return _text_height(boxes) if boxes else None
+
+
+def text_box(image: Image.Image) -> tuple[int, int, int, int] | None:
+    """The `(top, left, bottom, right)` box around all text, or `None` if there is none."""
+    gray = np.asarray(image.convert("RGB")).max(axis=2)
+    boxes = np.array(_word_boxes(gray > _threshold(gray)))
+    if not len(boxes):
+        return None
+    return (int(boxes[:, 0].min()), int(boxes[:, 1].min()),
+            int(boxes[:, 2].max()), int(boxes[:, 3].max()))
+
+
+def segment(image: Image.Image) -> list[np.ndarray]:
+    """
+    Split the text into words in reading order, and the words into glyphs.
+
+    Glyphs are separated by empty columns. Anti-aliased characters can touch, so a
+    glyph may also be two characters. All glyphs are scaled alike, so the same
+    character looks the same in every word.
+
+    Returns:
+        The glyphs of every word, as an array of shape `(glyphs, GLYPH_PIXELS)`.
+    """
+    gray = np.asarray(image.convert("RGB")).max(axis=2)
+    ink = gray > _threshold(gray)
+    boxes = _word_boxes(ink)
+    if not boxes:
+        return []
+    scale = GLYPH_SIZE * 0.75 / _text_height(boxes)
+    return [_word_glyphs(ink, box, scale) for box in boxes]
+
+
+class GlyphLibrary:
+    """Bitmaps of known glyphs and the one or two characters they stand for."""
+
+    def __init__(self, bitmaps: np.ndarray = None, chars: list[str] = None):
+        self.bitmaps = np.zeros((0, GLYPH_PIXELS), dtype=bool) if bitmaps is None else bitmaps
+        self.chars = chars or []
+
+    @classmethod
+    def load(cls, path: str = GLYPHS_FILE) -> "GlyphLibrary":
+        try:
+            with np.load(path) as data:
+                bitmaps = np.unpackbits(data["bitmaps"], axis=1, count=GLYPH_PIXELS)
+                return cls(bitmaps.astype(bool), list(data["chars"]))
+        except FileNotFoundError:
+            return cls()
+        except Exception as e:
+            log.warn(f"Ignoring unreadable glyph library {path}: {e}")
+            return cls()
+
+    def save(self, path: str = GLYPHS_FILE):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, bitmaps=np.packbits(self.bitmaps, axis=1), chars=np.array(self.chars))
+        os.replace(tmp_path, path)
+
+    def match(self, glyphs: np.ndarray) -> tuple[list[str], np.ndarray]:
+        """
+        Find the closest known glyph for every glyph.
+        Returns the characters of every glyph and the fraction of its ink that
+        matches.
+        """
+        if not self.chars:
+            return ["?"] * len(glyphs), np.zeros(len(glyphs))
+        distances = _distances(glyphs, self.bitmaps)
+        best = distances.argmin(axis=1)
+        return [self.chars[i] for i in best], 1 - distances[np.arange(len(glyphs)), best]
+
+    def add(self, bitmap: np.ndarray, char: str) -> bool:
+        """Add a glyph unless the same glyph is already known. Returns whether it was added."""
+        if self.chars and _distances(bitmap[None], self.bitmaps).min() <= SAME_GLYPH:
+            return False
+        self.bitmaps = np.vstack([self.bitmaps, bitmap])
+        self.chars.append(char)
+        return True
+
+
+def _distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    The fraction of the ink of two glyphs that is not shared, between every glyph
+    of `a` and every glyph of `b`.
+    """
+    a, b = a.astype(np.float32), b.astype(np.float32)
+    shared = a @ b.T
+    union = a.sum(axis=1)[:, None] + b.sum(axis=1)[None, :] - shared
+    return 1 - shared / np.maximum(union, 1)
+
+
+def _read(words: list[np.ndarray], library: GlyphLibrary
+          ) -> list[tuple[str, dict, float, list[int]]]:
+    """
+    Read the goods shown by the words.
+
+    Every good is expected to show its symbol followed by its value (for example
+    `$12.34`), and its stock (for example `0/110`), with the goods and the stocks
+    in the same order.
+
+    Returns:
+        For every good that was read, its symbol, a dict with 'value' and 'bought'
+        keys like the results of the server, the lowest confidence of its glyphs,
+        and the indices of its words.
+    """
+    chars, confidence = library.match(np.concatenate(words))
+
+    # Every symbol is followed by its value, but the stocks can be on another line
+    values, stocks = [], []
+    symbol = None
+    i = 0
+    for k, word in enumerate(words):
+        text = "".join(chars[i:i + len(word)])
+        word_confidence = float(confidence[i:i + len(word)].min())
+        i += len(word)
+        if text in SYMBOLS:
+            symbol, lowest, first = text, word_confidence, k
+        elif symbol is not None and (m := _VALUE.match(text)):
+            values.append((symbol, float(m.group(1)), min(lowest, word_confidence), [first, k]))
+            symbol = None
+        elif m := _STOCK.match(text):
+            stocks.append((int(m.group(1)), word_confidence, k))
+
+    if len(stocks) != len(values):
+        return []
+    return [(symbol, {"value": value, "bought": stock > 0}, min(lowest, stock_confidence),
+             indices + [k])
+            for (symbol, value, lowest, indices), (stock, stock_confidence, k)
+            in zip(values, stocks)]
+
+
+def _digest(pixels: np.ndarray) -> bytes:
+    return hashlib.blake2b(pixels.tobytes(), digest_size=16).digest()
+
+
+class CellCache:
+    """
+    The last good read from every cell of the stock market, so that only the cells
+    whose pixels changed are read again.
+
+    A cell is the area around the symbol, value and stock of a good, as found by
+    the last read of the whole stock market. It is read with the same threshold
+    and scale as that read.
+    """
+
+    def __init__(self):
+        self.shape = None
+        self.threshold = self.scale = None
+        # Box, digest of the pixels and good of every symbol
+        self.cells: dict[str, tuple[tuple[int, int, int, int], bytes, dict]] = {}
+
+    def clear(self):
+        self.shape = None
+        self.cells = {}
+
+    def update(self, pixels: np.ndarray, threshold: float, scale: float,
+               boxes: dict[str, tuple[int, int, int, int]], goods: dict):
+        """Start over with the cells in `boxes` of a stock market that was read completely."""
+        self.shape, self.threshold, self.scale = pixels.shape, threshold, scale
+        self.cells = {}
+        for symbol, box in boxes.items():
+            top, left, bottom, right = box
+            self.cells[symbol] = (box, _digest(pixels[top:bottom, left:right]), goods[symbol])
+
+    def recognize(self, pixels: np.ndarray, library: GlyphLibrary, min_confidence: float
+                  ) -> tuple[dict, int] | None:
+        """
+        Read the goods of the cells that changed, and reuse the others.
+        Returns the goods and the number of cells that were read, or `None` if the
+        cells are unknown or a cell could not be read.
+        """
+        if pixels.shape != self.shape or not self.cells:
+            return None
+        goods, changed = {}, {}
+        for symbol, (box, digest, good) in self.cells.items():
+            top, left, bottom, right = box
+            cell = pixels[top:bottom, left:right]
+            new_digest = _digest(cell)
+            if new_digest == digest:
+                goods[symbol] = good
+                continue
+            ink = cell.max(axis=2) > self.threshold
+            # Text that runs into the edge has moved, so the cells have to be found again
+            if ink[0].any() or ink[-1].any() or ink[:, 0].any() or ink[:, -1].any():
+                return None
+            words = [_word_glyphs(ink, word, self.scale) for word in _word_boxes(ink)]
+            read = _read(words, library) if words else []
+            if len(read) != 1 or read[0][0] != symbol or read[0][2] < min_confidence:
+                return None
+            goods[symbol] = read[0][1]
+            changed[symbol] = (box, new_digest, read[0][1])
+        self.cells.update(changed)
+        return goods, len(changed)
+
+    def split(self, pixels: np.ndarray
+              ) -> tuple[dict, dict[str, tuple[int, int, int, int]]] | None:
+        """
+        Split the cells into those whose pixels did not change and those that did.
+        Returns the goods of the first and the boxes of the second, or `None` if the
+        cells are unknown or text runs into the edge of a changed cell.
+        """
+        if pixels.shape != self.shape or not self.cells:
+            return None
+        goods, boxes = {}, {}
+        for symbol, (box, digest, good) in self.cells.items():
+            top, left, bottom, right = box
+            cell = pixels[top:bottom, left:right]
+            if _digest(cell) == digest:
+                goods[symbol] = good
+                continue
+            ink = cell.max(axis=2) > self.threshold
+            if ink[0].any() or ink[-1].any() or ink[:, 0].any() or ink[:, -1].any():
+                return None
+            boxes[symbol] = box
+        return goods, boxes
+
+    def refresh(self, pixels: np.ndarray, goods: dict):
+        """Remember the goods that were read elsewhere for the cells that changed."""
+        if pixels.shape != self.shape:
+            return
+        for symbol, (box, digest, good) in self.cells.items():
+            top, left, bottom, right = box
+            new_digest = _digest(pixels[top:bottom, left:right])
+            if new_digest != digest and symbol in goods:
+                self.cells[symbol] = (box, new_digest, goods[symbol])
+
+
+@_locked
+def recognize(image: Image.Image, min_confidence: float) -> dict | None:
+    """
+    Read the values of all goods from a screenshot of the stock market.
+
+    Only the cells of goods whose pixels changed since the last screenshot are read
+    again, unless the layout changed.
+
+    Returns:
+        Map keyed by symbol to a dict with 'value' and 'bought' keys, like the
+        results of the server, or `None` if not all goods could be read with at
+        least `min_confidence`.
+    """
+    start = time.perf_counter()
+    library = get_library()
+    if not library.chars:
+        return None
+    pixels = np.asarray(image.convert("RGB"))
+    cached = _CELLS.recognize(pixels, library, min_confidence)
+    if cached is not None:
+        goods, changed = cached
+        elapsed = (time.perf_counter() - start) * 1000
+        log.debug(f"Local OCR read {changed} changed of {len(goods)} goods in {elapsed:.1f}ms")
+        return goods
+
+    gray = pixels.max(axis=2)
+    threshold = _threshold(gray)
+    ink = gray > threshold
+    boxes = _word_boxes(ink)
+    read = []
+    if boxes:
+        height = _text_height(boxes)
+        scale = GLYPH_SIZE * 0.75 / height
+        read = _read([_word_glyphs(ink, box, scale) for box in boxes], library)
+    goods = {symbol: good for symbol, good, confidence, _ in read
+             if confidence >= min_confidence}
+
+    elapsed = (time.perf_counter() - start) * 1000
+    if len(goods) < len(SYMBOLS):
+        _CELLS.clear()
+        log.debug(f"Local OCR read {len(goods)} of {len(SYMBOLS)} goods in {elapsed:.1f}ms")
+        return None
+    # The cell of a good is the box around its words, with some room for the words
+    # to change without running into its edge
+    pad = max(1, round(height * 0.3))
+    cells = {}
+    for symbol, _, _, indices in read:
+        top, left, bottom, right = np.array([boxes[k] for k in indices]).T
+        cells[symbol] = (max(top.min() - pad, 0), max(left.min() - pad, 0),
+                         min(bottom.max() + pad, gray.shape[0]),
+                         min(right.max() + pad, gray.shape[1]))
+    _CELLS.update(pixels, threshold, scale, cells, goods)
+    log.debug(f"Local OCR read all goods in {elapsed:.1f}ms")
+    return goods
+
+
+@_locked
+def mask_unchanged(image: Image.Image) -> tuple[Image.Image, dict] | None:
+    """
+    Hide the goods whose pixels did not change since they were read, so that the
+    server only has to read the others.
+
+    Returns:
+        The part of the screenshot around the cells that changed, with the cells
+        that did not change painted over with their background, and the goods of
+        the cells that did not change. `None` if the cells are unknown, or all or
+        none of them changed.
+    """
+    pixels = np.asarray(image.convert("RGB"))
+    split = _CELLS.split(pixels)
+    if split is None or not split[0] or not split[1]:
+        return None
+    goods, boxes = split
+    top, left, bottom, right = np.array(list(boxes.values())).T
+    top, left, bottom, right = top.min(), left.min(), bottom.max(), right.max()
+    masked = pixels.copy()
+    for symbol in goods:
+        t, l, b, r = _CELLS.cells[symbol][0]
+        # The edges of a cell are background
+        masked[t:b, l:r] = pixels[t, l]
+    # Cells may overlap where they are padded
+    for t, l, b, r in boxes.values():
+        masked[t:b, l:r] = pixels[t:b, l:r]
+    log.debug(f"Sending {len(boxes)} changed of {len(goods) + len(boxes)} goods to the server")
+    return Image.fromarray(masked[top:bottom, left:right]), goods
+
+
+@_locked
+def refresh_cells(image: Image.Image, goods: dict):
+    """Remember the goods that the server read for the cells that changed."""
+    _CELLS.refresh(np.asarray(image.convert("RGB")), goods)
+
+
+def _clusters(words: list[np.ndarray]) -> tuple[list[tuple[int, ...]], np.ndarray]:
+    """
+    Give every distinct glyph an ID.
+    Returns the words as sequences of IDs, and the bitmap of every ID.
+    """
+    glyphs = np.concatenate(words)
+    ids = np.empty(len(glyphs), dtype=np.intp)
+    representatives = []
+    for i, glyph in enumerate(glyphs):
+        if representatives:
+            distances = _distances(glyph[None], glyphs[representatives])[0]
+            j = distances.argmin()
+            if distances[j] <= SAME_GLYPH:
+                ids[i] = j
+                continue
+        ids[i] = len(representatives)
+        representatives.append(i)
+    result, i = [], 0
+    for word in words:
+        result.append(tuple(ids[i:i + len(word)]))
+        i += len(word)
+    return result, glyphs[representatives]
+
+
+def _align(words: list[tuple], expected: list[list[str]]
+           ) -> tuple[dict[int, str], list[int]] | None:
+    """
+    Find the words that show the expected texts, in order, so that every glyph
+    always stands for the same character.
+
+    Args:
+        words: The words as sequences of glyph IDs.
+        expected: For every text, the ways it can be written.
+    Returns:
+        The characters of every matched glyph ID and the index of the word of every
+        text, or `None` if there is no match.
+    """
+    steps = 0
+
+    def assign(word: tuple, text: str, mapping: dict) -> dict | None:
+        # Every glyph is one or two characters
+        if not len(word) <= len(text) <= 2 * len(word):
+            return None
+        if not word:
+            return mapping
+        glyph = word[0]
+        labels = [mapping[glyph]] if glyph in mapping else [text[:1], text[:2]]
+        for label in labels:
+            if text.startswith(label) and label:
+                new = assign(word[1:], text[len(label):], {**mapping, glyph: label})
+                if new is not None:
+                    return new
+        return None
+
+    def search(k: int, start: int, mapping: dict) -> tuple[dict, list[int]] | None:
+        nonlocal steps
+        if k == len(expected):
+            return mapping, []
+        for i in range(start, len(words)):
+            steps += 1
+            if steps > _MAX_ALIGN_STEPS:
+                return None
+            for text in expected[k]:
+                new = assign(words[i], text, mapping)
+                if new is not None and (result := search(k + 1, i + 1, new)) is not None:
+                    return result[0], [i] + result[1]
+        return None
+
+    return search(0, 0, {})
+
+
+def _extent(bitmap: np.ndarray) -> tuple[int, int]:
+    """The width and height of the ink of a glyph."""
+    glyph = bitmap.reshape(GLYPH_SIZE, GLYPH_WIDTH)
+    columns, rows = np.flatnonzero(glyph.any(axis=0)), np.flatnonzero(glyph.any(axis=1))
+    return (columns[-1] + 1, rows[-1] + 1) if len(columns) else (0, 0)
+
+
+def _shift(bitmap: np.ndarray, x: int, y: int = 0) -> np.ndarray:
+    """Move a glyph `x` pixels to the right and `y` pixels down (or back if negative)."""
+    glyph = bitmap.reshape(GLYPH_SIZE, GLYPH_WIDTH)
+    canvas = np.zeros_like(glyph)
+    height, width = GLYPH_SIZE - abs(y), GLYPH_WIDTH - abs(x)
+    canvas[max(y, 0):max(y, 0) + height, max(x, 0):max(x, 0) + width] = \
+        glyph[max(-y, 0):max(-y, 0) + height, max(-x, 0):max(-x, 0) + width]
+    return canvas.ravel()
+
+
+def _draw(label: str, known: dict[str, np.ndarray], gap: int) -> np.ndarray:
+    """
+    Draw the known glyphs of the characters of `label` next to each other, `gap`
+    pixels apart and on the same baseline.
+    """
+    extents = [_extent(known[char]) for char in label]
+    bottom = max(height for _, height in extents)
+    canvas = np.zeros(GLYPH_PIXELS, dtype=bool)
+    x = 0
+    for char, (width, height) in zip(label, extents):
+        canvas |= _shift(known[char], min(x, GLYPH_WIDTH), bottom - height)
+        x += width + gap
+    return canvas
+
+
+def _split_off(bitmap: np.ndarray, char: np.ndarray) -> np.ndarray:
+    """The rest of a glyph of two characters whose first character is `char`."""
+    width = _extent(char)[0]
+    rest = _shift(bitmap, -width)
+    rows = np.flatnonzero(rest.reshape(GLYPH_SIZE, GLYPH_WIDTH).any(axis=1))
+    return _shift(rest, 0, -rows[0]) if len(rows) else rest
+
+
+def _learn_stocks(ids: list[tuple], representatives: np.ndarray, mapping: dict[int, str],
+                  matched: list[int], goods: dict, library: GlyphLibrary):
+    """
+    Learn the glyphs of the stocks, which the server does not read.
+
+    A stock of 0 (not bought) is shown as "0/..." with a maximum made of known
+    digits, which teaches the slash. After that, a slash that touches a digit is
+    recognized by drawing both glyphs side by side.
+    """
+    stocks = []
+    for k, word in enumerate(ids):
+        text = "".join(mapping.get(glyph, "?") for glyph in word)
+        if k not in matched and all(c in "?/" or c.isdigit() for c in text):
+            stocks.append(word)
+    # The stocks are in the same order as the goods, so if all are found, it is
+    # known which of them are 0
+    bought = [goods[symbol]["bought"] for symbol in SYMBOLS if symbol in goods]
+    if len(bought) != len(stocks):
+        bought = [None] * len(stocks)
+
+    unknown_stocks = []
+    for word, is_bought in zip(stocks, bought):
+        unknown = [i for i, glyph in enumerate(word) if glyph not in mapping]
+        if len(unknown) != 1:
+            continue
+        i = unknown[0]
+        head = "".join(mapping[glyph] for glyph in word[:i])
+        tail = "".join(mapping[glyph] for glyph in word[i + 1:])
+        if head and not head.isdigit():
+            continue
+        if is_bought is False and head in ("", "0") and len(tail) >= 2 and tail.isdigit():
+            mapping[word[i]] = "0/"[len(head):]
+        else:
+            unknown_stocks.append((word[i], head, tail, is_bought))
+
+    known = {char: library.bitmaps[i] for i, char in enumerate(library.chars)}
+    known.update((char, representatives[glyph]) for glyph, char in mapping.items())
+    if "/" not in known and "0/" in known and "0" in known:
+        known["/"] = _split_off(known["0/"], known["0"])
+    for glyph, head, tail, is_bought in unknown_stocks:
+        if glyph in mapping or "/" not in known:
+            continue
+        labels = [label for label in _SLASH_LABELS
+                  if (m := _STOCK.match(head + label + tail))
+                  and is_bought in (None, int(m.group(1)) > 0)
+                  and all(c in known for c in label)]
+        # Characters that touch can be drawn closer together than usual
+        distances = [_distances(representatives[glyph][None],
+                                np.stack([_draw(label, known, gap) for gap in range(-2, 2)])).min()
+                     for label in labels]
+        # Drawn glyphs only roughly look like real ones, so the best label must be
+        # close and clearly better than the others
+        order = np.argsort(distances)
+        if len(order) and distances[order[0]] <= 3 * SAME_GLYPH \
+                and (len(order) == 1 or distances[order[1]] >= 1.5 * distances[order[0]]):
+            mapping[glyph] = labels[order[0]]
+
+
+@_locked
+def learn(image: Image.Image, goods: dict):
+    """
+    Learn the glyphs of the font from a screenshot and the goods that the server
+    read from it, by finding the words that show their symbols and values.
+    """
+    words = segment(image)
+    if not words:
+        return
+    ids, representatives = _clusters(words)
+    expected = []
+    for symbol in SYMBOLS:
+        if symbol in goods:
+            value = f"{goods[symbol]['value']:.2f}"
+            expected += [[symbol], ["$" + value, value]]
+    aligned = _align(ids, expected)
+    if aligned is None:
+        log.debug("Could not match the server results to the screenshot")
+        return
+    mapping, matched = aligned
+
+    # Glyphs that are not part of a symbol or value may already be known
+    library = get_library()
+    if library.chars:
+        chars, confidence = library.match(representatives)
+        for glyph in range(len(representatives)):
+            if glyph not in mapping and confidence[glyph] >= 1 - SAME_GLYPH:
+                mapping[glyph] = chars[glyph]
+
+    _learn_stocks(ids, representatives, mapping, matched, goods, library)
+    added = sum(library.add(representatives[glyph], char) for glyph, char in mapping.items())
+    if added:
+        library.save()
+        log.info(f"Learned {added} new glyphs for local OCR ({len(library.chars)} known)")
+
+
+def get_library() -> GlyphLibrary:
+    global _LIBRARY
+    if _LIBRARY is None:
+        _LIBRARY = GlyphLibrary.load()
+    return _LIBRARY
+
+
+_LIBRARY: GlyphLibrary = None
+_CELLS = CellCache()
@@ -0,0 +1,181 @@
+import numpy as np
+from PIL import Image
+import local_ocr
+from logger import log
+from metrics import metrics
+from select_server.bounds import Bounds
+
+# Minimum normalized cross-correlation between the panel and a part of the screen
+# for the panel to be found there
+MIN_SCORE = 0.7
+
+# Pixels around the text of the panel that are kept in its bounds
+TEXT_MARGIN = 4
+
+# The screen is scaled down by this factor for a search of the whole screen
+SEARCH_SCALE = 4
+
+
+def _gray(image: Image.Image | np.ndarray) -> np.ndarray:
+    """
+    The brightness of an image or of an RGB array of shape `(height, width, 3)`,
+    computed like PIL converts to grayscale.
+    """
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert("L"), dtype=np.float64)
+    rgb = image.astype(np.uint32)
+    return ((rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000)
+            >> 16).astype(np.float64)
+
+
+def _crop(image: Image.Image | np.ndarray, x: int, y: int, width: int,
+          height: int) -> Image.Image | np.ndarray:
+    """A part of an image, or a view of a part of an RGB array."""
+    if isinstance(image, Image.Image):
+        return image.crop((x, y, x + width, y + height))
+    return image[y:y + height, x:x + width]
+
+
+def _to_image(image: Image.Image | np.ndarray) -> Image.Image:
+    """An image with the pixels of an RGB array, or the image itself."""
+    if isinstance(image, Image.Image):
+        return image
+    return Image.fromarray(np.ascontiguousarray(image), "RGB")
+
+
+def score(patch: np.ndarray, template: np.ndarray) -> float:
+    """The normalized cross-correlation between a grayscale patch and template of the same size."""
+    p, t = patch - patch.mean(), template - template.mean()
+    norm = np.sqrt((p * p).sum() * (t * t).sum())
+    return float((p * t).sum() / norm) if norm > 0 else -1.0
+
+
+def match(frame: np.ndarray, template: np.ndarray) -> tuple[float, int, int]:
+    """
+    Find the position in a grayscale frame that looks most like a grayscale
+    template, by normalized cross-correlation.
+    Returns the score between -1 and 1 and the x and y of the top left corner.
+    """
+    fh, fw = frame.shape
+    th, tw = template.shape
+    if th > fh or tw > fw:
+        return -1.0, 0, 0
+    t = template - template.mean()
+    t_norm = np.sqrt((t * t).sum())
+    if t_norm == 0:
+        return -1.0, 0, 0
+    # As the template has a mean of 0, this is the covariance (times the size) at
+    # every position
+    corr = np.fft.irfft2(np.fft.rfft2(frame) * np.conj(np.fft.rfft2(t, s=frame.shape)),
+                         s=frame.shape)[:fh - th + 1, :fw - tw + 1]
+
+    def window_sums(a: np.ndarray) -> np.ndarray:
+        s = np.zeros((fh + 1, fw + 1))
+        s[1:, 1:] = a.cumsum(axis=0).cumsum(axis=1)
+        return s[th:, tw:] - s[:-th, tw:] - s[th:, :-tw] + s[:-th, :-tw]
+
+    sums = window_sums(frame)
+    variance = window_sums(frame * frame) - sums * sums / (th * tw)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.where(variance > 1e-6, corr / (np.sqrt(np.maximum(variance, 0)) * t_norm), 0)
+    y, x = np.unravel_index(np.argmax(scores), scores.shape)
+    return float(scores[y, x]), int(x), int(y)
+
+
+class PanelTracker:
+    """
+    Follows the stock market panel on the screen, so that its bounds stay tight
+    around it when the window moves.
+
+    The panel is first looked for in the bounds that were selected by hand, and
+    cropped to its text. Every screenshot then only needs to grab a window of
+    `margin` pixels around the last bounds, in which the panel is matched against
+    the last screenshot of it. Only if it is not found there, the whole screen is
+    searched.
+    """
+
+    def __init__(self, bounds: Bounds, margin: int, screen_size: tuple[int, int]):
+        self.bounds = bounds
+        self.margin = margin
+        self.screen_size = screen_size
+        self.template: np.ndarray = None
+
+    def start(self, image: Image.Image) -> Image.Image:
+        """Tighten the bounds around the text in the image of the selected bounds."""
+        box = local_ocr.text_box(image)
+        if box is not None:
+            top, left, bottom, right = box
+            left, top = max(left - TEXT_MARGIN, 0), max(top - TEXT_MARGIN, 0)
+            right = min(right + TEXT_MARGIN, image.width)
+            bottom = min(bottom + TEXT_MARGIN, image.height)
+            image = image.crop((left, top, right, bottom))
+            self.bounds = Bounds(self.bounds.x + left, self.bounds.y + top,
+                                 right - left, bottom - top)
+            log.info(f"Tightened the bounds to {self.bounds.width}x{self.bounds.height} "
+                     f"at ({self.bounds.x}, {self.bounds.y})")
+        self.template = _gray(image)
+        return image
+
+    def search_window(self) -> Bounds:
+        """The bounds around the last position of the panel that are searched first."""
+        width, height = self.screen_size
+        left = max(self.bounds.x - self.margin, 0)
+        top = max(self.bounds.y - self.margin, 0)
+        right = min(self.bounds.x + self.bounds.width + self.margin, width)
+        bottom = min(self.bounds.y + self.bounds.height + self.margin, height)
+        return Bounds(left, top, right - left, bottom - top)
+
+    def verify(self, image: Image.Image | np.ndarray, window: Bounds) -> Image.Image | None:
+        """
+        Find the panel in the image of the search window, which may also be a view
+        of an RGB array that the capture overwrites later. Only the pixels of the
+        panel are copied.
+        Returns the image of the panel, or `None` if it is not there.
+        """
+        # Usually the panel has not moved at all, so only its pixels are needed
+        x, y = self.bounds.x - window.x, self.bounds.y - window.y
+        height, width = self.template.shape
+        if score(_gray(_crop(image, x, y, width, height)), self.template) >= MIN_SCORE:
+            return self._found(image, window, x, y)
+        best, x, y = match(_gray(image), self.template)
+        if best < MIN_SCORE:
+            log.debug(f"Stock market panel not near its last position (score {best:.2f})")
+            return None
+        return self._found(image, window, x, y)
+
+    def search(self, screen: Image.Image) -> Image.Image | None:
+        """
+        Find the panel on a screenshot of the whole screen, first on a scaled down
+        screenshot and then around the best position at full size.
+        Returns the image of the panel, or `None` if it is not on the screen.
+        """
+        metrics.increment("panel_searches")
+        self.screen_size = screen.size
+        small = (max(1, screen.width // SEARCH_SCALE), max(1, screen.height // SEARCH_SCALE))
+        template = Image.fromarray(self.template.astype(np.uint8))
+        small_template = template.resize(
+            (max(1, template.width // SEARCH_SCALE), max(1, template.height // SEARCH_SCALE)),
+            Image.BILINEAR)
+        best, x, y = match(_gray(screen.resize(small, Image.BILINEAR)), _gray(small_template))
+        if best < MIN_SCORE:
+            log.warn(f"Stock market panel not found on the screen (score {best:.2f})")
+            return None
+        self.bounds = Bounds(x * SEARCH_SCALE, y * SEARCH_SCALE,
+                             self.bounds.width, self.bounds.height)
+        margin, self.margin = self.margin, 2 * SEARCH_SCALE
+        window = self.search_window()
+        self.margin = margin
+        return self.verify(screen.crop((window.x, window.y, window.x + window.width,
+                                        window.y + window.height)), window)
+
+    def _found(self, image: Image.Image | np.ndarray, window: Bounds, x: int,
+               y: int) -> Image.Image:
+        width, height = self.bounds.width, self.bounds.height
+        moved = (window.x + x, window.y + y) != (self.bounds.x, self.bounds.y)
+        self.bounds = Bounds(window.x + x, window.y + y, width, height)
+        if moved:
+            log.info(f"Stock market panel moved to ({self.bounds.x}, {self.bounds.y})")
+        panel = _to_image(_crop(image, x, y, width, height))
+        # Follow the changes of the values
+        self.template = _gray(panel)
+        return panel
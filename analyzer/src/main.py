@@ -4,27 +4,265 @@ if err:
     print(f"Error loading config: {err}")
     exit(1)
 
+import argparse  # noqa: E402
+import os  # noqa: E402
+import tempfile  # noqa: E402
+from datetime import datetime  # noqa: E402
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+import backtest  # noqa: E402
+import encode  # noqa: E402
 import ocr  # noqa: E402
+import optimize  # noqa: E402
+import pipeline  # noqa: E402
+import replay  # noqa: E402
+import scheduler  # noqa: E402
 import screenshot  # noqa: E402
+import thresholds  # noqa: E402
+from analyze import load_thresholds  # noqa: E402
 from logger import log  # noqa: E402
+from metrics import metrics  # noqa: E402
+from outbox import get_outbox  # noqa: E402
 from select_server import run_server, Bounds  # noqa: E402
-from simulation.simulation import init_sim_data  # noqa: E402
+from simulation.cache import cache_key  # noqa: E402
+from simulation.forecast import init_forecaster  # noqa: E402
+from simulation.simulation import (  # noqa: E402
+    get_conditional_table, get_distribution, init_sim_data, sim_settings, start_sim_data,
+    stop_sim_data)
 from config import conf  # noqa: E402
 
 
+def screenshot_ticks() -> int:
+    """Number of ticks between two screenshots taken every `checkInterval` seconds."""
+    return max(1, round(conf.CHECK_INTERVAL / 60))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="CCSW analyzer")
+    commands = parser.add_subparsers(dest="command")
+    backtest_parser = commands.add_parser(
+        "backtest", help="Measure how the buy and sell quantiles would have performed")
+    backtest_parser.add_argument(
+        "--buy", type=float, default=conf.BUY_QUARTILE, help="Buy quantile to test")
+    backtest_parser.add_argument(
+        "--sell", type=float, default=conf.SELL_QUARTILE, help="Sell quantile to test")
+    backtest_parser.add_argument(
+        "--csv", help="Replay values recorded in a CSV file with one column per symbol "
+        "and a timestamp column (needed to hold goods back) instead of simulated values")
+    backtest_parser.add_argument(
+        "--history", action="store_true",
+        help="Replay the values recorded by the analyzer instead of simulated values")
+    backtest_parser.add_argument(
+        "--since", type=datetime.fromisoformat,
+        help="With --history, only replay the values recorded since this ISO 8601 date")
+    backtest_parser.add_argument(
+        "--years", type=float, default=1.0, help="In-game years of values to simulate")
+    backtest_parser.add_argument(
+        "--replicas", type=int, default=64, help="Number of markets to simulate at once")
+    backtest_parser.add_argument(
+        "--step", type=int, default=screenshot_ticks(),
+        help="Ticks between two simulated screenshots (default: checkInterval)")
+    backtest_parser.add_argument(
+        "--delay", type=int, default=1,
+        help="Number of screenshots after which the user follows an action")
+    backtest_parser.add_argument(
+        "--overhead", type=float, default=0.2,
+        help="Stock market overhead paid on top of the value when buying "
+        "(0.2, reduced by 5%% per broker)")
+    backtest_parser.add_argument(
+        "--no-hold-back", action="store_true",
+        help="Act as soon as a good is past its threshold, instead of waiting while it is "
+        "likely to keep moving in our favor like the analyzer (conditionalHorizon)")
+    backtest_parser.add_argument("--seed", type=int, help="Seed of the simulation")
+
+    optimize_parser = commands.add_parser(
+        "optimize", help="Find the best buy and sell quantiles for every good")
+    optimize_parser.add_argument(
+        "--years", type=float, default=4.0, help="In-game years of values to simulate")
+    optimize_parser.add_argument(
+        "--replicas", type=int, default=64, help="Number of markets to simulate at once")
+    optimize_parser.add_argument(
+        "--shards", type=int, default=os.cpu_count() or 1,
+        help="Number of processes the search is split into")
+    optimize_parser.add_argument(
+        "--step", type=int, default=screenshot_ticks(),
+        help="Ticks between two simulated screenshots (default: checkInterval)")
+    optimize_parser.add_argument(
+        "--delay", type=int, default=1,
+        help="Number of screenshots after which the user follows an action")
+    optimize_parser.add_argument(
+        "--grid-step", type=float, default=0.05, help="Spacing of the searched quantiles")
+    optimize_parser.add_argument(
+        "--overhead", type=float, default=0.2,
+        help="Stock market overhead paid on top of the value when buying "
+        "(0.2, reduced by 5%% per broker)")
+    optimize_parser.add_argument(
+        "--no-hold-back", action="store_true",
+        help="Optimize for acting as soon as a good is past its threshold, instead of "
+        "waiting while it is likely to keep moving in our favor like the analyzer")
+    optimize_parser.add_argument("--seed", type=int, help="Seed of the simulation")
+
+    encoding_parser = commands.add_parser(
+        "encoding", help="Compare the size and speed of the ways to send screenshots")
+    encoding_parser.add_argument(
+        "--image", default="../test.png",
+        help="Cropped screenshot of the stock market to encode (default: analyzer/test.png)")
+    encoding_parser.add_argument(
+        "--frames", type=int, default=20, help="Number of times every variant is measured")
+
+    replay_parser = commands.add_parser(
+        "replay", help="Process recorded screenshots as fast as possible and measure every stage")
+    replay_parser.add_argument(
+        "path", help="Directory or zip or tar archive of screenshots, named by the time they "
+        "were taken (seconds since the epoch or ISO 8601) or else ordered by modification time")
+    replay_parser.add_argument(
+        "--bounds", help="x,y,width,height of the stock market on the screenshots, "
+        "if they show the whole screen")
+    replay_parser.add_argument(
+        "--output", help="Directory for the outbox and history of the replay, which are kept "
+        "apart from those of the analyzer (default: a new temporary directory)")
+    replay_parser.add_argument(
+        "--upload", action="store_true",
+        help="Upload the values to the configured instance, as a stream of their own. "
+        "This stores them in its history and may send notifications")
+    replay_parser.add_argument(
+        "--speed", type=float, default=0,
+        help="Replay this many times faster than the screenshots were taken "
+        "(default: as fast as possible)")
+    return parser.parse_args()
+
+
+def run_backtest(args: argparse.Namespace):
+    """Backtest quantiles on simulated or recorded values."""
+    if not init_sim_data():
+        return
+    if args.csv:
+        try:
+            values, ticks = backtest.load_values(args.csv)
+        except (OSError, ValueError) as e:
+            log.error(f"Could not read {args.csv}: {e}")
+            return
+    elif args.history:
+        try:
+            values, ticks = backtest.load_history(args.since)
+        except (OSError, ValueError) as e:
+            log.error(f"Could not read the history: {e}")
+            return
+        if len(values) == 0:
+            log.error("No values are recorded in the history yet")
+            return
+    else:
+        log.info(f"Simulating {args.years:g} years of values...")
+        values = backtest.simulate_values(
+            args.years, args.replicas, args.step, conf.BANK_LEVEL,
+            conf.HAS_SUPREME_INTELLECT, args.seed)
+        ticks = np.arange(len(values)) * args.step
+    backtest.report(values, args.buy, args.sell, args.delay, args.overhead, ticks,
+                    not args.no_hold_back)
+
+
+def run_optimize(args: argparse.Namespace):
+    """Find the best quantiles for every good and save them in the threshold table."""
+    if not init_sim_data():
+        return
+    table = None if args.no_hold_back else get_conditional_table()
+    buy, sell = optimize.optimize(
+        get_distribution(), table, args.years, args.replicas, args.shards, args.step,
+        args.delay, args.overhead, args.grid_step, conf.BANK_LEVEL, conf.HAS_SUPREME_INTELLECT,
+        args.seed)
+    thresholds.save(buy, sell, cache_key(sim_settings()))
+    log.info(f"Saved the thresholds to {thresholds.THRESHOLDS_FILE}. "
+             "Set \"perGoodThresholds\" to true in the config to use them.")
+
+
+def run_encoding(args: argparse.Namespace):
+    """Benchmark the encodings of screenshots."""
+    try:
+        image = Image.open(args.image)
+    except OSError as e:
+        log.error(f"Could not open {args.image}: {e}")
+        return
+    encode.benchmark(image, args.frames)
+
+
+def run_replay(args: argparse.Namespace):
+    """Replay recorded screenshots through the whole pipeline, by default without uploading."""
+    bounds = None
+    if args.bounds:
+        try:
+            bounds = Bounds(*(int(v) for v in args.bounds.split(",")))
+        except (TypeError, ValueError):
+            log.error(f"Invalid bounds {args.bounds}, expected x,y,width,height")
+            return
+    directory = args.output or tempfile.mkdtemp(prefix="ccsw-replay-")
+    try:
+        box = replay.use_directory(directory)
+    except (OSError, ValueError) as e:
+        log.error(f"Could not use {directory} for the replay: {e}")
+        return
+    # Screenshots that cannot be read locally are still read by the server
+    error = conf.login() if conf.is_instance_configured() else "No instance is configured"
+    if args.upload:
+        if error:
+            log.error(f"Cannot upload the values: {error}")
+            return
+        box.start()
+    else:
+        if error:
+            log.warn(f"Could not log in, reading screenshots on the server will fail: {error}")
+        log.info(f"Dry run: the updates are saved in {directory}, but not uploaded")
+    if not init_sim_data():
+        return
+    init_forecaster()
+    load_thresholds()
+    try:
+        replay.replay(args.path, bounds, args.speed, ocr.process_screenshot_callback)
+    except (OSError, ValueError) as e:
+        log.error(f"Could not replay {args.path}: {e}")
+    finally:
+        if args.upload:
+            box.stop()
+            box.drain()
+
+
 def main():
     """Main function to start the Cookie Clicker bot with logging."""
+    args = parse_args()
+    if args.command == "backtest":
+        run_backtest(args)
+        return
+    if args.command == "optimize":
+        run_optimize(args)
+        return
+    if args.command == "encoding":
+        run_encoding(args)
+        return
+    if args.command == "replay":
+        run_replay(args)
+        return
+
     log.info("Starting CCSW Bot")
 
+    schedule = scheduler.create_schedule()
+    stages = pipeline.Pipeline(schedule)
+    outbox = get_outbox()
     try:
-        if not init_sim_data():
+        # The full simulation continues in the background if it has not run before
+        if not start_sim_data():
             return
+        init_forecaster()
+        load_thresholds()
         bounds = run_server(screenshot.take_screenshot, not conf.MOCK_DATA)
-        screenshot.start_screenshot_loop(
-            bounds, ocr.process_screenshot_callback)
+        stages.start()
+        outbox.start()
+        screenshot.start_screenshot_loop(bounds, stages.submit, schedule)
     except KeyboardInterrupt:
         log.info("Bot stopped by user (Ctrl+C)")
     except Exception:
         log.exception("Unexpected error occurred")
     finally:
+        stages.stop()
+        outbox.stop()
+        stop_sim_data()
+        log.info(f"Metrics: {metrics.summary()}")
         log.info("CCSW Bot shutdown complete")
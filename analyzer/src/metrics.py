@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+import numpy as np
+
+# Number of most recent durations that are kept per stage
+TIMING_SAMPLES = 4096
+
+
+class Metrics:
+    """
+    Counters of what the analyzer did since it was started, for example to see how
+    many requests to the server were saved, and how long the stages of processing
+    a screenshot took.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._timings: dict[str, deque] = {}
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters[name]
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def observe(self, name: str, seconds: float):
+        """Record how long a stage took."""
+        with self._lock:
+            if name not in self._timings:
+                self._timings[name] = deque(maxlen=TIMING_SAMPLES)
+            self._timings[name].append(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Record how long the body of the `with` statement took as a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def latencies(self, name: str, percentiles=(50, 90, 99, 100)) -> list[float]:
+        """Percentiles of the recorded durations of a stage in seconds, empty if there are none."""
+        with self._lock:
+            samples = list(self._timings.get(name, ()))
+        return list(np.percentile(samples, percentiles)) if samples else []
+
+    def timing_count(self, name: str) -> int:
+        """How many durations of a stage are recorded, at most `TIMING_SAMPLES`."""
+        with self._lock:
+            return len(self._timings.get(name, ()))
+
+    def timed_stages(self) -> list[str]:
+        with self._lock:
+            return list(self._timings)
+
+    def summary(self) -> str:
+        """All counters as one line, sorted by name."""
+        counters = self.snapshot()
+        return ", ".join(f"{name}={counters[name]}" for name in sorted(counters)) or "none"
+
+
+metrics = Metrics()
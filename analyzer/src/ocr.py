@@ -1,10 +1,13 @@
-from io import BytesIO
+import hashlib
+from datetime import datetime
 from analyze import analyze_values
 from PIL import Image
 from logger import log
 import request
 from config import conf
-import base64
+import encode
+import local_ocr
+from metrics import metrics
 
 
 MOCK_DATA = {
@@ -31,40 +34,114 @@ MOCK_DATA = {
 }
 
 
+# Digest of the pixels of the last screenshot that was processed, and the time
+# at which it was taken
+_last_digest: bytes = None
+_last_processed: datetime = None
+
+
+def check_changed(screenshot_image: Image.Image, timestamp: datetime) -> bytes | None:
+    """
+    Decide whether a screenshot taken at `timestamp` has to be processed.
+
+    Screenshots that are identical to the last processed one (for example while
+    the game is paused) are skipped, unless the last one was taken more than
+    `forceRefreshInterval` seconds before.
+
+    Returns:
+        The digest of the screenshot to pass to `mark_processed()`, or `None` if
+        it is skipped.
+    """
+    digest = hashlib.blake2b(screenshot_image.tobytes(), digest_size=16).digest()
+    if digest == _last_digest and conf.FORCE_REFRESH_INTERVAL:
+        if (timestamp - _last_processed).total_seconds() < conf.FORCE_REFRESH_INTERVAL:
+            metrics.increment("skipped_unchanged")
+            log.info("Screenshot is unchanged, skipping it "
+                     f"({metrics.get('skipped_unchanged')} skipped so far)")
+            return None
+        metrics.increment("forced_refreshes")
+        log.info("Screenshot is unchanged, but processing it to refresh the server")
+    return digest
+
+
+def mark_processed(digest: bytes, timestamp: datetime):
+    """Remember the digest of a screenshot whose goods were read, and when it was taken."""
+    global _last_digest, _last_processed
+    _last_digest, _last_processed = digest, timestamp
+
+
 def process_screenshot_callback(screenshot_image, timestamp):
     """
-    Callback function to process a screenshot.
+    Callback function to process a screenshot, see `check_changed()` for which
+    screenshots are skipped.
 
     Args:
         screenshot_image (PIL.Image): The screenshot image
         timestamp (datetime): When the screenshot was taken
     """
+    metrics.increment("screenshots")
     if conf.MOCK_DATA:
         analyze_values(MOCK_DATA['goods'], timestamp)
         return
-    return process_ai(screenshot_image, timestamp)
 
+    digest = check_changed(screenshot_image, timestamp)
+    if digest is not None and process_image(screenshot_image, timestamp):
+        mark_processed(digest, timestamp)
+
+
+def process_image(screenshot_image: Image.Image, timestamp) -> bool:
+    """Read the goods from a screenshot and analyze them. Returns whether this succeeded."""
+    goods = read_locally(screenshot_image)
+    if goods is None:
+        goods = read_remotely(screenshot_image)
+    if goods is None:
+        return False
+    with metrics.timer("analyze"):
+        analyze_values(goods, timestamp)
+    return True
 
-def to_base64(image: Image.Image) -> str:
-    """
-    Convert a PIL Image to a base64 encoded string.
-    """
-    buffer = BytesIO()
-    image.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode('utf-8')
 
+def read_locally(screenshot_image: Image.Image) -> dict | None:
+    """Read the goods with the learned glyphs, or return `None` if that is not possible."""
+    if conf.OCR_MODE != "local":
+        return None
+    with metrics.timer("recognize"):
+        goods = local_ocr.recognize(screenshot_image, conf.OCR_MIN_CONFIDENCE)
+    if goods is None:
+        log.info("Could not read the stock market locally, sending it to the server")
+        return None
+    metrics.increment("local_ocr")
+    return goods
 
-def process_ai(screenshot_image: Image.Image, timestamp):
 
+def read_remotely(screenshot_image: Image.Image) -> dict | None:
+    """
+    Let the server read the goods, and learn the glyphs from its results.
+
+    With local OCR, the goods whose cells did not change since they were read are
+    hidden from the server, and only the part of the screenshot around the others
+    is sent.
+    """
+    masked = local_ocr.mask_unchanged(screenshot_image) if conf.OCR_MODE == "local" else None
+    image, known = masked if masked is not None else (screenshot_image, {})
+    with metrics.timer("encode"):
+        image, mime_type = encode.encode_screenshot(image)
     data = {
-        "image": to_base64(screenshot_image),
+        "image": request.Base64(image),
+        "mimeType": mime_type,
         "instanceId": conf.INSTANCE_ID,
     }
-    res = request.post(
-        conf.Endpoint.IMG_PROCESS, data, timeout=100).as_result()
+    metrics.increment("remote_ocr")
+    with metrics.timer("remote_ocr"):
+        res = request.post(
+            conf.Endpoint.IMG_PROCESS, data, timeout=100).as_result()
     if not res.success:
         log.error(
             f"Failed to process image with AI. {res.error}")
-        return
+        return None
 
-    analyze_values(res.data["goods"], timestamp)
+    goods = {**res.data["goods"], **known}
+    if conf.OCR_MODE == "local":
+        local_ocr.learn(screenshot_image, goods)
+        local_ocr.refresh_cells(screenshot_image, res.data["goods"])
+    return goods
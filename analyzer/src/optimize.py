@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from analyze import SYMBOLS
+from backtest import backtest, expected_returns, simulate_values
+from logger import log
+from simulation.conditional import ConditionalTable
+from simulation.distribution import Distribution
+
+
+def quantile_grid(step: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    All pairs of buy quantiles below 0.5 and sell quantiles above 0.5, spaced `step` apart.
+    Returns the buy and the sell quantile of every pair.
+    """
+    qs = np.round(np.arange(step, 1, step), 6)
+    buy, sell = np.meshgrid(qs[qs < 0.5], qs[qs > 0.5], indexing="ij")
+    return buy.ravel(), sell.ravel()
+
+
+def _evaluate_shard(years: float, replicas: int, step: int, bank_level: int,
+                    has_supreme_intellect: bool, seed, buy_values: np.ndarray,
+                    sell_values: np.ndarray, delay: int, overhead: float,
+                    table: ConditionalTable | None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Simulate values and backtest every pair of thresholds on them.
+
+    Args:
+        buy_values: The buy threshold of every pair and good, with shape `(pairs, goods)`.
+        sell_values: The sell threshold of every pair and good.
+        table: The conditional table to hold goods back with like `analyze_values()`,
+            or `None` to act as soon as a good is past its threshold.
+    Returns:
+        The total profit and number of trades of every pair and good.
+    """
+    values = simulate_values(years, replicas, step, bank_level, has_supreme_intellect, seed)
+    snapshots, _, goods = values.shape
+    values = values.reshape(snapshots, replicas * goods)
+    expected = None
+    if table is not None:
+        expected = expected_returns(values, np.tile(np.arange(goods), replicas), table,
+                                    np.arange(snapshots) * step)
+    profit = np.empty(buy_values.shape)
+    trades = np.empty(buy_values.shape, dtype=np.int64)
+    for i in range(len(buy_values)):
+        result = backtest(values, np.tile(buy_values[i], replicas),
+                          np.tile(sell_values[i], replicas), delay, overhead, expected)
+        profit[i] = result["profit"].reshape(replicas, goods).sum(axis=0)
+        trades[i] = result["trades"].reshape(replicas, goods).sum(axis=0)
+    return profit, trades
+
+
+def optimize(dist: Distribution, table: ConditionalTable | None, years: float, replicas: int,
+             shards: int, step: int, delay: int, overhead: float, grid_step: float,
+             bank_level: int, has_supreme_intellect: bool,
+             seed=None) -> tuple[list[float], list[float]]:
+    """
+    Find the pair of buy and sell quantiles with the highest backtested profit for
+    every good, by searching a grid of quantile pairs. With the conditional
+    `table`, goods are held back like in `analyze_values()`.
+
+    The `years` of simulated values are split between `shards` independently seeded
+    processes, which each backtest all pairs on their share of the values.
+
+    Returns:
+        The best buy quantile and the best sell quantile of every good.
+    """
+    buy_qs, sell_qs = quantile_grid(grid_step)
+    goods = dist.goods
+    buy_values = np.array([[dist.quantile(g, q) for g in range(goods)] for q in buy_qs])
+    sell_values = np.array([[dist.quantile(g, q) for g in range(goods)] for q in sell_qs])
+    log.info(
+        f"Backtesting {len(buy_qs)} quantile pairs on {years:g} years of values "
+        f"in {shards} shards...")
+
+    start = time.perf_counter()
+    seeds = np.random.SeedSequence(seed).spawn(shards)
+    args = (years / shards, replicas, step, bank_level, has_supreme_intellect)
+    with ProcessPoolExecutor(shards) as pool:
+        futures = [pool.submit(_evaluate_shard, *args, s, buy_values, sell_values,
+                               delay, overhead, table)
+                   for s in seeds]
+        results = [future.result() for future in futures]
+    profit = sum(profit for profit, _ in results)
+    trades = sum(trades for _, trades in results)
+    log.info(f"Optimized thresholds in {time.perf_counter() - start:.1f}s")
+
+    best = profit.argmax(axis=0)
+    print(f"{'Good':<5}{'Buy':>7}{'Sell':>7}{'Trades':>8}{'Profit':>10}")
+    for g, symbol in enumerate(SYMBOLS[:goods]):
+        i = best[g]
+        print(f"{symbol:<5}{buy_qs[i]:>7.2f}{sell_qs[i]:>7.2f}"
+              f"{trades[i, g]:>8}{profit[i, g]:>10.1f}")
+    return [float(buy_qs[i]) for i in best], [float(sell_qs[i]) for i in best]
@@ -0,0 +1,297 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from config import conf
+from logger import log
+from metrics import metrics
+import request
+
+OUTBOX_FILE = "outbox.jsonl"
+# The ID of the stream of updates, and the last update that the server
+# acknowledged with its sequence number
+STATE_FILE = "outbox.json"
+
+# Updates sent to the server in one request
+BATCH_SIZE = 50
+
+# Seconds to wait before sending again after a failure, doubled after every
+# failure up to `RETRY_MAX`
+RETRY_MIN = 5
+RETRY_MAX = 300
+
+# Every this many updates, all goods are sent even if they did not change
+KEYFRAME_INTERVAL = 60
+
+
+def is_repeated(action: dict, base_action: dict | None) -> bool:
+    """
+    Whether an action only repeats that a good is still past its threshold, like it
+    was in the base update.
+    """
+    return (base_action is not None and action["type"].startswith("still_")
+            and all(action[key] == base_action[key] for key in ("symbol", "type", "value")))
+
+
+def encode_update(update: dict, base: dict | None) -> dict:
+    """
+    The update as it is sent to the server: only the goods that changed since the
+    `base` update and the actions that are not repeated from it (see
+    `is_repeated()`), or all goods and actions (a keyframe) if there is no base.
+    The server keeps the repeated actions of goods that did not change from the
+    base, so an update in which nothing changed is only a heartbeat with its
+    timestamp.
+    """
+    if base is None:
+        return update
+    goods = {symbol: good for symbol, good in update["goods"].items()
+             if (good["value"], good["bought"]) != (base["goods"].get(symbol, {}).get("value"),
+                                                    base["goods"].get(symbol, {}).get("bought"))}
+    base_actions = {action["symbol"]: action for action in base["actions"]}
+    # The server keeps still_* actions of goods that are not sent, so a good whose
+    # action ended is sent even if it did not change
+    current = {action["symbol"] for action in update["actions"]}
+    for symbol, action in base_actions.items():
+        if (action["type"].startswith("still_") and symbol not in current
+                and symbol in update["goods"]):
+            goods[symbol] = update["goods"][symbol]
+    actions = [action for action in update["actions"]
+               if action["symbol"] in goods
+               or not is_repeated(action, base_actions.get(action["symbol"]))]
+    encoded = {"seq": update["seq"], "timestamp": update["timestamp"], "base": base["seq"]}
+    if goods:
+        encoded["goods"] = goods
+    if actions:
+        encoded["actions"] = actions
+    return encoded
+
+
+class Outbox:
+    """
+    Updates for the server, appended to a file before they are sent so that none
+    are lost while the server cannot be reached or the analyzer is restarted.
+
+    Every update gets a sequence number, which the server uses to store every
+    update only once, no matter how often it is sent. Waiting updates are sent
+    oldest first in batches, with `delta` only with what changed since the update
+    before (see `encode_update()`). If the file grows over `max_bytes`, the oldest
+    waiting updates are dropped.
+
+    Updates are sent by a thread of their own once it is started, so that saving
+    an update never waits for the server.
+    """
+
+    def __init__(self, path: str = OUTBOX_FILE, state_path: str = STATE_FILE,
+                 max_bytes: int = 10_000_000, delta: bool = True):
+        self.path = path
+        self.state_path = state_path
+        self.max_bytes = max_bytes
+        self.delta = delta
+        # Held while the waiting updates or the files change
+        self._lock = threading.Lock()
+        # Held while updates are sent, so that only one batch is sent at a time
+        self._send_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread = None
+        self.stream_id = None
+        self.acked = 0
+        # The last update that the server acknowledged, which the next one may
+        # only send the changes to
+        self.base: dict = None
+        self._load_state()
+        # Waiting updates with their line in the file
+        self.pending: deque[tuple[dict, bytes]] = deque()
+        self._load_pending()
+        self.next_seq = max([self.acked] + [u["seq"] for u, _ in self.pending]) + 1
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as file:
+                state = json.load(file)
+            self.stream_id, self.acked = state["streamId"], state["acked"]
+            self.base = state.get("base")
+        except FileNotFoundError:
+            # A new stream, so the server does not take its sequence numbers
+            # for ones it has already seen
+            self.stream_id = str(uuid.uuid4())
+            self._save_state()
+        except (OSError, ValueError, KeyError) as e:
+            log.warn(f"Could not read {self.state_path}, starting a new outbox: {e}")
+            self.stream_id = str(uuid.uuid4())
+            self._save_state()
+
+    def _save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump({"streamId": self.stream_id, "acked": self.acked, "base": self.base}, file)
+        os.replace(tmp, self.state_path)
+
+    def _load_pending(self):
+        try:
+            with open(self.path, "rb") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                update = json.loads(line)
+            except ValueError:
+                # The analyzer stopped while writing the last line
+                log.warn(f"Skipping a damaged update in {self.path}")
+                continue
+            if update["seq"] > self.acked:
+                self.pending.append((update, line if line.endswith(b"\n") else line + b"\n"))
+        if self.pending:
+            log.info(f"{len(self.pending)} updates from the last run are waiting to be sent")
+
+    def append(self, timestamp: str, goods: dict, actions: list[dict]):
+        """Save an update to be sent."""
+        with self._lock:
+            update = {"seq": self.next_seq, "timestamp": timestamp, "goods": goods,
+                      "actions": actions}
+            self.next_seq += 1
+            line = json.dumps(update).encode("utf-8") + b"\n"
+            with open(self.path, "ab") as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+            self.pending.append((update, line))
+            if os.path.getsize(self.path) > self.max_bytes:
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the file with only the waiting updates, dropping the oldest if needed."""
+        size = sum(len(line) for _, line in self.pending)
+        evicted = 0
+        # Leave room for new updates, so that the file is not rewritten every time
+        while self.pending and size > self.max_bytes // 2:
+            size -= len(self.pending.popleft()[1])
+            evicted += 1
+        if evicted:
+            metrics.increment("outbox_evicted", evicted)
+            log.warn(f"The outbox is full, dropped the {evicted} oldest updates")
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as file:
+            file.writelines(line for _, line in self.pending)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.path)
+
+    def drain(self) -> bool:
+        """
+        Send all waiting updates, oldest first. Stops at the first batch that fails.
+        Returns whether all updates were sent.
+        """
+        with self._send_lock:
+            while True:
+                with self._lock:
+                    if not self.pending:
+                        return True
+                    updates = self._encode_batch()
+                payload = {
+                    "instanceId": conf.INSTANCE_ID,
+                    "streamId": self.stream_id,
+                    "updates": updates,
+                }
+                metrics.increment("uploads")
+                with metrics.timer("upload"):
+                    response = request.post(conf.Endpoint.UPDATE_BATCH, payload)
+                if response.status_code == 409:
+                    # The server does not have the update that the changes are based on
+                    log.warn("The server needs all values again, sending a keyframe")
+                    self.base = None
+                    continue
+                res = response.as_result()
+                if not res.success:
+                    log.error(f"Failed to push values to server, {len(self.pending)} updates "
+                              f"are waiting: {res.error}")
+                    return False
+                with self._lock:
+                    self._ack(res.data["acked"])
+
+    def start(self):
+        """Start sending the waiting updates and every update that is appended."""
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """Stop sending updates. Updates that are still waiting are sent after a restart."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def wake(self):
+        """Send the waiting updates now, unless the last attempt failed too recently."""
+        self._wake.set()
+
+    def _run(self):
+        delay = RETRY_MIN
+        retry_at = 0.0
+        while not self._stopping.is_set():
+            wait = max(retry_at - time.monotonic(), 0) if self.pending else None
+            if wait != 0:
+                self._wake.wait(wait)
+                self._wake.clear()
+                if self._stopping.is_set() or time.monotonic() < retry_at:
+                    continue
+            try:
+                sent = self.drain()
+            except Exception:
+                log.exception("Failed to send the waiting updates")
+                sent = False
+            if sent:
+                delay, retry_at = RETRY_MIN, 0.0
+            else:
+                retry_at = time.monotonic() + delay
+                delay = min(delay * 2, RETRY_MAX)
+
+    def _encode_batch(self) -> list[dict]:
+        """The oldest waiting updates, encoded as they are sent."""
+        batch = []
+        base = self.base
+        for update, _ in list(self.pending)[:BATCH_SIZE]:
+            # Changes can only be sent to the update right before, which may have been dropped
+            if (not self.delta or base is None or base["seq"] != update["seq"] - 1
+                    or update["seq"] % KEYFRAME_INTERVAL == 0):
+                base = None
+            batch.append(encode_update(update, base))
+            if "base" in batch[-1]:
+                metrics.increment("delta_updates")
+            else:
+                metrics.increment("keyframes")
+            base = update
+        return batch
+
+    def _ack(self, seq: int):
+        """Forget the updates up to the sequence number, which the server has stored."""
+        while self.pending and self.pending[0][0]["seq"] <= seq:
+            update = self.pending.popleft()[0]
+            self.base = {"seq": update["seq"], "goods": update["goods"],
+                         "actions": update["actions"]}
+        self.acked = max(self.acked, seq)
+        self._save_state()
+        if not self.pending:
+            # Nothing is waiting, so the file can start over
+            open(self.path, "wb").close()
+
+
+_OUTBOX: Outbox = None
+
+
+def get_outbox() -> Outbox:
+    global _OUTBOX
+    if _OUTBOX is None:
+        _OUTBOX = Outbox(max_bytes=conf.OUTBOX_MAX_BYTES, delta=conf.DELTA_UPDATES)
+    return _OUTBOX
+
+
+def set_outbox(outbox: Outbox):
+    """Save the updates in `outbox` instead of the outbox of the analyzer."""
+    global _OUTBOX
+    _OUTBOX = outbox
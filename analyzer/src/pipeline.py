@@ -0,0 +1,140 @@
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+from PIL import Image
+import ocr
+from analyze import analyze_values, threshold_distance
+from config import conf
+from logger import log
+from metrics import metrics
+from scheduler import Schedule
+
+# Number of items that may wait for each stage. Screenshots are only worth reading
+# while they are recent, so only the newest one waits, but results wait to be
+# analyzed while an earlier one is.
+FRAME_QUEUE_SIZE = 1
+REMOTE_QUEUE_SIZE = 1
+ANALYZE_QUEUE_SIZE = 16
+
+_STOP = object()
+
+
+class Stage:
+    """
+    A thread that handles the items of a bounded queue one after the other.
+
+    When the queue is full, the oldest item is dropped to make room for the new
+    one, so that a slow stage never holds up the stages before it and always
+    works on the most recent items.
+    """
+
+    def __init__(self, name: str, handle: Callable, size: int):
+        self.name = name
+        self.handle = handle
+        self.queue = queue.Queue(size)
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait((time.monotonic(), item))
+                return
+            except queue.Full:
+                pass
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            metrics.increment(f"dropped_{self.name}")
+            log.warn(f"The {self.name} stage is behind, dropped its oldest item")
+
+    def stop(self, timeout: float):
+        if not self.thread.is_alive():
+            return
+        self.put(_STOP)
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            queued, item = self.queue.get()
+            if item is _STOP:
+                return
+            metrics.observe(f"{self.name}_wait", time.monotonic() - queued)
+            try:
+                self.handle(item)
+            except Exception:
+                log.exception(f"The {self.name} stage failed")
+
+
+class Pipeline:
+    """
+    Processes screenshots in stages that run in their own threads: reading them
+    locally, reading them on the server, and analyzing the goods. The updates are
+    saved in the outbox, which sends them on its own thread, so a slow request to
+    the server never delays the next screenshot or drops an update.
+
+    Results are analyzed in the order in which their screenshots were taken;
+    results that arrive after those of a newer screenshot are dropped. The
+    schedule learns from every result when to take the next screenshot.
+    """
+
+    def __init__(self, schedule: Schedule):
+        self.schedule = schedule
+        self.recognize = Stage("recognize", self._recognize, FRAME_QUEUE_SIZE)
+        self.remote = Stage("remote", self._remote, REMOTE_QUEUE_SIZE)
+        self.analyze = Stage("analyze", self._analyze, ANALYZE_QUEUE_SIZE)
+        self._stages = [self.recognize, self.remote, self.analyze]
+        self._last_timestamp: datetime = None
+
+    def start(self):
+        for stage in self._stages:
+            stage.start()
+
+    def stop(self, timeout: float = 5):
+        for stage in self._stages:
+            stage.stop(timeout)
+
+    def submit(self, image: Image.Image, timestamp: datetime):
+        """Queue a screenshot, like `ocr.process_screenshot_callback()` processes it."""
+        metrics.increment("screenshots")
+        self.recognize.put((image, timestamp))
+
+    def _recognize(self, item: tuple[Image.Image, datetime]):
+        image, timestamp = item
+        if conf.MOCK_DATA:
+            self.analyze.put((ocr.MOCK_DATA["goods"], timestamp))
+            return
+        digest = ocr.check_changed(image, timestamp)
+        if digest is None:
+            self.schedule.observe(timestamp, None, None)
+            return
+        goods = ocr.read_locally(image)
+        if goods is None:
+            self.remote.put((image, timestamp, digest))
+            return
+        ocr.mark_processed(digest, timestamp)
+        self.analyze.put((goods, timestamp))
+
+    def _remote(self, item: tuple[Image.Image, datetime, bytes]):
+        image, timestamp, digest = item
+        goods = ocr.read_remotely(image)
+        if goods is not None:
+            ocr.mark_processed(digest, timestamp)
+            self.analyze.put((goods, timestamp))
+
+    def _analyze(self, item: tuple[dict, datetime]):
+        goods, timestamp = item
+        if self._last_timestamp is not None and timestamp <= self._last_timestamp:
+            metrics.increment("stale_results")
+            log.info(f"Dropping the goods of {timestamp.isoformat()}, "
+                     "newer ones were already analyzed")
+            return
+        self._last_timestamp = timestamp
+        with metrics.timer("analyze"):
+            analyze_values(goods, timestamp)
+        self.schedule.observe(timestamp, goods, threshold_distance(goods))
@@ -0,0 +1,159 @@
+import io
+import os
+import tarfile
+import time
+import zipfile
+from datetime import datetime
+from typing import Callable
+from PIL import Image
+import history
+import outbox
+from config import conf
+from locate import PanelTracker
+from logger import log
+from metrics import metrics
+from screenshot import Capture, crop_screenshot, grab_panel
+from select_server.bounds import Bounds
+
+IMAGE_EXTENSIONS = (".png", ".webp", ".jpg", ".jpeg", ".bmp")
+
+# The stages in the order in which a screenshot passes through them
+STAGES = ["load", "capture", "recognize", "encode", "remote_ocr", "analyze", "record", "upload",
+          "frame"]
+
+
+def _timestamp(name: str, modified: float) -> datetime:
+    """
+    When a recorded screenshot was taken: the name of the file as seconds since the
+    epoch or as an ISO 8601 date, or else the time the file was last modified.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    try:
+        return datetime.fromtimestamp(float(stem)).astimezone()
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(stem).astimezone()
+    except ValueError:
+        return datetime.fromtimestamp(modified).astimezone()
+
+
+def list_frames(path: str) -> list[tuple[datetime, Callable[[], bytes]]]:
+    """
+    The recorded screenshots in a directory or a zip or tar archive, sorted by the
+    time at which they were taken, with a function that reads each of them.
+    """
+    frames = []
+    if os.path.isdir(path):
+        for name in os.listdir(path):
+            file = os.path.join(path, name)
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                frames.append((_timestamp(name, os.path.getmtime(file)),
+                               lambda file=file: open(file, "rb").read()))
+    elif zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        for info in archive.infolist():
+            if info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                modified = datetime(*info.date_time).timestamp()
+                frames.append((_timestamp(info.filename, modified),
+                               lambda info=info: archive.read(info)))
+    elif tarfile.is_tarfile(path):
+        archive = tarfile.open(path)
+        for member in archive.getmembers():
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                frames.append((_timestamp(member.name, member.mtime),
+                               lambda member=member: archive.extractfile(member).read()))
+    else:
+        raise ValueError(f"{path} is not a directory or a zip or tar archive")
+    frames.sort(key=lambda frame: frame[0])
+    return frames
+
+
+def use_directory(directory: str) -> outbox.Outbox:
+    """
+    Save the updates and the history of the replay in `directory`, so that the
+    replay does not change those of the analyzer. Returns the outbox of the replay,
+    whose updates are only sent once it is started.
+    """
+    os.makedirs(directory, exist_ok=True)
+    box = outbox.Outbox(os.path.join(directory, outbox.OUTBOX_FILE),
+                        os.path.join(directory, outbox.STATE_FILE),
+                        conf.OUTBOX_MAX_BYTES, conf.DELTA_UPDATES)
+    outbox.set_outbox(box)
+    history.set_history(history.History(os.path.join(directory, history.HISTORY_FILE))
+                        if conf.RECORD_HISTORY else None)
+    return box
+
+
+class FrameCapture(Capture):
+    """Grabs the bounds from a recorded screenshot of the whole screen."""
+    name = "replay"
+
+    def __init__(self):
+        self.frame: Image.Image = None
+
+    def grab_screen(self) -> Image.Image:
+        return self.frame
+
+
+def replay(path: str, bounds: Bounds | None, speed: float, callback):
+    """
+    Process recorded screenshots like screenshots of the screen, and report how
+    long every stage took.
+
+    Args:
+        path: Directory or archive of the screenshots.
+        bounds: The bounds of the stock market on the screenshots, or `None` if they
+            are already cropped to it.
+        speed: How many times faster than they were recorded the screenshots are
+            replayed, or 0 to replay them as fast as possible.
+        callback: Processes each screenshot, like in `start_screenshot_loop()`.
+    """
+    frames = list_frames(path)
+    if not frames:
+        log.error(f"No screenshots found in {path}")
+        return
+    log.info(f"Replaying {len(frames)} screenshots from {path}")
+    capture = FrameCapture()
+    tracker = None
+    first = frames[0][0]
+    start = time.perf_counter()
+    for i, (timestamp, read) in enumerate(frames):
+        if speed > 0:
+            delay = start + (timestamp - first).total_seconds() / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            with metrics.timer("load"):
+                image = Image.open(io.BytesIO(read()))
+                image.load()
+            capture.frame = image
+            if bounds is not None:
+                with metrics.timer("capture"):
+                    if conf.TRACK_PANEL:
+                        if tracker is None:
+                            tracker = PanelTracker(bounds, conf.TRACK_MARGIN, image.size)
+                        image = grab_panel(capture, tracker)
+                    else:
+                        image = crop_screenshot(image, bounds)
+            with metrics.timer("frame"):
+                callback(image, timestamp)
+        except Exception:
+            log.exception(f"Failed to replay screenshot #{i + 1}")
+    report(len(frames), time.perf_counter() - start)
+
+
+def report(frames: int, elapsed: float):
+    """Print the throughput and the latency percentiles of every stage."""
+    print(f"Replayed {frames} screenshots in {elapsed:.2f}s ({frames / elapsed:.1f}/s)")
+    print(f"{'Stage':<12}{'Count':>7}{'Per s':>9}{'p50 ms':>9}{'p90 ms':>9}"
+          f"{'p99 ms':>9}{'Max ms':>9}")
+    stages = metrics.timed_stages()
+    for stage in STAGES + [s for s in stages if s not in STAGES]:
+        latencies = metrics.latencies(stage)
+        if not latencies:
+            continue
+        count = metrics.timing_count(stage)
+        print(f"{stage:<12}{count:>7}{count / elapsed:>9.1f}"
+              + "".join(f"{latency * 1000:>9.1f}" for latency in latencies))
+    print(f"Counters: {metrics.summary()}")
@@ -1,3 +1,7 @@
+import base64
+import threading
+import zlib
+from contextlib import contextmanager
 from dataclasses import dataclass
 from io import BytesIO
 import json
@@ -5,6 +9,10 @@ from typing import Any
 import pycurl
 from logger import log
 from config import conf
+from metrics import metrics
+
+# Bodies smaller than this many bytes are not worth compressing
+MIN_COMPRESS_SIZE = 1024
 
 
 @dataclass
@@ -52,48 +60,222 @@ class Response:
         return Result(success=True, data=self.parsed_json["data"])
 
 
-def post(url: str, data: dict, timeout: int = 10, auth: bool = True) -> Response:
+class Base64:
+    """
+    Binary data that is sent as a base64 string in the JSON body of a request.
+    It is encoded in chunks while the request is sent, instead of all at once.
+    """
+
+    # Bytes encoded at once, a multiple of 3 so that chunks can be joined
+    CHUNK_SIZE = 3 * 16384
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def encoded_size(self) -> int:
+        return (len(self.data) + 2) // 3 * 4
+
+    def chunks(self):
+        view = memoryview(self.data)
+        for i in range(0, len(view), self.CHUNK_SIZE):
+            yield base64.b64encode(view[i:i + self.CHUNK_SIZE])
+
+
+class _BodyReader:
+    """
+    Reads a request body made of JSON and `Base64` parts for pycurl, optionally
+    compressing it with gzip while it is sent.
+    """
+
+    def __init__(self, parts: list, compress: bool = False):
+        self.size = sum(len(part) if isinstance(part, bytes) else part.encoded_size() + 2
+                        for part in parts)
+        self._chunks = self._generate(parts)
+        if compress:
+            self._chunks = self._compress(self._chunks)
+            # Only known once it has been sent, so the body is sent in chunks
+            self.size = None
+        self._pending = memoryview(b"")
+
+    @staticmethod
+    def _generate(parts: list):
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                yield b'"'
+                yield from part.chunks()
+                yield b'"'
+
+    @staticmethod
+    def _compress(chunks):
+        compressor = zlib.compressobj(wbits=31)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    def read(self, size: int) -> bytes:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b""
+            self._pending = memoryview(chunk)
+        result, self._pending = self._pending[:size], self._pending[size:]
+        return bytes(result)
+
+
+def _split_payload(data: dict) -> tuple[str, list]:
+    """
+    Serialize the data to JSON, leaving out the contents of `Base64` values.
+    Returns the JSON with placeholders (for logging) and the parts of the body.
     """
-    Sends a POST request to the specified URL with the given data.
-    Args:
-        url (str): The URL to send the POST request to.
-        data (dict): The data to send in the request body.
+    values = []
+
+    def placeholder(value):
+        if not isinstance(value, Base64):
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+        values.append(value)
+        return f"<base64 {len(value.data)} bytes #{len(values) - 1}>"
+
+    payload_json = json.dumps(data, default=placeholder)
+    parts = []
+    rest = payload_json.encode("utf-8")
+    for i, value in enumerate(values):
+        before, rest = rest.split(json.dumps(f"<base64 {len(value.data)} bytes #{i}>").encode(), 1)
+        parts += [before, value]
+    parts.append(rest)
+    return payload_json, parts
+
+
+def _http2_supported() -> bool:
+    return bool(pycurl.version_info()[4] & pycurl.VERSION_HTTP2)
+
+
+class Client:
+    """
+    Sends requests over a pool of curl handles that share their connections, DNS
+    lookups and TLS sessions, so that consecutive requests to the server reuse the
+    same connection instead of connecting again.
+
+    Every request checks out its own handle from the pool, so requests can be sent
+    from several threads at once.
     """
-    payload_json = json.dumps(data)
 
-    buffer = BytesIO()
-    c = pycurl.Curl()
-    c.setopt(c.URL, url)
-    c.setopt(c.POSTFIELDS, payload_json)
-    c.setopt(c.USERAGENT, conf.USER_AGENT)
+    def __init__(self):
+        self._share = pycurl.CurlShare()
+        for data in (pycurl.LOCK_DATA_DNS, pycurl.LOCK_DATA_SSL_SESSION,
+                     pycurl.LOCK_DATA_CONNECT):
+            self._share.setopt(pycurl.SH_SHARE, data)
+        self._idle: list[pycurl.Curl] = []
+        self._lock = threading.Lock()
+        self._http2 = _http2_supported()
+
+    @contextmanager
+    def _checkout(self):
+        """A handle from the pool with all options reset, which is returned afterwards."""
+        with self._lock:
+            c = self._idle.pop() if self._idle else None
+        if c is None:
+            c = pycurl.Curl()
+            c.setopt(c.SHARE, self._share)
+        else:
+            # Keeps the connections and the share of the handle
+            c.reset()
+        try:
+            yield c
+        except BaseException:
+            # The handle may be in the middle of a transfer
+            c.close()
+            raise
+        with self._lock:
+            self._idle.append(c)
+
+    def _record(self, c: pycurl.Curl):
+        """Count whether the request reused a connection, and how long connecting took."""
+        if c.getinfo(pycurl.NUM_CONNECTS) == 0:
+            metrics.increment("http_reused")
+            return
+        metrics.increment("http_connections")
+        connect = c.getinfo(pycurl.CONNECT_TIME)
+        metrics.observe("http_connect", connect)
+        tls = c.getinfo(pycurl.APPCONNECT_TIME)
+        if tls > 0:
+            metrics.observe("http_tls", tls - connect)
 
-    headers = ["Content-Type: application/json"]
+    def post(self, url: str, data: dict, timeout: int = 10, auth: bool = True) -> Response:
+        """
+        Sends a POST request to the specified URL with the given data.
+        Args:
+            url (str): The URL to send the POST request to.
+            data (dict): The data to send in the request body. `Base64` values are
+                sent as base64 strings.
+        """
+        payload_json, parts = _split_payload(data)
+        size = sum(len(part) if isinstance(part, bytes) else part.encoded_size() for part in parts)
+        compress = conf.COMPRESS_REQUESTS and size >= MIN_COMPRESS_SIZE
 
-    if auth:
-        headers.append(f"Authorization: Bearer {conf.SESSION_TOKEN}")
+        buffer = BytesIO()
+        headers = ["Content-Type: application/json"]
+        try:
+            with self._checkout() as c:
+                c.setopt(c.URL, url)
+                if len(parts) == 1 and not compress:
+                    c.setopt(c.POSTFIELDS, payload_json)
+                else:
+                    reader = _BodyReader(parts, compress)
+                    c.setopt(c.POST, 1)
+                    c.setopt(c.READFUNCTION, reader.read)
+                    if reader.size is not None:
+                        c.setopt(c.POSTFIELDSIZE_LARGE, reader.size)
+                    # Send the body right away instead of asking the server first
+                    headers.append("Expect:")
+                if compress:
+                    headers.append("Content-Encoding: gzip")
+                c.setopt(c.USERAGENT, conf.USER_AGENT)
+                if self._http2:
+                    c.setopt(c.HTTP_VERSION, c.CURL_HTTP_VERSION_2TLS)
+                # Accept all compressions of the response that curl can decode
+                c.setopt(c.ACCEPT_ENCODING, "")
 
-    c.setopt(c.HTTPHEADER, headers)
-    c.setopt(c.WRITEDATA, buffer)
-    c.setopt(c.TIMEOUT, timeout)
+                if auth:
+                    headers.append(f"Authorization: Bearer {conf.SESSION_TOKEN}")
 
-    log.debug(
-        f"Sending data to server at {url} with payload: {payload_json[:100]}")
-    try:
-        c.perform()
-        status_code = c.getinfo(pycurl.HTTP_CODE)
+                c.setopt(c.HTTPHEADER, headers)
+                c.setopt(c.WRITEDATA, buffer)
+                c.setopt(c.TIMEOUT, timeout)
+
+                log.debug(
+                    f"Sending data to server at {url} with payload: {payload_json[:100]}")
+                c.perform()
+                status_code = c.getinfo(pycurl.HTTP_CODE)
+                self._record(c)
+        except pycurl.error as e:
+            log.error(f"Request failed: {e}")
+            return Response(None, None, f"Request failed: {e}")
         response_body = buffer.getvalue().decode('utf-8')
-    except pycurl.error as e:
-        log.error(f"Request failed: {e}")
-        c.close()
-        return Response(None, None, f"Request failed: {e}")
-    c.close()
-    log.debug(f"Server response ({status_code}): {response_body[:100]}")
-
-    try:
-        parsed_body = json.loads(response_body)
-    except json.JSONDecodeError as e:
-        log.error(f"Failed to parse JSON response: {e}")
-        log.debug(f"Response body was: {response_body}")
-        return Response(status_code, None, f"Failed to parse json: {response_body}")
-
-    return Response(status_code, parsed_body, None)
+        log.debug(f"Server response ({status_code}): {response_body[:100]}")
+
+        try:
+            parsed_body = json.loads(response_body)
+        except json.JSONDecodeError as e:
+            log.error(f"Failed to parse JSON response: {e}")
+            log.debug(f"Response body was: {response_body}")
+            return Response(status_code, None, f"Failed to parse json: {response_body}")
+
+        return Response(status_code, parsed_body, None)
+
+    def close(self):
+        with self._lock:
+            for c in self._idle:
+                c.close()
+            self._idle.clear()
+
+
+client = Client()
+
+
+def post(url: str, data: dict, timeout: int = 10, auth: bool = True) -> Response:
+    """Sends a POST request with the shared `client`, see `Client.post()`."""
+    return client.post(url, data, timeout, auth)
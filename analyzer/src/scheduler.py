@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import numpy as np
+from config import conf
+from logger import log
+from metrics import metrics
+
+# Seconds between two ticks of the stock market
+TICK_SECONDS = 60
+# Seconds after a tick that the screenshot is taken, so that the game has redrawn
+TICK_DELAY = 1.0
+# The phase of the ticks is known once it is narrowed down to this many seconds
+PHASE_TOLERANCE = 2.0
+# Seconds between checks that the ticks still happen at the known phase
+VERIFY_INTERVAL = 1800
+
+# Goods this close to the threshold of their next action (in quantiles) are
+# checked every tick, goods farther away than `FAR_DISTANCE` every `checkInterval`
+NEAR_DISTANCE = 0.03
+FAR_DISTANCE = 0.15
+
+
+class Schedule:
+    """
+    Deadlines `interval` seconds apart on the monotonic clock, so that the time it
+    takes to handle one does not delay the next one. Deadlines that have already
+    passed are skipped.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.deadline = time.monotonic()
+
+    def start(self):
+        """Count the deadlines from now, when the first screenshot is taken."""
+        self.deadline = time.monotonic()
+
+    def observe(self, timestamp: datetime, goods: dict | None, distance: float | None):
+        """
+        Learn from the goods read from the screenshot taken at `timestamp`, or from
+        a screenshot identical to the previous one if `goods` is `None`.
+        `distance` is the one of `analyze.threshold_distance()`.
+        """
+
+    def wait(self):
+        """Wait until the next deadline."""
+        self.deadline += self.interval
+        now = time.monotonic()
+        if now > self.deadline:
+            missed = int((now - self.deadline) // self.interval) + 1
+            self.deadline += missed * self.interval
+            metrics.increment("missed_deadlines", missed)
+            log.warn(f"Taking the screenshot took too long, skipped {missed} screenshot(s)")
+        time.sleep(self.deadline - now)
+
+
+class TickPhase:
+    """
+    Estimates at which second of the minute the stock market ticks, from whether
+    the values changed between two screenshots less than a tick apart.
+    """
+
+    BINS = 240
+
+    def __init__(self):
+        self._centers = (np.arange(self.BINS) + 0.5) * TICK_SECONDS / self.BINS
+        # Whether the ticks may happen in every part of the minute
+        self.candidates = np.ones(self.BINS, dtype=bool)
+
+    def _between(self, start: float, end: float) -> np.ndarray:
+        """The parts of the minute that lie between two times in seconds."""
+        return (self._centers - start) % TICK_SECONDS <= end - start
+
+    def observe(self, start: float, end: float, changed: bool):
+        """Learn whether the values changed between two times in seconds since the epoch."""
+        if not 0 < end - start < TICK_SECONDS:
+            return
+        between = self._between(start, end)
+        candidates = self.candidates & (between if changed else ~between)
+        if not candidates.any():
+            # The game was paused or slowed down, so the ticks moved
+            log.debug("The stock market ticks moved, estimating them again")
+            candidates = between if changed else ~between
+        self.candidates = candidates
+
+    def uncertainty(self) -> float:
+        """How many seconds of the minute the ticks may still happen in."""
+        return self.candidates.sum() * TICK_SECONDS / self.BINS
+
+    def known(self) -> bool:
+        return self.uncertainty() <= PHASE_TOLERANCE
+
+    def phase(self) -> float:
+        """The second of the minute at which the ticks most likely happen."""
+        angles = self._centers[self.candidates] * 2 * np.pi / TICK_SECONDS
+        mean = np.arctan2(np.sin(angles).mean(), np.cos(angles).mean())
+        return (mean * TICK_SECONDS / (2 * np.pi)) % TICK_SECONDS
+
+    def probe(self, since: float) -> float:
+        """
+        Seconds after `since` at which a screenshot tells in which half of the
+        remaining parts of the minute the ticks happen.
+        """
+        offsets = np.sort((self._centers[self.candidates] - since) % TICK_SECONDS)
+        return float(offsets[len(offsets) // 2])
+
+
+class AdaptiveSchedule(Schedule):
+    """
+    Takes screenshots right after the stock market ticks, every tick while a good
+    is close to the threshold of its next action, and up to every `interval`
+    seconds while all goods are far from them.
+
+    At most `budget` screenshots are taken per hour (0 for no limit). While the
+    phase of the ticks is unknown, extra screenshots are taken to find it, and
+    every `VERIFY_INTERVAL` seconds one is taken just before a tick if the budget
+    allows, which finds the values unchanged unless the ticks moved.
+    """
+
+    def __init__(self, interval: float, budget: int):
+        super().__init__(interval)
+        self.budget = budget
+        self.tick_phase = TickPhase()
+        self.distance: float = None
+        self._captures: deque[float] = deque()
+        self._last: tuple[float, dict] = None
+        self._verified = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            super().start()
+            self._verified = self.deadline
+
+    def observe(self, timestamp: datetime, goods: dict | None, distance: float | None):
+        seconds = timestamp.timestamp()
+        with self._lock:
+            if goods is None:
+                if self._last is None:
+                    return
+                goods = self._last[1]
+            else:
+                self.distance = distance
+            if self._last is not None and seconds > self._last[0]:
+                changed = any(self._last[1].get(symbol, {}).get("value") != good["value"]
+                              for symbol, good in goods.items())
+                self.tick_phase.observe(self._last[0], seconds, changed)
+            if self._last is None or seconds > self._last[0]:
+                self._last = (seconds, goods)
+
+    def current_interval(self) -> float:
+        """Seconds between screenshots for how close the goods are to their thresholds."""
+        if self.distance is None:
+            return self.interval
+        ticks = max(1, round(self.interval / TICK_SECONDS))
+        far = np.clip((self.distance - NEAR_DISTANCE) / (FAR_DISTANCE - NEAR_DISTANCE), 0, 1)
+        return (1 + round(far * (ticks - 1))) * TICK_SECONDS
+
+    def _next_capture(self, last: float) -> float:
+        """The monotonic time of the screenshot after the one taken at `last`."""
+        interval = self.current_interval()
+        # Ticks are in seconds since the epoch, deadlines on the monotonic clock
+        offset = time.time() - time.monotonic()
+        if not self.tick_phase.known():
+            if not self.budget or len(self._captures) < self.budget:
+                return last + self.tick_phase.probe(last + offset) + TICK_DELAY / 2
+            return last + interval
+        if last - self._verified >= VERIFY_INTERVAL and (
+                not self.budget or len(self._captures) < self.budget):
+            self._verified = last
+            # Just before the next tick
+            return (self._after_tick(last + TICK_DELAY, offset) - 2 * TICK_DELAY
+                    - self.tick_phase.uncertainty() / 2)
+        deadline = self._after_tick(last + interval - TICK_SECONDS / 2, offset)
+        while deadline <= last:
+            deadline += TICK_SECONDS
+        return deadline
+
+    def _after_tick(self, earliest: float, offset: float) -> float:
+        """The monotonic time right after the first tick after `earliest`."""
+        delay = TICK_DELAY + self.tick_phase.uncertainty() / 2
+        tick = self.tick_phase.phase()
+        ticks = np.ceil((earliest + offset - tick - delay) / TICK_SECONDS)
+        return float(tick + ticks * TICK_SECONDS + delay - offset)
+
+    def wait(self):
+        now = time.monotonic()
+        with self._lock:
+            self._captures.append(self.deadline)
+            while self._captures and self._captures[0] <= now - 3600:
+                self._captures.popleft()
+            deadline = max(self._next_capture(self.deadline), now)
+            if self.budget and len(self._captures) >= self.budget:
+                earliest = self._captures[0] + 3600
+                if deadline < earliest:
+                    deadline = earliest
+                    if self.tick_phase.known():
+                        deadline = self._after_tick(earliest, time.time() - time.monotonic())
+                    metrics.increment("budget_waits")
+        log.info(f"Next screenshot in {deadline - now:.0f} seconds")
+        self.deadline = deadline
+        time.sleep(deadline - now)
+
+
+def create_schedule() -> Schedule:
+    if conf.ADAPTIVE_INTERVAL:
+        return AdaptiveSchedule(conf.CHECK_INTERVAL, conf.CAPTURE_BUDGET)
+    return Schedule(conf.CHECK_INTERVAL)
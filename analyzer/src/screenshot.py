@@ -1,9 +1,12 @@
-import time
 from datetime import datetime
 from PIL import ImageGrab, Image
+import numpy as np
 import os
 from select_server.bounds import Bounds
 from logger import log
+from metrics import metrics
+from scheduler import Schedule
+from locate import PanelTracker
 from config import conf
 
 
@@ -50,24 +53,153 @@ def crop_screenshot(image: Image.Image, bounds: Bounds) -> Image:
     ))
 
 
-def start_screenshot_loop(bounds: Bounds, callback):
+class Capture:
+    """A way to grab the pixels inside the bounds from the screen."""
+    name = "full"
+
+    def grab(self, bounds: Bounds) -> Image.Image:
+        """Grab the whole screen and crop it."""
+        return crop_screenshot(self.grab_screen(), bounds)
+
+    def grab_view(self, bounds: Bounds) -> Image.Image | np.ndarray:
+        """
+        Grab the pixels inside the bounds without copying them if possible: as a
+        view of shape `(height, width, 3)` in RGB order that is overwritten by the
+        next grab, or else as an image.
+        """
+        return self.grab(bounds)
+
+    def grab_screen(self) -> Image.Image:
+        """Grab the whole screen."""
+        return get_screenshot()
+
+    def close(self):
+        pass
+
+
+class PILCapture(Capture):
+    """Lets PIL grab only the bounds."""
+    name = "pil"
+
+    def grab(self, bounds: Bounds) -> Image.Image:
+        return ImageGrab.grab(bbox=(bounds.x, bounds.y,
+                                    bounds.x + bounds.width, bounds.y + bounds.height))
+
+
+class XShmCapture(Capture):
+    """
+    Grabs the bounds from an X11 screen into a buffer in shared memory that is
+    reused for every screenshot.
+    """
+    name = "xshm"
+
+    def __init__(self):
+        self._grabber = None
+
+    def _grab(self, bounds: Bounds) -> np.ndarray:
+        import xshm
+        rect = (bounds.x, bounds.y, bounds.width, bounds.height)
+        if self._grabber is None or rect != (self._grabber.x, self._grabber.y,
+                                             self._grabber.width, self._grabber.height):
+            self.close()
+            self._grabber = xshm.XShmGrabber(*rect)
+        return self._grabber.grab()
+
+    def grab(self, bounds: Bounds) -> Image.Image:
+        self._grab(bounds)
+        # The buffer is overwritten by the next screenshot, which may be taken while
+        # this one is still processed, so its pixels are converted into a new image
+        return Image.frombuffer("RGB", (bounds.width, bounds.height), self._grabber.buffer,
+                                "raw", "BGRX", self._grabber.stride, 1)
+
+    def grab_view(self, bounds: Bounds) -> np.ndarray:
+        # The BGRX pixels of the shared buffer, with the channels reversed in the view
+        return self._grab(bounds)[..., 2::-1]
+
+    def close(self):
+        if self._grabber is not None:
+            self._grabber.close()
+            self._grabber = None
+
+
+CAPTURES = {capture.name: capture for capture in (XShmCapture, PILCapture, Capture)}
+
+
+def create_capture(bounds: Bounds) -> Capture:
+    """
+    Create the configured capture, or with "auto", the first one that works on
+    this system, in the order of `CAPTURES`. Grabbing the whole screen always works.
     """
-    Starts a loop to take a screenshot at a regular interval.
+    if conf.USE_TEST_IMAGE:
+        return Capture()
+    names = list(CAPTURES) if conf.CAPTURE_BACKEND == "auto" else [conf.CAPTURE_BACKEND]
+    for name in names:
+        capture = CAPTURES[name]()
+        try:
+            capture.grab(bounds)
+        except Exception as e:
+            log.warn(f"Cannot capture the screen with {name}: {e}")
+            capture.close()
+            continue
+        log.info(f"Capturing the screen with {name}")
+        return capture
+    log.warn("Falling back to grabbing the whole screen")
+    return Capture()
+
+
+def grab_panel(capture: Capture, tracker: PanelTracker) -> Image.Image:
+    """
+    Grab the stock market panel wherever it is on the screen, searching the whole
+    screen if it moved away from the window around its last position.
+    """
+    if tracker.template is None:
+        return tracker.start(capture.grab(tracker.bounds))
+    window = tracker.search_window()
+    try:
+        # Only the pixels of the panel are copied out of the capture
+        panel = tracker.verify(capture.grab_view(window), window)
+    except Exception as e:
+        log.warn(f"Failed to grab the area around the stock market panel: {e}")
+        panel = None
+    if panel is not None:
+        return panel
+    log.info("Searching the whole screen for the stock market panel")
+    screen = capture.grab_screen()
+    panel = tracker.search(screen)
+    # Without the panel, the last bounds are read and fail like any unreadable screenshot
+    return panel if panel is not None else crop_screenshot(screen, tracker.bounds)
+
+
+def start_screenshot_loop(bounds: Bounds, callback, schedule: Schedule = None):
+    """
+    Starts a loop to take screenshots at the deadlines of a schedule, by default
+    every `checkInterval` seconds. The interval is measured from one screenshot to
+    the next, so it does not grow by the time the callback takes.
 
     Args:
         callback (function): Callback function to process each screenshot.
                                      Should accept image and timestamp as parameters.
     """
     screenshot_count = 0
+    capture = create_capture(bounds)
+    tracker = PanelTracker(bounds, conf.TRACK_MARGIN, get_screenshot().size) \
+        if conf.TRACK_PANEL else None
+    schedule = schedule or Schedule(conf.CHECK_INTERVAL)
+    # The schedule may have been created long before, while the bounds were selected
+    schedule.start()
 
-    def cb(image, timestamp):
-        cropped = crop_screenshot(image, bounds)
-        callback(cropped, timestamp)
-
-    while True:
-        screenshot_count += 1
-        log.info(f"Taking screenshot #{screenshot_count}")
-        take_screenshot(cb)
-        log.info(
-            f"Waiting {conf.CHECK_INTERVAL} seconds until next screenshot...")
-        time.sleep(conf.CHECK_INTERVAL)
+    try:
+        while True:
+            screenshot_count += 1
+            log.info(f"Taking screenshot #{screenshot_count}")
+            try:
+                timestamp = datetime.now().astimezone()
+                with metrics.timer("capture"):
+                    image = grab_panel(capture, tracker) if tracker else capture.grab(bounds)
+                log.debug(f"Screenshot taken at {timestamp.isoformat()}")
+                callback(image, timestamp)
+            except Exception:
+                log.exception("Failed to take screenshot")
+            schedule.wait()
+    finally:
+        capture.close()
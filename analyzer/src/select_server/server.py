@@ -7,6 +7,7 @@ from datetime import datetime
 from config import conf
 from logger import log
 from request import post
+from simulation.simulation import get_status
 import json
 import html
 
@@ -55,6 +56,13 @@ def get_instance_html():
     return html_content
 
 
+def get_simulation_status_js():
+    PATH = "select_server/simulation_status.js"
+    with open(PATH, "br") as file:
+        js_content = file.read()
+    return js_content
+
+
 def get_logged_in_instance_html():
     """Return the logged-in instance page with dynamic status (success or error)."""
     PATH = "select_server/instance_logged_in.html"
@@ -112,6 +120,10 @@ class BoundsServer(BaseHTTPRequestHandler):
             self.serve_instance_configuration()
         elif self.path == "/img":
             self.serve_screenshot()
+        elif self.path == "/simulation-status.js":
+            self.serve_simulation_status_script()
+        elif self.path == "/api/simulation-status":
+            self.send_json_response(200, get_status())
         elif self.path == "/":
             self.redirect_to("/instance")
 
@@ -257,6 +269,12 @@ class BoundsServer(BaseHTTPRequestHandler):
     def stop_server(self):
         threading.Thread(target=self.server.shutdown).start()
 
+    def serve_simulation_status_script(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/javascript")
+        self.end_headers()
+        self.wfile.write(get_simulation_status_js())
+
     def serve_screenshot(self):
         bytes_array = io.BytesIO()
         self.img.save(bytes_array, format='PNG')
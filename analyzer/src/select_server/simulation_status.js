@@ -0,0 +1,24 @@
+// Shows the progress of the stock market simulation in the element with the ID sim-status
+async function updateSimulationStatus() {
+    const statusEl = document.getElementById('sim-status');
+    try {
+        const res = await fetch('/api/simulation-status');
+        const status = await res.json();
+        if (status.state === 'done') {
+            statusEl.textContent = 'Stock market simulation complete.';
+            return;
+        }
+        if (status.state === 'running') {
+            statusEl.textContent = `Stock market simulation running in the background: ` +
+                `${status.years.toFixed(2)} of ${status.targetYears} years simulated. ` +
+                `Provisional results are used until it is done.`;
+        } else {
+            statusEl.textContent = `Stock market simulation ${status.state}. Provisional results are used.`;
+        }
+    } catch (error) {
+        statusEl.textContent = 'Simulation status unavailable.';
+        return;
+    }
+    setTimeout(updateSimulationStatus, 2000);
+}
+document.addEventListener("DOMContentLoaded", updateSimulationStatus);
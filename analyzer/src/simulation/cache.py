@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+from logger import log
+from simulation import distribution
+from simulation.conditional import ConditionalTable
+from simulation.distribution import Distribution, FormatError
+from simulation.sketch import QuantileSketch
+
+CACHE_DIR = "simulation/cache"
+
+
+def cache_key(settings: dict) -> str:
+    """Hash the simulation settings into the key of a cache entry."""
+    encoded = json.dumps(settings, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.bin")
+
+
+def _table_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.npz")
+
+
+def load(key: str) -> Distribution | None:
+    """
+    Load the distribution stored under `key`.
+    Returns `None` if there is no entry or it is corrupted.
+    """
+    path = _entry_path(key)
+    try:
+        dist = Distribution.open(path)
+    except FileNotFoundError:
+        return None
+    except FormatError as e:
+        log.warn(f"Ignoring simulation cache entry: {e}")
+        return None
+
+    # Mark the entry as recently used
+    os.utime(path)
+    return dist
+
+
+def store(key: str, sketch: QuantileSketch, capacity: int) -> Distribution:
+    """
+    Store the distribution of a sketch under `key`, then evict the least recently
+    used entries so that at most `capacity` entries are kept.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _entry_path(key)
+    distribution.write(path, sketch)
+    evict(CACHE_DIR, ".bin", max(capacity, 1))
+    return Distribution.open(path)
+
+
+def load_table(key: str) -> ConditionalTable | None:
+    """
+    Load the conditional table stored under `key`.
+    Returns `None` if there is no entry or it can't be read.
+    """
+    path = _table_path(key)
+    try:
+        table = ConditionalTable.load(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warn(f"Ignoring unreadable simulation cache entry {path}: {e}")
+        return None
+
+    # Mark the entry as recently used
+    os.utime(path)
+    return table
+
+
+def store_table(key: str, table: ConditionalTable, capacity: int) -> ConditionalTable:
+    """
+    Store a conditional table under `key`, then evict the least recently used
+    tables so that at most `capacity` are kept.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    table.save(_table_path(key))
+    evict(CACHE_DIR, ".npz", max(capacity, 1))
+    return table
+
+
+def evict(directory: str, suffix: str, capacity: int):
+    """
+    Delete the least recently used files ending with `suffix` in `directory`,
+    so that at most `capacity` of them are kept.
+    """
+    entries = [os.path.join(directory, name) for name in os.listdir(directory)
+               if name.endswith(suffix)]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for path in entries[capacity:]:
+        log.info(f"Evicting {path}")
+        os.remove(path)
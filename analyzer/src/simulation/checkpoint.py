@@ -0,0 +1,65 @@
+import os
+import pickle
+import time
+from logger import log
+from simulation.cache import evict
+from simulation.engine import SimulationState
+
+CHECKPOINT_DIR = "simulation/checkpoints"
+
+# Minimum number of seconds between two checkpoints of a running simulation
+CHECKPOINT_INTERVAL = 60
+
+
+def _checkpoint_path(key: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"{key}.pkl")
+
+
+def load(key: str) -> SimulationState | None:
+    """
+    Load the simulation state saved under `key`.
+    Returns `None` if there is no checkpoint or it can't be read.
+    """
+    path = _checkpoint_path(key)
+    try:
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warn(f"Ignoring unreadable simulation checkpoint {path}: {e}")
+        return None
+    if not isinstance(state, SimulationState):
+        log.warn(f"Ignoring invalid simulation checkpoint {path}")
+        return None
+    return state
+
+
+def save(key: str, state: SimulationState, capacity: int):
+    """
+    Save a simulation state under `key`, then evict the least recently saved
+    checkpoints so that at most `capacity` are kept.
+    """
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = _checkpoint_path(key)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    evict(CHECKPOINT_DIR, ".pkl", max(capacity, 1))
+
+
+class Checkpointer:
+    """Round callback that saves the simulation state at most every `CHECKPOINT_INTERVAL` seconds."""
+
+    def __init__(self, key: str, capacity: int):
+        self.key = key
+        self.capacity = capacity
+        self._last_save = time.monotonic()
+
+    def __call__(self, state: SimulationState):
+        now = time.monotonic()
+        if now - self._last_save >= CHECKPOINT_INTERVAL:
+            save(self.key, state, self.capacity)
+            self._last_save = now
+            log.debug(f"Saved simulation checkpoint ({state.years:g} years)")
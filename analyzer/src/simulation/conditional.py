@@ -0,0 +1,147 @@
+import os
+import numpy as np
+
+# Values are bucketed by their ratio to the resting value of the good,
+# in quarter octaves from 1/8 to 8 times the resting value
+VALUE_BUCKETS = 24
+_VALUE_OCTAVES = 3
+
+# Edges of the buckets of the average change of the value per tick
+DELTA_EDGES = np.array([-2.0, -1.0, -0.5, -0.2, -0.05, 0.05, 0.2, 0.5, 1.0, 2.0])
+DELTA_BUCKETS = len(DELTA_EDGES) + 1
+
+# Forward returns are counted as log returns between -RETURN_RANGE and
+# RETURN_RANGE, in buckets of equal width
+RETURN_BUCKETS = 80
+RETURN_RANGE = 2.0
+
+# Quantiles of the forward return that are stored per bucket
+TABLE_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# Buckets with fewer samples have no quantiles
+MIN_SAMPLES = 100
+
+
+def _value_buckets(values: np.ndarray, resting: np.ndarray) -> np.ndarray:
+    buckets = np.floor(
+        (np.log2(values / resting) + _VALUE_OCTAVES) * VALUE_BUCKETS / (2 * _VALUE_OCTAVES))
+    return np.clip(buckets, 0, VALUE_BUCKETS - 1).astype(np.intp)
+
+
+def _delta_buckets(deltas: np.ndarray) -> np.ndarray:
+    return np.searchsorted(DELTA_EDGES, deltas)
+
+
+class ReturnHistogram:
+    """
+    Histogram of the forward returns of the goods, conditioned on their current
+    state.
+
+    For every simulated tick, the return over the next `horizon` ticks is counted
+    in the bucket of the good, its current value and its average change per tick
+    over the last `lookback` ticks. Histograms with the same parameters are merged
+    by adding their counts.
+    """
+
+    def __init__(self, goods: int, resting: np.ndarray, lookback: int, horizon: int):
+        self.resting = resting
+        self.lookback = lookback
+        self.horizon = horizon
+        self.counts = np.zeros(
+            (goods, VALUE_BUCKETS, DELTA_BUCKETS, RETURN_BUCKETS), dtype=np.int64)
+        self._offsets = np.arange(goods) * (VALUE_BUCKETS * DELTA_BUCKETS * RETURN_BUCKETS)
+
+    def empty(self) -> "ReturnHistogram":
+        """A histogram with the same parameters and no counts."""
+        return ReturnHistogram(self.counts.shape[0], self.resting, self.lookback, self.horizon)
+
+    def add(self, block: np.ndarray):
+        """
+        Add the returns of a block of consecutive values.
+        Only the ticks whose past and forward values are both in the block are counted.
+
+        Args:
+            block: Array of shape `(ticks, replicas, goods)`.
+        """
+        lb, h = self.lookback, self.horizon
+        if len(block) <= lb + h:
+            return
+        now = block[lb:len(block) - h]
+        deltas = (now - block[:len(block) - lb - h]) / lb
+        returns = np.log(block[lb + h:] / now)
+
+        r = np.floor((returns + RETURN_RANGE) * RETURN_BUCKETS / (2 * RETURN_RANGE))
+        np.clip(r, 0, RETURN_BUCKETS - 1, out=r)
+        keys = ((_value_buckets(now, self.resting) * DELTA_BUCKETS + _delta_buckets(deltas))
+                * RETURN_BUCKETS + r.astype(np.intp) + self._offsets)
+        self.counts += np.bincount(
+            keys.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other: "ReturnHistogram"):
+        """Add the counts of another histogram with the same parameters to this one."""
+        if (other.lookback, other.horizon, other.counts.shape) != (
+                self.lookback, self.horizon, self.counts.shape):
+            raise ValueError("Cannot merge histograms with different parameters")
+        self.counts += other.counts
+
+    def table(self) -> "ConditionalTable":
+        """Summarize the histogram in a lookup table of return quantiles."""
+        cumulative = np.cumsum(self.counts, axis=-1)
+        total = cumulative[..., -1:]
+        width = 2 * RETURN_RANGE / RETURN_BUCKETS
+        quantiles = np.empty(self.counts.shape[:-1] + (len(TABLE_QUANTILES),), dtype=np.float32)
+        for i, q in enumerate(TABLE_QUANTILES):
+            buckets = (cumulative < q * total).sum(axis=-1)
+            quantiles[..., i] = -RETURN_RANGE + (buckets + 0.5) * width
+        quantiles[total[..., 0] < MIN_SAMPLES] = np.nan
+        return ConditionalTable(np.expm1(quantiles), self.resting, self.lookback, self.horizon)
+
+
+class ConditionalTable:
+    """
+    Lookup table of the quantiles of the return of a good over the next `horizon`
+    ticks, given its current value and its average change per tick over the last
+    `lookback` ticks. Returns are relative, so 0.1 means a rise of 10%.
+    """
+
+    def __init__(self, quantiles: np.ndarray, resting: np.ndarray, lookback: int, horizon: int):
+        self.quantiles = quantiles
+        self.resting = np.asarray(resting)
+        self.lookback = int(lookback)
+        self.horizon = int(horizon)
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, quantiles=self.quantiles, resting=self.resting,
+                 lookback=self.lookback, horizon=self.horizon)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ConditionalTable":
+        with np.load(path) as data:
+            return cls(data["quantiles"], data["resting"],
+                       data["lookback"], data["horizon"])
+
+    def quantile(self, good: int, value: float, delta: float, q: float) -> float | None:
+        """
+        The return over the next `horizon` ticks that a fraction `q` of the returns
+        lie below, for a good with the given value and average change per tick.
+        `q` must be one of `TABLE_QUANTILES`.
+        Returns `None` if too few simulated values were in the same state.
+        """
+        v = _value_buckets(np.float64(value), self.resting[good])
+        d = _delta_buckets(delta)
+        result = self.quantiles[good, v, d, TABLE_QUANTILES.index(q)]
+        return None if np.isnan(result) else float(result)
+
+    def lookup(self, goods: np.ndarray, values: np.ndarray, deltas: np.ndarray,
+               q: float) -> np.ndarray:
+        """
+        Like `quantile()` for arrays of goods, values and changes per tick of the
+        same shape. The result is NaN where it is not known or a value is NaN.
+        """
+        known = ~np.isnan(values) & ~np.isnan(deltas)
+        v = _value_buckets(np.where(known, values, self.resting[goods]), self.resting[goods])
+        d = _delta_buckets(np.where(known, deltas, 0.0))
+        result = self.quantiles[goods, v, d, TABLE_QUANTILES.index(q)]
+        return np.where(known, result, np.nan)
@@ -0,0 +1,131 @@
+import hashlib
+import math
+import os
+import struct
+import numpy as np
+from simulation.sketch import QuantileSketch
+
+# Magic bytes and version of the distribution file format
+MAGIC = b"CCSD"
+FORMAT_VERSION = 1
+
+# Number of steps of the precomputed quantile grid
+QUANTILE_STEPS = 10000
+
+# Magic, format version, payload checksum, goods, buckets, quantile steps,
+# alpha, max value
+_HEADER = struct.Struct("<4sH32sIIIdd")
+
+
+class FormatError(Exception):
+    """Raised when a distribution file is corrupted or has an unknown format."""
+
+
+def _tables(sketch: QuantileSketch) -> tuple[np.ndarray, np.ndarray]:
+    """The cumulative bucket counts and the quantile grid of a sketch."""
+    cumulative = np.cumsum(sketch.counts, axis=1).astype("<i8")
+    grid = sketch.quantiles(np.linspace(0, 1, QUANTILE_STEPS + 1)).astype("<f8")
+    return cumulative, grid
+
+
+def write(path: str, sketch: QuantileSketch):
+    """
+    Write the full distribution described by a sketch to a file.
+
+    The file contains, per good, the cumulative counts of all sketch buckets and
+    the values at `QUANTILE_STEPS + 1` evenly spaced quantiles. Both are stored as
+    little-endian arrays after a fixed-size header, so they can be memory-mapped.
+    """
+    cumulative, grid = _tables(sketch)
+    payload = cumulative.tobytes() + grid.tobytes()
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, hashlib.sha256(payload).digest(),
+        sketch.goods, sketch.buckets, QUANTILE_STEPS, sketch.alpha, sketch.max_value)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(header)
+        file.write(payload)
+    os.replace(tmp_path, path)
+
+
+class Distribution:
+    """
+    Read-only full distribution of the values of every good.
+
+    `quantile()` and its inverse `percentile()` are constant-time lookups into
+    the cumulative bucket counts and the quantile grid, which are usually
+    memory-mapped from a file written by `write()`.
+    """
+
+    def __init__(self, cumulative: np.ndarray, grid: np.ndarray,
+                 alpha: float, max_value: float):
+        self.cumulative = cumulative
+        self.grid = grid
+        self.alpha = alpha
+        self.max_value = max_value
+        self.steps = grid.shape[1] - 1
+        self._inv_log_gamma = 1 / math.log((1 + alpha) / (1 - alpha))
+
+    @classmethod
+    def open(cls, path: str) -> "Distribution":
+        """Memory-map a distribution file written by `write()`."""
+        with open(path, "rb") as file:
+            header = file.read(_HEADER.size)
+        try:
+            magic, version, checksum, goods, buckets, steps, alpha, max_value = \
+                _HEADER.unpack(header)
+        except struct.error:
+            raise FormatError(f"Truncated distribution file: {path}")
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise FormatError(f"Unknown distribution file format: {path}")
+
+        size = goods * buckets * 8 + goods * (steps + 1) * 8
+        if os.path.getsize(path) != _HEADER.size + size:
+            raise FormatError(f"Distribution file has the wrong size: {path}")
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=_HEADER.size)
+        if hashlib.sha256(data).digest() != checksum:
+            raise FormatError(f"Corrupted distribution file: {path}")
+
+        cumulative = data[:goods * buckets * 8].view("<i8").reshape(goods, buckets)
+        grid = data[goods * buckets * 8:].view("<f8").reshape(goods, steps + 1)
+        return cls(cumulative, grid, alpha, max_value)
+
+    @classmethod
+    def from_sketch(cls, sketch: QuantileSketch) -> "Distribution":
+        """Create a distribution in memory, without writing it to a file."""
+        return cls(*_tables(sketch), sketch.alpha, sketch.max_value)
+
+    @property
+    def goods(self) -> int:
+        return self.cumulative.shape[0]
+
+    @property
+    def buckets(self) -> int:
+        return self.cumulative.shape[1]
+
+    def quantile(self, good: int, q: float) -> float:
+        """The value below which a fraction `q` of the values of a good lie."""
+        position = min(max(q, 0.0), 1.0) * self.steps
+        i = min(int(position), self.steps - 1)
+        low, high = self.grid[good, i], self.grid[good, i + 1]
+        return float(low + (high - low) * (position - i))
+
+    def percentile(self, good: int, value: float) -> float:
+        """The fraction of the values of a good that lie below `value`."""
+        key = math.ceil(math.log(max(value, 1.0)) * self._inv_log_gamma)
+        key = min(key, self.buckets - 1)
+        cumulative = self.cumulative[good]
+        below = cumulative[key - 1] if key > 0 else 0
+        # Count half of the values in the bucket of `value` as below it
+        return float((below + cumulative[key]) / 2 / cumulative[-1])
+
+    def quantiles(self, qs: list[float]) -> list[list[float]]:
+        """Table with one row per good and the values at `qs`."""
+        return [[self.quantile(good, q) for q in qs] for good in range(self.goods)]
+
+    def to_sketch(self) -> QuantileSketch:
+        """Reconstruct the sketch the distribution was written from."""
+        sketch = QuantileSketch(self.goods, self.alpha, self.max_value)
+        sketch.counts[:] = np.diff(self.cumulative, axis=1, prepend=0)
+        return sketch
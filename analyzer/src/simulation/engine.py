@@ -0,0 +1,419 @@
+import copy
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import numpy as np
+from config import conf
+from logger import log
+from simulation.conditional import ReturnHistogram
+from simulation.sketch import QuantileSketch
+
+TICKS_PER_YEAR = 60 * 24 * 365  # = 525600
+
+# Increase when a change to the engine changes the simulation results,
+# so that cached results are not reused
+ENGINE_VERSION = 2
+
+# Modes a good can switch to, with the weights used by the game
+MODE_CHOICES = np.array([0, 1, 1, 2, 2, 3, 4, 5], dtype=np.int8)
+
+# Per-mode drift update `d = d * DECAY + SCALE * (rand - SHIFT)` and value kick
+# `val += KICK * rand`, replacing the mode if/else chain of the game code
+D_DECAY = np.array([0.95, 0.99, 0.99, 1.0, 1.0, 1.0])
+D_SCALE = np.array([0.05, 0.05, -0.05, 0.15, -0.15, 0.3])
+D_SHIFT = np.array([0.5, 0.1, 0.1, 0.1, 0.1, 0.5])
+VAL_KICK = np.array([0.0, 0.0, 0.0, 5.0, -5.0, 0.0])
+
+# Number of uniform random numbers drawn per good and tick
+_DRAWS = 30
+
+# Markets are split into shards of about this many, no matter how many processes
+# simulate them, so that the results do not depend on the number of processes and
+# every shard has enough markets to vectorize over
+REPLICAS_PER_SHARD = 32
+
+
+def resting_values(bank_level: int) -> np.ndarray:
+    """Resting value of every good for the given bank level."""
+    return 10 + 10 * np.arange(conf.GOOD_COUNT) + (bank_level - 1.0)
+
+
+class Market:
+    """
+    A batch of independent stock markets that are advanced in lockstep.
+
+    The state of every market is stored as arrays of shape `(replicas, GOOD_COUNT)`,
+    so one call to `tick()` advances `replicas` markets by one in-game tick.
+    The tick logic is a vectorized port of `stockmarketsim.ts`, which in turn
+    uses the code of the game.
+    """
+
+    def __init__(self, replicas: int, bank_level: int, dragon_boost: int,
+                 rng: np.random.Generator):
+        self.replicas = replicas
+        self.bank_level = bank_level
+        self.dragon_boost = dragon_boost
+        self.rng = rng
+        self.resting = resting_values(bank_level)
+
+        shape = (replicas, conf.GOOD_COUNT)
+        self.mode = MODE_CHOICES[rng.integers(len(MODE_CHOICES), size=shape)]
+        self.dur = np.floor(10 + rng.random(shape) * 690)
+        self.val = np.broadcast_to(self.resting, shape).copy()
+        self.d = rng.random(shape) * 0.2 - 0.1
+
+    def branch(self, values: np.ndarray) -> "Market":
+        """
+        A copy of the markets in which every good has the given value.
+        The copy shares the random number generator of the original.
+        """
+        market = copy.copy(self)
+        market.mode, market.dur, market.d = self.mode.copy(), self.dur.copy(), self.d.copy()
+        market.val = np.broadcast_to(values, self.val.shape).copy()
+        return market
+
+    def tick(self) -> np.ndarray:
+        """
+        Advance all markets by one tick.
+        Returns the new values, an array of shape `(replicas, GOOD_COUNT)`.
+        """
+        db = self.dragon_boost
+        mode, val, d = self.mode, self.val, self.d
+        u = self.rng.random((_DRAWS,) + val.shape)
+        g = self.rng.random((3, self.replicas, 1))
+
+        d *= 0.97 + 0.01 * db
+        d *= D_DECAY[mode]
+        d += D_SCALE[mode] * (u[0] - D_SHIFT[mode])
+        val += VAL_KICK[mode] * u[1]
+
+        val += (self.resting - val) * 0.01
+
+        # Global event shared by all goods of a market
+        glob_d = np.where(g[0] < 0.1 + 0.1 * db, (g[1] - 0.5) * 2, 0.0)
+        hit = (glob_d != 0) & (u[2] < g[2])
+        if hit.any():
+            glob_d = np.where(hit, glob_d, 0.0)
+            val -= (1 + d * u[3] ** 3 * 7) * glob_d
+            val -= glob_d * (1 + u[4] ** 3 * 7)
+            d += glob_d * (1 + u[5] * 4)
+            self.dur[hit] = 0
+
+        val += ((u[6] - 0.5) * 2) ** 11 * 3
+        d += 0.1 * (u[7] - 0.5)
+        val += (u[8] < 0.15) * (u[9] - 0.5) * 3
+        val += (u[10] < 0.03) * (u[11] - 0.5) * (10 + 10 * db)
+        d += (u[12] < 0.1) * (u[13] - 0.5) * (0.3 + 0.2 * db)
+
+        chaotic = mode == 5
+        val += (chaotic & (u[14] < 0.5)) * (u[15] - 0.5) * 10
+        np.copyto(d, (u[17] - 0.5) * (2 + 6 * db), where=chaotic & (u[16] < 0.2))
+
+        rising = mode == 3
+        kick = rising & (u[18] < 0.3)
+        d += kick * (u[19] - 0.5) * 0.1
+        val += kick * (u[20] - 0.7) * 10
+        mode[rising & (u[21] < 0.03)] = 4
+        kick = (mode == 4) & (u[22] < 0.3)
+        d += kick * (u[23] - 0.5) * 0.1
+        val += kick * (u[24] - 0.3) * 10
+
+        d[(val > 100 + (self.bank_level - 1) * 3) & (d > 0)] *= 0.9
+
+        val += d
+        low = val < 5
+        val += low * (5 - val) * 0.5
+        d[(val < 5) & (d < 0)] *= 0.95
+        np.maximum(val, 1, out=val)
+
+        self.dur -= 1
+        expired = self.dur <= 0
+        if expired.any():
+            self.dur[expired] = np.floor(
+                10 + u[25][expired] * (690 - 200 * db))
+            new_mode = MODE_CHOICES[(u[29] * len(MODE_CHOICES)).astype(np.intp)]
+            new_mode[(mode >= 3) & (mode <= 4) & (u[28] < 0.7)] = 5
+            new_mode[(u[26] < db) & (u[27] < 0.5)] = 5
+            mode[expired] = new_mode[expired]
+        return val
+
+    def run(self, ticks: int, on_block, block_size: int = 1024):
+        """
+        Advance all markets by `ticks` ticks.
+
+        The values are collected in blocks of up to `block_size` ticks and passed to
+        `on_block` as an array of shape `(ticks_in_block, replicas, GOOD_COUNT)`.
+        The array is reused between blocks, so `on_block` must not keep a reference to it.
+        """
+        block = np.empty((min(block_size, ticks), self.replicas, conf.GOOD_COUNT))
+        done = 0
+        while done < ticks:
+            n = min(block_size, ticks - done)
+            for i in range(n):
+                block[i] = self.tick()
+            on_block(block[:n])
+            done += n
+
+
+def _run_shard(market: Market, ticks: int, warmup: int, summaries: list) -> tuple[Market, list]:
+    """
+    Advance a shard's markets by `warmup` unrecorded ticks, then by `ticks` ticks
+    whose values are added to each of the empty `summaries` (like a `QuantileSketch`
+    or a `ReturnHistogram`).
+    Returns the advanced markets, because the worker process only has a copy of them.
+    """
+    for _ in range(warmup):
+        market.tick()
+
+    def on_block(block: np.ndarray):
+        for summary in summaries:
+            summary.add(block)
+
+    market.run(ticks, on_block)
+    return market, summaries
+
+
+class ShardPool:
+    """
+    Shards of markets that are advanced in parallel on a pool of up to `workers`
+    processes, one round at a time, recording their values in summaries like the
+    given ones. The results do not depend on the number of processes.
+
+    Before their first round, the markets run `warmup` ticks that are not recorded,
+    so that the results do not depend on the initial state.
+    """
+
+    def __init__(self, markets: list[Market], warmup: int, summaries: list, workers: int = 1):
+        self.markets = markets
+        self._warmup = warmup
+        self._summaries = summaries
+        workers = min(workers, len(markets))
+        self._pool = None
+        if workers > 1:
+            # The simulation may run next to the threads of the analyzer, and forking
+            # a process with threads can deadlock
+            self._pool = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    def _empty(self) -> list:
+        return [summary.empty() for summary in self._summaries]
+
+    def run(self, years: float) -> list[list]:
+        """
+        Simulate `years` in-game years, divided between the shards.
+        Returns the summaries of the values simulated by each shard in this round.
+        """
+        total_ticks = int(years * TICKS_PER_YEAR)
+        # Ticks per market, rounded up
+        ticks = -(-total_ticks // sum(market.replicas for market in self.markets))
+        args = (ticks, self._warmup)
+        if self._pool is None:
+            # Advance a copy like a worker process would, so the markets stay
+            # unchanged if the round is interrupted
+            results = [_run_shard(copy.deepcopy(market), *args, self._empty())
+                       for market in self.markets]
+        else:
+            futures = [self._pool.submit(_run_shard, market, *args, self._empty())
+                       for market in self.markets]
+            results = [future.result() for future in futures]
+        self._warmup = 0
+        self.markets[:] = [market for market, _ in results]
+        return [summaries for _, summaries in results]
+
+
+def new_markets(replicas: int, bank_level: int, has_supreme_intellect: bool,
+                seed=None) -> list[Market]:
+    """
+    `replicas` markets, divided evenly between independently seeded shards of
+    about `REPLICAS_PER_SHARD` markets.
+    """
+    replicas = max(1, replicas)
+    shards = -(-replicas // REPLICAS_PER_SHARD)
+    seeds = np.random.SeedSequence(seed).spawn(shards)
+    return [Market(len(part), bank_level, int(has_supreme_intellect), np.random.default_rng(s))
+            for part, s in zip(np.array_split(np.arange(replicas), shards), seeds)]
+
+
+@dataclass
+class SimulationState:
+    """
+    Everything needed to continue a simulation: the markets of every shard and
+    the summary of the values simulated so far.
+    """
+    markets: list[Market]
+    sketch: QuantileSketch
+    years: float = 0.0
+    warmed_up: bool = False
+    # Quantiles of every batch, used by the adaptive mode
+    batch_qs: list[float] = field(default_factory=list)
+    batch_estimates: list[np.ndarray] = field(default_factory=list)
+
+    @classmethod
+    def new(cls, replicas: int, bank_level: int, has_supreme_intellect: bool,
+            seed=None) -> "SimulationState":
+        """
+        Create the state of a new simulation of `replicas` markets, split into
+        independently seeded shards (see `new_markets()`).
+        """
+        markets = new_markets(replicas, bank_level, has_supreme_intellect, seed)
+        return cls(markets, QuantileSketch(conf.GOOD_COUNT))
+
+    def shard_pool(self, workers: int = 1, warmup: int = 2000) -> ShardPool:
+        """
+        Create the pool that advances the markets on up to `workers` processes,
+        to be used with `run_round()`.
+        """
+        return ShardPool(list(self.markets), 0 if self.warmed_up else warmup, [self.sketch],
+                         workers)
+
+    def run_round(self, pool: ShardPool, years: float) -> list[QuantileSketch]:
+        """
+        Simulate `years` in-game years, divided between the shards.
+        The state is only updated once the round is complete, so it stays consistent
+        if the round is interrupted.
+
+        Returns:
+            The sketch of the values simulated by each shard in this round.
+        """
+        sketches = [sketch for sketch, in pool.run(years)]
+        counts = self.sketch.counts + sum(sketch.counts for sketch in sketches)
+        self.markets = list(pool.markets)
+        self.warmed_up = True
+        self.sketch.counts = counts
+        self.years += years
+        return sketches
+
+
+def simulate_returns(markets: list[Market], lookback: int, horizon: int, years: float,
+                     workers: int = 1, batch_years: float = 0.25, warmup: int = 2000,
+                     on_round=None) -> ReturnHistogram:
+    """
+    Simulate `years` in-game years with new `markets` on up to `workers` processes,
+    only counting the forward returns of the goods in a `ReturnHistogram` with the
+    given `lookback` and `horizon`. `on_round` is called with the number of years
+    simulated so far after every round.
+    """
+    returns = ReturnHistogram(conf.GOOD_COUNT, resting_values(markets[0].bank_level),
+                              lookback, horizon)
+    done = 0.0
+    with ShardPool(list(markets), warmup, [returns], workers) as pool:
+        while done < years:
+            round_years = min(batch_years * len(markets), years - done)
+            for shard, in pool.run(round_years):
+                returns.merge(shard)
+            done += round_years
+            if on_round:
+                on_round(done)
+    return returns
+
+
+def simulate(state: SimulationState, years: float, workers: int = 1, batch_years: float = 0.25,
+             on_round=None) -> QuantileSketch:
+    """
+    Continue a simulation on up to `workers` processes until `years` in-game years
+    have been simulated in total, in rounds in which every shard simulates `batch_years`.
+    `on_round` is called with the state after every round.
+
+    Returns:
+        A sketch of the distribution of the values of every good.
+    """
+    log.info(f"Simulating {years - state.years:g} years in {len(state.markets)} shards "
+             f"on up to {workers} processes...")
+    start, start_ticks = time.perf_counter(), state.sketch.total
+    with state.shard_pool(workers) as pool:
+        while state.years < years:
+            state.run_round(pool, min(batch_years * len(state.markets),
+                                      years - state.years))
+            if on_round:
+                on_round(state)
+    _log_throughput(state.sketch.total - start_ticks, start)
+    return state.sketch
+
+
+# Minimum number of batches used to estimate the confidence intervals
+MIN_BATCHES = 8
+
+
+def _t95(df: int) -> float:
+    """Approximate two-sided 95% quantile of Student's t-distribution."""
+    z = 1.959964
+    return z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+
+
+def confidence_half_widths(estimates: np.ndarray) -> np.ndarray:
+    """
+    Half-widths of the 95% confidence intervals of quantiles, estimated from the
+    spread of the quantiles of independent batches.
+
+    Args:
+        estimates: Array of shape `(batches, GOOD_COUNT, quantiles)`.
+    Returns:
+        Array of shape `(GOOD_COUNT, quantiles)`.
+    """
+    n = len(estimates)
+    return _t95(n - 1) * estimates.std(axis=0, ddof=1) / np.sqrt(n)
+
+
+def simulate_adaptive(state: SimulationState, qs: list[float], tolerance: float,
+                      max_years: float, workers: int = 1, batch_years: float = 0.25,
+                      on_round=None) -> np.ndarray:
+    """
+    Continue a simulation on up to `workers` processes until the quantiles `qs`
+    of every good are known precisely enough, or until `max_years` in-game years
+    have been simulated.
+
+    Every round, each shard simulates a batch of `batch_years`. After each round
+    the 95% confidence intervals of the quantiles are estimated by comparing the
+    batches, and the simulation stops once all of them are within `tolerance`
+    of the estimate. `on_round` is called with the state after every round.
+
+    Returns:
+        The achieved half-widths of the confidence intervals, with shape
+        `(GOOD_COUNT, len(qs))`. The sketch of all simulated values is `state.sketch`.
+    """
+    if state.batch_qs != qs:
+        state.batch_qs, state.batch_estimates = list(qs), []
+    log.info(
+        f"Simulating until quantiles {qs} are within {tolerance} (at most {max_years} years)...")
+    start, start_ticks = time.perf_counter(), state.sketch.total
+
+    def precision():
+        if len(state.batch_estimates) < MIN_BATCHES:
+            return np.full((conf.GOOD_COUNT, len(qs)), np.inf)
+        return confidence_half_widths(np.stack(state.batch_estimates))
+
+    half_widths = precision()
+    with state.shard_pool(workers) as pool:
+        while half_widths.max() > tolerance and state.years < max_years:
+            sketches = state.run_round(pool, batch_years * len(state.markets))
+            state.batch_estimates += [sketch.quantiles(qs) for sketch in sketches]
+            half_widths = precision()
+            if on_round:
+                on_round(state)
+            if len(state.batch_estimates) >= MIN_BATCHES:
+                log.info(
+                    f"Simulated {state.years:g} years, precision: ±{half_widths.max():.3f}")
+
+    if half_widths.max() <= tolerance:
+        log.info(f"Simulation converged, precision: ±{half_widths.max():.3f}")
+    else:
+        log.warn(
+            f"Simulation did not converge within {max_years} years, "
+            f"precision: ±{half_widths.max():.3f}")
+    _log_throughput(state.sketch.total - start_ticks, start)
+    return half_widths
+
+
+def _log_throughput(ticks: int, start: float):
+    elapsed = time.perf_counter() - start
+    if ticks:
+        log.info(
+            f"Simulated {ticks} ticks in {elapsed:.1f}s ({ticks / elapsed:,.0f} ticks/s)")
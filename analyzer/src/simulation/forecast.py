@@ -0,0 +1,84 @@
+import time
+import numpy as np
+from config import conf
+from logger import log
+from simulation.engine import Market
+
+
+class Forecaster:
+    """
+    Forecasts whether the goods will reach their thresholds within the next ticks,
+    by simulating many possible futures of the market from the observed values.
+
+    Only the values of the goods can be observed; their hidden mode, drift and
+    mode duration are sampled from a batch of `paths` markets that is warmed up
+    once on creation. Every forecast starts all paths from the observed values and
+    advances them together, so all goods are forecast in one batched computation.
+    """
+
+    def __init__(self, paths: int, bank_level: int, has_supreme_intellect: bool,
+                 warmup: int = 200, seed=None):
+        self._prior = Market(paths, bank_level, int(has_supreme_intellect),
+                             np.random.default_rng(seed))
+        for _ in range(warmup):
+            self._prior.tick()
+
+    def forecast(self, values: np.ndarray, thresholds: np.ndarray, rising: np.ndarray,
+                 horizon: int, budget: float) -> dict:
+        """
+        Simulate up to `horizon` ticks and record when each path reaches the threshold
+        of each good. The simulation ends early after `budget` seconds.
+
+        Args:
+            values: The current value of every good.
+            thresholds: The threshold of every good, or NaN to not forecast a good.
+            rising: Whether each good reaches its threshold by rising to it
+                (selling) or by falling to it (buying).
+        Returns:
+            A dict with the `probability` of reaching the threshold within the
+            simulated ticks for every good, the `expectedTicks` until it is reached
+            in the paths that reach it (NaN if none do), and the number of simulated
+            ticks as `horizon`.
+        """
+        deadline = time.monotonic() + budget
+        market = self._prior.branch(values)
+
+        # Compare `sign * val >= sign * threshold` for both directions
+        sign = np.where(rising, 1.0, -1.0)
+        target = sign * thresholds
+        hit_tick = np.zeros(market.val.shape, dtype=np.int32)
+
+        ticks = 0
+        while ticks < horizon and time.monotonic() < deadline:
+            ticks += 1
+            hit = (hit_tick == 0) & (sign * market.tick() >= target)
+            hit_tick[hit] = ticks
+        if ticks < horizon:
+            log.debug(f"Forecast stopped after {ticks} of {horizon} ticks")
+
+        hits = hit_tick > 0
+        count = hits.sum(axis=0)
+        with np.errstate(invalid="ignore"):
+            expected = hit_tick.sum(axis=0) / count
+        return {
+            "probability": count / market.replicas,
+            "expectedTicks": expected,
+            "horizon": ticks,
+        }
+
+
+def init_forecaster():
+    """Create the forecaster, unless forecasts are disabled in the config."""
+    global _FORECASTER
+    if conf.FORECAST_PATHS <= 0:
+        return
+    log.info("Preparing forecaster...")
+    _FORECASTER = Forecaster(
+        conf.FORECAST_PATHS, conf.BANK_LEVEL, conf.HAS_SUPREME_INTELLECT)
+
+
+def get_forecaster() -> Forecaster | None:
+    return _FORECASTER
+
+
+_FORECASTER: Forecaster = None
@@ -1,52 +1,264 @@
-import subprocess
+import threading
+from config import conf
 from logger import log
+from simulation import cache, checkpoint, engine
+from simulation.conditional import ConditionalTable
+from simulation.distribution import Distribution
 
+# Length of the provisional simulation used while the full one is running
+PROVISIONAL_YEARS = 0.05
+PROVISIONAL_REPLICAS = 32
 
-def read_quartiles():
-    with open("simulation/simulation_results.txt", "r") as file:
-        data = file.read().strip()
-        global _QUARTILES
-        _QUARTILES = [[float(num) for num in string.split(" ")]
-                      for string in data.split("\n")]
-        log.info("Simulation data initialized successfully")
 
+def sim_settings() -> dict:
+    """The settings that the distribution of the simulated values depends on."""
+    settings = {
+        "bankLevel": conf.BANK_LEVEL,
+        "hasSupremeIntellect": conf.HAS_SUPREME_INTELLECT,
+        "simulationYears": conf.SIMULATION_YEARS,
+        "engineVersion": engine.ENGINE_VERSION,
+    }
+    if conf.SIMULATION_TOLERANCE:
+        # The length of an adaptive simulation depends on the quantiles it targets
+        settings["simulationTolerance"] = conf.SIMULATION_TOLERANCE
+        settings["quantiles"] = target_quantiles()
+    return settings
+
+
+def table_settings() -> dict:
+    """
+    The settings that the conditional table depends on. It is simulated apart
+    from the distribution, so that changing them does not simulate it again.
+    """
+    return {
+        "bankLevel": conf.BANK_LEVEL,
+        "hasSupremeIntellect": conf.HAS_SUPREME_INTELLECT,
+        "conditionalLookback": conf.CONDITIONAL_LOOKBACK,
+        "conditionalHorizon": conf.CONDITIONAL_HORIZON,
+        "conditionalYears": conf.CONDITIONAL_YEARS,
+        "engineVersion": engine.ENGINE_VERSION,
+    }
+
+
+def checkpoint_settings() -> dict:
+    """
+    The settings that a simulation state depends on. Unlike `sim_settings()`
+    it does not include the length of the simulation, so that a checkpoint can
+    be extended to more years. Nor does it include the number of processes, so
+    that it can be resumed on any machine.
+    """
+    return {
+        "bankLevel": conf.BANK_LEVEL,
+        "hasSupremeIntellect": conf.HAS_SUPREME_INTELLECT,
+        "replicas": conf.SIMULATION_REPLICAS,
+        "engineVersion": engine.ENGINE_VERSION,
+    }
+
+
+def target_quantiles() -> list[float]:
+    """The quantiles that are used as thresholds."""
+    return [conf.BUY_QUARTILE, conf.SELL_QUARTILE]
+
+
+def _simulate_table(years: float, replicas: int, workers: int, on_round=None
+                    ) -> ConditionalTable:
+    markets = engine.new_markets(replicas, conf.BANK_LEVEL, conf.HAS_SUPREME_INTELLECT)
+    returns = engine.simulate_returns(markets, conf.CONDITIONAL_LOOKBACK,
+                                      conf.CONDITIONAL_HORIZON, years, workers,
+                                      on_round=on_round)
+    return returns.table()
+
+
+def run_table_simulation() -> ConditionalTable | None:
+    """
+    Simulate the conditional table, which takes `conf.CONDITIONAL_YEARS` instead
+    of the years of the full simulation.
+    Returns `None` if the simulation failed or was stopped.
+    """
+    log.info(f"Simulating {conf.CONDITIONAL_YEARS:g} years for the conditional table...")
+
+    def on_round(years: float):
+        if _STOP.is_set():
+            raise SimulationStopped()
 
-def init_sim_data():
     try:
-        read_quartiles()
-        return True
-    except FileNotFoundError:
-        if run_simulation():
-            read_quartiles()
-            return True
-        return False
+        return _simulate_table(conf.CONDITIONAL_YEARS, conf.SIMULATION_REPLICAS,
+                               conf.SIMULATION_SHARDS, on_round)
+    except SimulationStopped:
+        log.info("Simulation of the conditional table stopped")
+    except Exception:
+        log.exception("Simulation of the conditional table failed to run")
+    return None
 
 
-def get_quartiles():
-    return _QUARTILES
+def _store_table(key: str, table: ConditionalTable) -> ConditionalTable:
+    return cache.store_table(key, table, conf.SIMULATION_CACHE_SIZE)
 
 
-_QUARTILES: list[list[float]] = []
+def init_sim_data():
+    """Load the simulation results, running the simulations first if there are none."""
+    key = cache.cache_key(sim_settings())
+    table_key = cache.cache_key(table_settings())
+    dist, table = cache.load(key), cache.load_table(table_key)
+    if dist is None:
+        state = run_simulation()
+        if state is None:
+            return False
+        dist = cache.store(key, state.sketch, conf.SIMULATION_CACHE_SIZE)
+    else:
+        log.info("Using cached simulation results")
+    if table is None:
+        table = run_table_simulation()
+        if table is None:
+            return False
+        table = _store_table(table_key, table)
+    _use_results((dist, table))
+    return True
+
 
+def _use_results(results: tuple[Distribution, ConditionalTable]):
+    global _DISTRIBUTION, _TABLE
+    _DISTRIBUTION, _TABLE = results
+    _STATUS.update(state="done", years=conf.SIMULATION_YEARS)
+    log.info("Simulation data initialized successfully")
 
-def run_simulation():
+
+def start_sim_data():
     """
-    This function runs the simulation.
+    Make simulation results available without waiting for the full simulation.
+
+    If there are no cached results, the results of a short provisional simulation
+    are used while the full simulation runs in a background thread. Once it is done,
+    `get_distribution()` switches to its results. The same goes for the conditional
+    table, which is simulated after the distribution.
     """
+    global _DISTRIBUTION, _TABLE, _THREAD
+    key = cache.cache_key(sim_settings())
+    table_key = cache.cache_key(table_settings())
+    dist, table = cache.load(key), cache.load_table(table_key)
+    if dist is not None and table is not None:
+        log.info("Using cached simulation results")
+        _use_results((dist, table))
+        return True
 
-    # Check if tsx is installed
-    process = subprocess.run(  # Change to the simulation directory
-        ["npm", "list", "tsx"], capture_output=True, text=True, cwd="simulation")
-    if "tsx@" not in process.stdout:
-        log.error(
-            "tsx is not installed. Please install go to the `simulation` directory and run `npm install`.")
+    log.info("Running a short provisional simulation...")
+    try:
+        if dist is None:
+            state = engine.SimulationState.new(
+                PROVISIONAL_REPLICAS, conf.BANK_LEVEL, conf.HAS_SUPREME_INTELLECT)
+            engine.simulate(state, PROVISIONAL_YEARS)
+            _DISTRIBUTION = Distribution.from_sketch(state.sketch)
+        else:
+            _DISTRIBUTION = dist
+        _TABLE = table or _simulate_table(PROVISIONAL_YEARS, PROVISIONAL_REPLICAS, 1)
+    except Exception:
+        log.exception("Provisional simulation failed to run")
         return False
+    _STATUS.update(state="running", years=0.0 if dist is None else conf.SIMULATION_YEARS)
+    log.info("Using provisional simulation data until the full simulation is done")
 
-    log.info("Running stock market simulation...")
-    # Run the TypeScript simulation file
-    process = subprocess.run(["npx", "tsx", "stockmarketsim.ts"],
-                             cwd="simulation")
-    if process.returncode != 0:
-        log.error("Simulation failed to run.")
-        return False
+    _THREAD = threading.Thread(
+        target=_run_background_simulation,
+        args=(None if dist else key, None if table else table_key), daemon=True)
+    _THREAD.start()
     return True
+
+
+def _run_background_simulation(key: str | None, table_key: str | None):
+    """Simulate the distribution and the table whose keys are given, and switch to them."""
+    global _DISTRIBUTION, _TABLE
+    if key is not None:
+        state = run_simulation()
+        if state is None:
+            _STATUS.update(state="stopped" if _STOP.is_set() else "failed")
+            return
+        # Swap in the refined results, each in a single assignment
+        _DISTRIBUTION = cache.store(key, state.sketch, conf.SIMULATION_CACHE_SIZE)
+    if table_key is not None:
+        table = run_table_simulation()
+        if table is None:
+            _STATUS.update(state="stopped" if _STOP.is_set() else "failed")
+            return
+        _TABLE = _store_table(table_key, table)
+    _STATUS.update(state="done")
+    log.info("Switched to the results of the full simulation")
+
+
+def stop_sim_data():
+    """Stop a background simulation after its current round and wait for it to save its progress."""
+    _STOP.set()
+    if _THREAD is not None:
+        _THREAD.join()
+
+
+def get_distribution() -> Distribution:
+    return _DISTRIBUTION
+
+
+def get_conditional_table() -> ConditionalTable:
+    return _TABLE
+
+
+def get_status() -> dict:
+    """
+    The progress of the simulation, with the `state` "done", "running", "stopped"
+    or "failed" and the number of simulated `years` out of `targetYears`.
+    """
+    return {**_STATUS, "targetYears": conf.SIMULATION_YEARS}
+
+
+_DISTRIBUTION: Distribution = None
+_TABLE: ConditionalTable = None
+_STATUS = {"state": "running", "years": 0.0}
+_THREAD: threading.Thread = None
+_STOP = threading.Event()
+
+
+class SimulationStopped(Exception):
+    """Raised to end a simulation that was stopped with `stop_sim_data()`."""
+
+
+def run_simulation() -> engine.SimulationState | None:
+    """
+    This function runs the simulation, resuming or extending the last checkpoint
+    with the same settings if there is one.
+    Returns the state of the finished simulation, or `None` if the simulation
+    failed or was stopped.
+    """
+    key = cache.cache_key(checkpoint_settings())
+    state = checkpoint.load(key)
+    if state is None:
+        log.info("Running stock market simulation...")
+        state = engine.SimulationState.new(
+            conf.SIMULATION_REPLICAS, conf.BANK_LEVEL, conf.HAS_SUPREME_INTELLECT)
+    else:
+        log.info(
+            f"Resuming stock market simulation from checkpoint ({state.years:g} years simulated)...")
+    _STATUS.update(years=state.years)
+
+    save_checkpoint = checkpoint.Checkpointer(key, conf.SIMULATION_CACHE_SIZE)
+
+    def on_round(state: engine.SimulationState):
+        save_checkpoint(state)
+        _STATUS.update(years=state.years)
+        if _STOP.is_set():
+            raise SimulationStopped()
+
+    try:
+        if conf.SIMULATION_TOLERANCE:
+            engine.simulate_adaptive(
+                state, target_quantiles(), conf.SIMULATION_TOLERANCE,
+                conf.SIMULATION_YEARS, conf.SIMULATION_SHARDS, on_round=on_round)
+        else:
+            engine.simulate(state, conf.SIMULATION_YEARS, conf.SIMULATION_SHARDS,
+                            on_round=on_round)
+    except SimulationStopped:
+        log.info(f"Simulation stopped after {state.years:g} years")
+        return None
+    except Exception:
+        log.exception("Simulation failed to run")
+        return None
+    finally:
+        # Keep the progress, so the simulation can be resumed or extended later
+        checkpoint.save(key, state, conf.SIMULATION_CACHE_SIZE)
+    return state
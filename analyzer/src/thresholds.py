@@ -0,0 +1,45 @@
+import json
+import os
+from logger import log
+
+THRESHOLDS_FILE = "simulation/thresholds.json"
+
+
+def save(buy_quantiles: list[float], sell_quantiles: list[float], sim_key: str,
+         path: str = THRESHOLDS_FILE):
+    """
+    Save the buy and sell quantile of every good, found for the simulation results
+    with the cache key `sim_key`.
+    """
+    data = {"simulation": sim_key, "buy": buy_quantiles, "sell": sell_quantiles}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=4)
+    os.replace(tmp_path, path)
+
+
+def load(sim_key: str, goods: int, path: str = THRESHOLDS_FILE
+         ) -> tuple[list[float], list[float]] | None:
+    """
+    Load the buy and sell quantile of every good.
+    Returns `None` if there is no valid table for the simulation results with the
+    cache key `sim_key`.
+    """
+    try:
+        with open(path, "r") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        log.warn(f"No threshold table found at {path}, run `main.py optimize` to create one")
+        return None
+    except (OSError, ValueError) as e:
+        log.warn(f"Ignoring unreadable threshold table {path}: {e}")
+        return None
+    if data.get("simulation") != sim_key:
+        log.warn("Ignoring threshold table that was optimized for different simulation settings")
+        return None
+    buy, sell = data.get("buy"), data.get("sell")
+    if not isinstance(buy, list) or not isinstance(sell, list) \
+            or len(buy) != goods or len(sell) != goods:
+        log.warn(f"Ignoring invalid threshold table {path}")
+        return None
+    return buy, sell
@@ -1,28 +1,19 @@
 from datetime import datetime
-from config import conf
-from logger import log
-import request
+from outbox import get_outbox
 
 
 def push_values(goods: dict, actions: list[dict], timestamp: datetime):
     """
     Push combined goods data, actions, and timestamp to the server.
 
+    The update is saved in the outbox, whose thread sends it together with all
+    updates that could not be sent before.
+
     Args:
         goods: Map keyed by symbol with `value` and `bought` keys
         actions: List of recommended actions
         timestamp: Datetime object representing when the screenshot was taken
     """
-    # Prepare the data payload
-    payload = {
-        "instanceId": conf.INSTANCE_ID,
-        "timestamp": timestamp.isoformat(),
-        "goods": goods,
-        "actions": actions
-    }
-
-    res = request.post(
-        conf.Endpoint.UPDATE, payload).as_result()
-
-    if not res.success:
-        log.error(f"Failed to push values to server: {res.error}")
+    outbox = get_outbox()
+    outbox.append(timestamp.isoformat(), goods, actions)
+    outbox.wake()
@@ -0,0 +1,206 @@
+import ctypes
+import ctypes.util
+import numpy as np
+
+# Constants from X11/X.h and sys/ipc.h
+_Z_PIXMAP = 2
+_ALL_PLANES = 0xFFFFFFFF
+_IPC_PRIVATE = 0
+_IPC_CREAT = 0o1000
+_IPC_RMID = 0
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ("shmseg", ctypes.c_ulong),
+        ("shmid", ctypes.c_int),
+        ("shmaddr", ctypes.c_void_p),
+        ("readOnly", ctypes.c_int),
+    ]
+
+
+class _XImage(ctypes.Structure):
+    # Only the fields that are used, the rest of the struct is never accessed
+    _fields_ = [
+        ("width", ctypes.c_int),
+        ("height", ctypes.c_int),
+        ("xoffset", ctypes.c_int),
+        ("format", ctypes.c_int),
+        ("data", ctypes.c_void_p),
+        ("byte_order", ctypes.c_int),
+        ("bitmap_unit", ctypes.c_int),
+        ("bitmap_bit_order", ctypes.c_int),
+        ("bitmap_pad", ctypes.c_int),
+        ("depth", ctypes.c_int),
+        ("bytes_per_line", ctypes.c_int),
+        ("bits_per_pixel", ctypes.c_int),
+    ]
+
+
+class _XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("display", ctypes.c_void_p),
+        ("resourceid", ctypes.c_ulong),
+        ("serial", ctypes.c_ulong),
+        ("error_code", ctypes.c_ubyte),
+        ("request_code", ctypes.c_ubyte),
+        ("minor_code", ctypes.c_ubyte),
+    ]
+
+
+_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(_XErrorEvent))
+
+
+def _load(name: str) -> ctypes.CDLL:
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise OSError(f"lib{name} not found")
+    return ctypes.CDLL(path)
+
+
+def _libraries() -> tuple[ctypes.CDLL, ctypes.CDLL, ctypes.CDLL]:
+    """Load libX11, libXext and libc, and declare the functions that are used."""
+    x11, xext, libc = _load("X11"), _load("Xext"), _load("c")
+    x11.XOpenDisplay.restype = ctypes.c_void_p
+    x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+    x11.XRootWindow.restype = ctypes.c_ulong
+    x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDefaultVisual.restype = ctypes.c_void_p
+    x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XFree.argtypes = [ctypes.c_void_p]
+    x11.XSetErrorHandler.restype = ctypes.c_void_p
+    x11.XSetErrorHandler.argtypes = [_ERROR_HANDLER]
+    xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+    xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+    xext.XShmCreateImage.argtypes = [
+        ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p,
+        ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+    xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+    xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+    xext.XShmGetImage.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage), ctypes.c_int, ctypes.c_int,
+        ctypes.c_ulong]
+    libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+    libc.shmat.restype = ctypes.c_void_p
+    libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+    libc.shmdt.argtypes = [ctypes.c_void_p]
+    libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+    return x11, xext, libc
+
+
+class XShmGrabber:
+    """
+    Grabs a fixed rectangle of an X11 screen through the MIT shared memory
+    extension, so that the X server writes the pixels directly into a buffer
+    that is allocated once and reused for every frame.
+    """
+
+    def __init__(self, x: int, y: int, width: int, height: int):
+        self.x, self.y, self.width, self.height = x, y, width, height
+        self._x11, self._xext, self._libc = _libraries()
+        self._display = None
+        self._image = None
+        self._info = _XShmSegmentInfo(shmid=-1)
+        self._attached = False
+        self._error = None
+        # Errors are reported to this handler instead of exiting the process
+        self._handler = _ERROR_HANDLER(self._on_error)
+        try:
+            self._open()
+        except Exception:
+            self.close()
+            raise
+
+    def _on_error(self, display, event) -> int:
+        self._error = event.contents.error_code
+        return 0
+
+    def _check(self, action: str):
+        self._x11.XSync(self._display, 0)
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise OSError(f"X error {error} while trying to {action}")
+
+    def _open(self):
+        x11, xext, libc = self._x11, self._xext, self._libc
+        self._display = x11.XOpenDisplay(None)
+        if not self._display:
+            raise OSError("Cannot open the X display")
+        x11.XSetErrorHandler(self._handler)
+        if not xext.XShmQueryExtension(self._display):
+            raise OSError("The X server does not support shared memory")
+        screen = x11.XDefaultScreen(self._display)
+        if self.x < 0 or self.y < 0 or self.width <= 0 or self.height <= 0 \
+                or self.x + self.width > x11.XDisplayWidth(self._display, screen) \
+                or self.y + self.height > x11.XDisplayHeight(self._display, screen):
+            raise ValueError("The bounds are not inside the screen")
+        self._root = x11.XRootWindow(self._display, screen)
+
+        self._image = xext.XShmCreateImage(
+            self._display, x11.XDefaultVisual(self._display, screen),
+            x11.XDefaultDepth(self._display, screen), _Z_PIXMAP, None,
+            ctypes.byref(self._info), self.width, self.height)
+        if not self._image:
+            raise OSError("Cannot create a shared memory image")
+        image = self._image.contents
+        if image.bits_per_pixel != 32:
+            raise OSError(f"Unsupported screen format with {image.bits_per_pixel} bits per pixel")
+        size = image.bytes_per_line * self.height
+        self._info.shmid = libc.shmget(_IPC_PRIVATE, size, _IPC_CREAT | 0o600)
+        if self._info.shmid < 0:
+            raise OSError("Cannot allocate shared memory")
+        address = libc.shmat(self._info.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            raise OSError("Cannot attach shared memory")
+        self._info.shmaddr = image.data = address
+        self._info.readOnly = 0
+        self._attached = bool(xext.XShmAttach(self._display, ctypes.byref(self._info)))
+        self._check("attach shared memory")
+        # The segment is freed once both this process and the X server detached it
+        libc.shmctl(self._info.shmid, _IPC_RMID, None)
+        self._info.shmid = -1
+
+        buffer = (ctypes.c_ubyte * size).from_address(address)
+        # The whole buffer, with rows of `stride` bytes that may be padded
+        self.buffer = np.ctypeslib.as_array(buffer).reshape(self.height, image.bytes_per_line)
+        self.stride = image.bytes_per_line
+        self._frame = self.buffer[:, :self.width * 4].reshape(self.height, self.width, 4)
+
+    def grab(self) -> np.ndarray:
+        """
+        Grab the rectangle from the screen.
+        Returns a view of the shared buffer with shape `(height, width, 4)` in BGRX
+        order. It is overwritten by the next grab.
+        """
+        if not self._xext.XShmGetImage(self._display, self._root, self._image,
+                                       self.x, self.y, _ALL_PLANES):
+            raise OSError("Cannot grab the screen")
+        self._check("grab the screen")
+        return self._frame
+
+    def close(self):
+        if self._attached:
+            self._xext.XShmDetach(self._display, ctypes.byref(self._info))
+            self._x11.XSync(self._display, 0)
+            self._attached = False
+        if self._info.shmaddr:
+            self._libc.shmdt(self._info.shmaddr)
+            self._info.shmaddr = None
+        if self._info.shmid >= 0:
+            self._libc.shmctl(self._info.shmid, _IPC_RMID, None)
+            self._info.shmid = -1
+        if self._image:
+            # The data is shared memory, so only the struct is freed
+            self._image.contents.data = None
+            self._x11.XFree(self._image)
+            self._image = None
+        if self._display:
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
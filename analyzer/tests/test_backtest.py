@@ -0,0 +1,105 @@
+import bisect
+import os
+import sys
+import unittest
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC_DIR)
+import config  # noqa: E402
+from config import conf  # noqa: E402
+conf.config_file = os.path.join(SRC_DIR, config.CONF_FILE)
+conf.load_config()
+
+import backtest  # noqa: E402
+from analyze import GoodState  # noqa: E402
+
+WAIT, BUY, SELL = (state.value for state in GoodState)
+
+
+class ChangeTable:
+    """Stands in for a `ConditionalTable` whose expected return is the change per tick."""
+
+    def __init__(self, lookback: int):
+        self.lookback = lookback
+
+    def lookup(self, goods: np.ndarray, values: np.ndarray, deltas: np.ndarray,
+               q: float) -> np.ndarray:
+        return deltas
+
+
+class HoldBackTest(unittest.TestCase):
+
+    def test_matches_analyzer(self):
+        rng = np.random.default_rng(1)
+        states = rng.choice([WAIT, BUY, SELL], (300, 8), p=[0.4, 0.3, 0.3])
+        # Runs of the same state, as the values cross the thresholds
+        states = np.repeat(states, rng.integers(1, 5, 300), axis=0)
+        held = rng.random(states.shape) < 0.6
+        result = backtest._hold_back(states, held)
+        for column in range(states.shape[1]):
+            waiting, prev = False, WAIT
+            for step, state in enumerate(states[:, column]):
+                # Like `analyze_values()`, wait from entering a state until it is not held
+                if state != prev:
+                    waiting = True
+                if not held[step, column]:
+                    waiting = False
+                prev = state
+                expected = WAIT if waiting else state
+                self.assertEqual(result[step, column], expected, (step, column))
+
+    def test_backtest(self):
+        values = np.array([[10.0], [5.5], [5.0], [3.0], [3.5], [20.0], [20.0]])
+        expected = np.array([[0.0], [-1.0], [-1.0], [1.0], [1.0], [0.0], [0.0]])
+        ticks = np.array([0, 1, 2, 3, 5, 8, 13])
+        thresholds = np.array([6.0]), np.array([15.0])
+        eager = backtest.backtest(values, *thresholds, ticks=ticks)
+        self.assertEqual(eager["profit"][0], 15.0)
+        self.assertEqual(eager["holdSnapshots"][0], 4)
+        self.assertEqual(eager["holdTicks"][0], 11)
+        # The buy waits while the value is expected to keep falling
+        held = backtest.backtest(values, *thresholds, expected=expected, ticks=ticks)
+        self.assertEqual(held["profit"][0], 16.5)
+        self.assertEqual(held["holdSnapshots"][0], 2)
+        self.assertEqual(held["holdTicks"][0], 8)
+        self.assertNotIn("holdTicks", backtest.backtest(values, *thresholds))
+
+
+class ExpectedReturnsTest(unittest.TestCase):
+
+    def test_uneven_ticks(self):
+        rng = np.random.default_rng(2)
+        ticks = np.cumsum(rng.choice([1, 1, 2, 3, 7, 30], 400))
+        values = rng.uniform(5, 100, (len(ticks), 3))
+        table = ChangeTable(10)
+        result = backtest.expected_returns(values, np.arange(3), table, ticks)
+        for step, tick in enumerate(ticks):
+            # The last snapshot at least about `lookback` ticks before
+            past = bisect.bisect_right(ticks, tick - (table.lookback - 0.5)) - 1
+            if past < 0 or tick - ticks[past] > 2 * table.lookback:
+                self.assertTrue(np.isnan(result[step]).all(), step)
+                continue
+            change = (values[step] - values[past]) / (tick - ticks[past])
+            np.testing.assert_allclose(result[step], change, err_msg=str(step))
+
+    def test_even_ticks(self):
+        values = np.arange(20.0)[:, None] * 2
+        result = backtest.expected_returns(values, np.zeros(1, dtype=int), ChangeTable(5),
+                                           np.arange(20) * 3)
+        # Snapshots 3 ticks apart look back 6 ticks, the first time that is at least 4.5
+        self.assertTrue(np.isnan(result[:2]).all())
+        np.testing.assert_allclose(result[2:], 2 / 3)
+
+    def test_disabled(self):
+        horizon = conf.CONDITIONAL_HORIZON
+        conf.CONDITIONAL_HORIZON = 0
+        try:
+            self.assertIsNone(backtest.expected_returns(
+                np.ones((3, 1)), np.zeros(1, dtype=int), ChangeTable(5), np.arange(3)))
+        finally:
+            conf.CONDITIONAL_HORIZON = horizon
+
+
+if __name__ == "__main__":
+    unittest.main()
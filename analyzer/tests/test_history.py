@@ -0,0 +1,103 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC_DIR)
+import history  # noqa: E402
+from config import conf  # noqa: E402
+from history import History  # noqa: E402
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "history.bin")
+        self.start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def time(self, i: int) -> datetime:
+        return self.start + timedelta(minutes=i)
+
+    def values(self, i: int) -> np.ndarray:
+        return 10.0 + i + np.arange(conf.GOOD_COUNT)
+
+    def bought(self, i: int) -> np.ndarray:
+        return np.arange(conf.GOOD_COUNT) % 3 == i % 3
+
+    def fill(self, count: int) -> History:
+        records = History(self.path)
+        for i in range(count):
+            self.assertTrue(records.append(self.time(i), self.values(i), self.bought(i)))
+        return records
+
+    def test_records(self):
+        records = self.fill(10)
+        self.assertEqual(len(records), 10)
+        part = records.records(self.time(3), self.time(6))
+        np.testing.assert_array_equal(part["values"], [self.values(i) for i in range(3, 6)])
+        np.testing.assert_array_equal(history.bought(part), [self.bought(i) for i in range(3, 6)])
+        self.assertEqual(history.timestamps(part)[0].astype(datetime),
+                         self.time(3).replace(tzinfo=None))
+        self.assertEqual(len(records.records()), 10)
+        self.assertEqual(len(records.records(end=self.time(3))), 3)
+        self.assertEqual(len(records.records(self.time(6), self.time(3))), 0)
+
+    def test_at(self):
+        records = History(self.path)
+        self.assertIsNone(records.at(self.time(0)))
+        self.assertIsNone(records.last())
+        self.fill(5)
+        records = History(self.path)
+        self.assertIsNone(records.at(self.time(-1)))
+        self.assertEqual(records.at(self.time(2) + timedelta(seconds=30))["values"][0],
+                         self.values(2)[0])
+        self.assertEqual(records.last()["values"][0], self.values(4)[0])
+
+    def test_time_only_increases(self):
+        records = self.fill(3)
+        self.assertFalse(records.append(self.time(2), self.values(9), self.bought(9)))
+        self.assertFalse(records.append(self.time(1), self.values(9), self.bought(9)))
+        self.assertEqual(len(records), 3)
+
+    def test_missing_values(self):
+        records = History(self.path)
+        values = self.values(0)
+        values[1] = np.nan
+        records.append(self.time(0), values, self.bought(0))
+        self.assertTrue(np.isnan(records.last()["values"][1]))
+
+    def test_reopen_and_grow(self):
+        count = history.GROW_RECORDS + 10
+        records = self.fill(count)
+        records.flush()
+        reopened = History(self.path)
+        self.assertEqual(len(reopened), count)
+        np.testing.assert_array_equal(reopened.records()["values"][-1], self.values(count - 1))
+        # Snapshots taken before the last recorded one are still refused after a restart
+        self.assertFalse(reopened.append(self.time(count - 1), self.values(0), self.bought(0)))
+
+    def test_truncated_file(self):
+        self.fill(3).flush()
+        # The header counts more records than the file holds
+        with open(self.path, "r+b") as file:
+            file.seek(history.HEADER.size - 8)
+            file.write(np.uint64(history.GROW_RECORDS + 1).tobytes())
+        reopened = History(self.path)
+        self.assertEqual(len(reopened), history.GROW_RECORDS)
+
+    def test_other_format(self):
+        with open(self.path, "wb") as file:
+            file.write(b"\0" * history.HEADER_SIZE)
+        with self.assertRaises(ValueError):
+            History(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,276 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC_DIR)
+import config  # noqa: E402
+from config import conf  # noqa: E402
+conf.config_file = os.path.join(SRC_DIR, config.CONF_FILE)
+conf.load_config()
+
+import outbox  # noqa: E402
+
+
+def _key(action: dict) -> tuple:
+    return action["symbol"], action["type"], action["value"]
+
+
+class Outbox(outbox.Outbox):
+    """Lets tests wait until the server acknowledged updates."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acked_changed = threading.Condition()
+
+    def _ack(self, seq: int):
+        super()._ack(seq)
+        with self.acked_changed:
+            self.acked_changed.notify_all()
+
+
+class Worker(BaseHTTPRequestHandler):
+    """
+    Stands in for the worker's updateBatch endpoint: stores every update once per
+    stream and sequence number, completes updates with only the changes from the
+    update they are based on, and does not store updates in which nothing changed.
+    """
+    protocol_version = "HTTP/1.1"
+    # "up", "down" (responds with 503) or "lose_ack" (stores, but drops the response)
+    mode = "up"
+    # Requests are only answered once this is set
+    release = threading.Event()
+    # Notified whenever a request arrives or updates are stored
+    handled = threading.Condition()
+    # The sequence numbers of every request, including those that failed
+    requests: list[list[int]] = []
+    rows: dict[tuple[str, int], dict] = {}
+    deliveries: list[int] = []
+    received: list[dict] = []
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        out = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with Worker.handled:
+            Worker.requests.append([update["seq"] for update in data["updates"]])
+            Worker.handled.notify_all()
+        Worker.release.wait(5)
+        if Worker.mode == "down":
+            return self._reply(503, {"success": False, "error": "Unavailable"})
+        updates = sorted(data["updates"], key=lambda u: u["seq"])
+        Worker.received.extend(updates)
+        snapshot = None
+        if "base" in updates[0]:
+            stored = [seq for stream, seq in Worker.rows
+                      if stream == data["streamId"] and seq <= updates[0]["base"]]
+            if not stored:
+                return self._reply(409, {"success": False, "error": "Keyframe required"})
+            snapshot = Worker.rows[(data["streamId"], max(stored))]
+        for update in updates:
+            if "base" in update:
+                base, goods, sent = snapshot, update.get("goods", {}), update.get("actions", [])
+                sent_symbols = {action["symbol"] for action in sent}
+                kept = [action for action in base["actions"]
+                        if action["type"].startswith("still_") and action["symbol"] not in goods
+                        and action["symbol"] not in sent_symbols]
+                snapshot = {"goods": {**base["goods"], **goods}, "actions": kept + sent}
+                changed = bool(goods) or (sorted(map(_key, base["actions"]))
+                                          != sorted(map(_key, snapshot["actions"])))
+            else:
+                snapshot = {"goods": update["goods"], "actions": update["actions"]}
+                changed = True
+            key = (data["streamId"], update["seq"])
+            if changed and key not in Worker.rows:
+                with Worker.handled:
+                    Worker.rows[key] = snapshot
+                    Worker.deliveries.append(update["seq"])
+                    Worker.handled.notify_all()
+        if Worker.mode == "lose_ack":
+            self.close_connection = True
+            return
+        self._reply(200, {"success": True, "data": {"acked": updates[-1]["seq"]}})
+
+
+class OutboxTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Worker)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        conf.Endpoint.UPDATE_BATCH = f"http://127.0.0.1:{cls.server.server_address[1]}/update"
+        conf.INSTANCE_ID = "test"
+        conf.SESSION_TOKEN = "test"
+        conf.COMPRESS_REQUESTS = False
+        outbox.RETRY_MIN = 0.05
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        Worker.mode = "up"
+        Worker.release.set()
+        Worker.requests, Worker.rows, Worker.deliveries, Worker.received = [], {}, [], []
+        # The outbox files are saved in the working directory
+        self.cwd = os.getcwd()
+        self.dir = tempfile.TemporaryDirectory()
+        os.chdir(self.dir.name)
+        self.boxes: list[Outbox] = []
+        self.start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def tearDown(self):
+        Worker.release.set()
+        for box in self.boxes:
+            box.stop()
+        os.chdir(self.cwd)
+        self.dir.cleanup()
+
+    def open_outbox(self, **kwargs) -> Outbox:
+        box = Outbox(**kwargs)
+        self.boxes.append(box)
+        return box
+
+    def goods(self, i: int) -> dict:
+        return {"CRL": {"value": 10.0 + i % 3, "bought": False},
+                "CHC": {"value": 20.0, "bought": i % 5 == 0}}
+
+    def actions(self, i: int) -> list[dict]:
+        if i % 4:
+            return []
+        return [{"symbol": "CRL", "value": 10.0 + i % 3, "thresh": 12.0, "type": "buy"}]
+
+    def append(self, box: Outbox, i: int):
+        box.append((self.start + timedelta(minutes=i)).isoformat(), self.goods(i),
+                   self.actions(i))
+        box.wake()
+
+    def wait_sent(self, box: Outbox, timeout: float = 5):
+        with box.acked_changed:
+            self.assertTrue(box.acked_changed.wait_for(lambda: not box.pending, timeout))
+
+    def wait_worker(self, predicate, timeout: float = 5):
+        with Worker.handled:
+            self.assertTrue(Worker.handled.wait_for(predicate, timeout))
+
+    def assert_delivered(self, box: Outbox, count: int):
+        """Every update was stored exactly once, in order, with the values it was saved with."""
+        self.assertEqual(Worker.deliveries, list(range(1, count + 1)))
+        for seq in range(1, count + 1):
+            row = Worker.rows[(box.stream_id, seq)]
+            self.assertEqual(row["goods"], self.goods(seq - 1))
+            # Actions are only stored with the update in which they happened
+            self.assertEqual(row["actions"], self.actions(seq - 1))
+
+    def test_outage_and_restart(self):
+        box = self.open_outbox()
+        box.start()
+        for i in range(3):
+            self.append(box, i)
+        self.wait_sent(box)
+
+        Worker.mode = "down"
+        for i in range(3, 10):
+            self.append(box, i)
+        self.wait_worker(lambda: any(10 in seqs for seqs in Worker.requests))
+        self.assertEqual(len(box.pending), 7)
+
+        # The worker stores the updates, but the analyzer never learns it
+        Worker.mode = "lose_ack"
+        self.append(box, 10)
+        self.wait_worker(lambda: 11 in Worker.deliveries)
+        box.stop()
+        self.assertEqual(len(box.pending), 8)
+
+        Worker.mode = "up"
+        restarted = self.open_outbox()
+        self.assertEqual(restarted.stream_id, box.stream_id)
+        self.assertEqual(len(restarted.pending), 8)
+        restarted.start()
+        for i in range(11, 14):
+            self.append(restarted, i)
+        self.wait_sent(restarted)
+        self.assert_delivered(restarted, 14)
+
+    def test_full_updates(self):
+        box = self.open_outbox(delta=False)
+        box.start()
+        for i in range(5):
+            self.append(box, i)
+        self.wait_sent(box)
+        self.assert_delivered(box, 5)
+
+    def test_append_does_not_wait_for_the_server(self):
+        Worker.release.clear()
+        box = self.open_outbox()
+        box.start()
+        self.append(box, 0)
+        self.wait_worker(lambda: Worker.requests)
+        # The worker has not answered yet
+        for i in range(1, 5):
+            self.append(box, i)
+        self.assertEqual(Worker.deliveries, [])
+        Worker.release.set()
+        self.wait_sent(box)
+        self.assert_delivered(box, 5)
+
+    def test_steady_state(self):
+        box = self.open_outbox()
+        box.start()
+        goods = {"CRL": {"value": 9.0, "bought": False}, "CHC": {"value": 20.0, "bought": False}}
+        still = {"symbol": "CRL", "value": 9.0, "thresh": 10.0, "type": "still_buy"}
+        steps = [[{**still, "type": "buy"}]] + [[still]] * 5
+        for i, actions in enumerate(steps):
+            box.append((self.start + timedelta(minutes=i)).isoformat(), goods, actions)
+            box.wake()
+            self.wait_sent(box)
+        # CRL stays past its threshold, so only the first buy and still_buy are stored
+        self.assertEqual(Worker.deliveries, [1, 2])
+        for update in Worker.received[2:]:
+            self.assertEqual(set(update), {"seq", "timestamp", "base"})
+
+        # A changed value is stored with the action that is still recommended
+        moved = {**goods, "CRL": {"value": 8.0, "bought": False}}
+        box.append((self.start + timedelta(minutes=6)).isoformat(), moved,
+                   [{**still, "value": 8.0}])
+        box.wake()
+        self.wait_sent(box)
+        self.assertEqual(Worker.deliveries, [1, 2, 7])
+        self.assertEqual(Worker.rows[(box.stream_id, 7)]["actions"], [{**still, "value": 8.0}])
+
+        # So is the end of the action, even if no value changed
+        box.append((self.start + timedelta(minutes=7)).isoformat(), moved, [])
+        box.wake()
+        self.wait_sent(box)
+        self.assertEqual(Worker.deliveries, [1, 2, 7, 8])
+        self.assertEqual(Worker.rows[(box.stream_id, 8)]["actions"], [])
+
+    def test_eviction(self):
+        Worker.mode = "down"
+        box = self.open_outbox(max_bytes=2000)
+        for i in range(40):
+            self.append(box, i)
+        self.assertLessEqual(os.path.getsize(box.path), 2000)
+        Worker.mode = "up"
+        self.assertTrue(box.drain())
+        # The oldest updates were dropped, the others are stored once each
+        delivered = sorted(Worker.deliveries)
+        self.assertEqual(delivered, list(range(delivered[0], 41)))
+        self.assertEqual(len(delivered), len(set(delivered)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC_DIR)
+from scheduler import PHASE_TOLERANCE, TICK_SECONDS, TickPhase  # noqa: E402
+
+
+def _ticked(start: float, end: float, phase: float) -> bool:
+    """Whether a tick at `phase` seconds into the minute happened in `(start, end]`."""
+    return (end - phase) // TICK_SECONDS > (start - phase) // TICK_SECONDS
+
+
+def _distance(a: float, b: float) -> float:
+    """Seconds between two parts of the minute."""
+    d = abs(a - b) % TICK_SECONDS
+    return min(d, TICK_SECONDS - d)
+
+
+class TickPhaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(1)
+        self.now = 1_700_000_000.0
+
+    def observe(self, ticks: TickPhase, phase: float, count: int):
+        """Compare screenshots a random part of a minute apart."""
+        for _ in range(count):
+            start = self.now
+            self.now += self.rng.uniform(5, 40)
+            ticks.observe(start, self.now, _ticked(start, self.now, phase))
+
+    def test_unknown(self):
+        ticks = TickPhase()
+        self.assertFalse(ticks.known())
+        self.assertEqual(ticks.uncertainty(), TICK_SECONDS)
+
+    def test_estimate(self):
+        for phase in (0.4, 17.3, 59.8):
+            ticks = TickPhase()
+            self.observe(ticks, phase, 200)
+            self.assertTrue(ticks.known())
+            self.assertLessEqual(_distance(ticks.phase(), phase), PHASE_TOLERANCE)
+
+    def test_probe(self):
+        ticks = TickPhase()
+        phase = 42.0
+        for _ in range(12):
+            start = self.now
+            self.now += ticks.probe(start)
+            ticks.observe(start, self.now, _ticked(start, self.now, phase))
+            self.now += self.rng.uniform(0, TICK_SECONDS)
+        # Every probe halves the parts of the minute in which the ticks may happen
+        self.assertTrue(ticks.known())
+        self.assertLessEqual(_distance(ticks.phase(), phase), PHASE_TOLERANCE)
+
+    def test_ignores_long_intervals(self):
+        ticks = TickPhase()
+        ticks.observe(self.now, self.now + TICK_SECONDS, True)
+        ticks.observe(self.now, self.now, False)
+        self.assertEqual(ticks.uncertainty(), TICK_SECONDS)
+
+    def test_ticks_moved(self):
+        ticks = TickPhase()
+        self.observe(ticks, 10.0, 200)
+        self.observe(ticks, 40.0, 200)
+        self.assertTrue(ticks.known())
+        self.assertLessEqual(_distance(ticks.phase(), 40.0), PHASE_TOLERANCE)
+
+
+if __name__ == "__main__":
+    unittest.main()
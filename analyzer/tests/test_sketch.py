@@ -0,0 +1,97 @@
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.append(SRC_DIR)
+from simulation import distribution  # noqa: E402
+from simulation.distribution import Distribution, FormatError  # noqa: E402
+from simulation.sketch import QuantileSketch  # noqa: E402
+
+QS = [0.0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1.0]
+
+
+def _values(seed: int, count: int = 20000, goods: int = 3) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.clip(rng.lognormal(3, 1, (count, goods)), 1, 5000)
+
+
+class QuantileSketchTest(unittest.TestCase):
+
+    def test_relative_error(self):
+        values = _values(1)
+        sketch = QuantileSketch(values.shape[1])
+        sketch.add(values[:5000])
+        sketch.add(values[5000:])
+        self.assertEqual(sketch.total, len(values))
+        ranks = np.floor(np.array(QS) * (len(values) - 1)).astype(int)
+        exact = np.sort(values, axis=0)[ranks].T
+        np.testing.assert_allclose(sketch.quantiles(QS), exact, rtol=sketch.alpha)
+
+    def test_merge(self):
+        values = _values(2)
+        whole = QuantileSketch(values.shape[1])
+        whole.add(values)
+        merged = whole.empty()
+        part = whole.empty()
+        merged.add(values[:7000])
+        part.add(values[7000:])
+        merged.merge(part)
+        np.testing.assert_array_equal(merged.counts, whole.counts)
+
+    def test_empty(self):
+        sketch = QuantileSketch(2, alpha=0.01, max_value=100)
+        sketch.add(np.array([[3.0, 4.0]]))
+        empty = sketch.empty()
+        self.assertEqual((empty.goods, empty.alpha, empty.max_value), (2, 0.01, 100))
+        self.assertEqual(empty.total, 0)
+        self.assertEqual(sketch.total, 1)
+
+    def test_merge_different_parameters(self):
+        with self.assertRaises(ValueError):
+            QuantileSketch(2).merge(QuantileSketch(2, alpha=0.01))
+
+
+class DistributionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sketch = QuantileSketch(3)
+        self.sketch.add(_values(3))
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "distribution.bin")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_quantiles(self):
+        dist = Distribution.from_sketch(self.sketch)
+        np.testing.assert_allclose(dist.quantiles(QS), self.sketch.quantiles(QS),
+                                   rtol=self.sketch.alpha)
+        for good in range(dist.goods):
+            for q in QS[1:-1]:
+                self.assertAlmostEqual(dist.percentile(good, dist.quantile(good, q)), q,
+                                       delta=0.002)
+
+    def test_file(self):
+        distribution.write(self.path, self.sketch)
+        dist = Distribution.open(self.path)
+        self.assertEqual(dist.quantiles(QS), Distribution.from_sketch(self.sketch).quantiles(QS))
+        np.testing.assert_array_equal(dist.to_sketch().counts, self.sketch.counts)
+
+    def test_corrupted_file(self):
+        distribution.write(self.path, self.sketch)
+        with open(self.path, "r+b") as file:
+            file.seek(-1, os.SEEK_END)
+            file.write(b"\xff")
+        with self.assertRaises(FormatError):
+            Distribution.open(self.path)
+        with open(self.path, "r+b") as file:
+            file.truncate(10)
+        with self.assertRaises(FormatError):
+            Distribution.open(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -54,6 +54,19 @@ data class GeneralizedAction<ActionT>(
     val threshold: Double,
     @SerialName("type")
     val type: ActionT,
+    @SerialName("forecast")
+    val forecast: Forecast? = null,
+)
+
+/** Forecast of whether a good will be past the threshold of an action within the next [horizon] ticks */
+@Serializable
+data class Forecast(
+    @SerialName("probability")
+    val probability: Double,
+    @SerialName("expectedTicks")
+    val expectedTicks: Double?,
+    @SerialName("horizon")
+    val horizon: Int,
 )
 
 /** Represents a limited subset of [Action] actions that can be received via FCM */
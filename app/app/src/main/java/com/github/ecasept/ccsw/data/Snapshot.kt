@@ -16,7 +16,10 @@ data class Snapshot(
 @Serializable
 data class SnapshotEntry(
     val value: Double,
-    val bought: Boolean
+    val bought: Boolean,
+    val percentile: Double? = null,
+    /** Forecast of whether the good will reach the threshold of its next action */
+    val forecast: Forecast? = null,
 )
 
 typealias GoodHistory = List<GoodHistoryEntry>
@@ -13,7 +13,7 @@ export async function processImg(
     if (res.success === false) {
         return res.response;
     }
-    const { image, instanceId } = res.data;
+    const { image, mimeType, instanceId } = res.data;
 
     const authRes = await verifyJWT(request, env, "apiKey", instanceId);
     if (authRes.success === false) {
@@ -27,7 +27,7 @@ export async function processImg(
     const contents = [
         {
             inlineData: {
-                mimeType: "image/png",
+                mimeType,
                 data: image,
             }
         },
@@ -0,0 +1,108 @@
+import { Action, DataPushBatchSchema, Good } from "../types";
+import { ensureRequest, errorResponse, successResponse, supabase } from "../utils";
+import { sendPushNotification } from "./notifications";
+import { verifyJWT } from "./auth/verify";
+
+type Snapshot = { goods: Record<string, Good>, actions: Action[] };
+
+/** Whether two updates recommend the same actions, in any order. */
+function sameActions(a: Action[], b: Action[]): boolean {
+    return a.length === b.length && b.every(action => a.some(other =>
+        other.symbol === action.symbol && other.type === action.type && other.value === action.value
+    ));
+}
+
+/** Stores updates that are numbered by the analyzer, each only once even if it is sent again.
+ * Updates that only contain changes are completed with the goods of the update they are
+ * based on, and with its still_* actions of goods that did not change, which the analyzer
+ * does not repeat. Updates without changed goods or actions are not stored at all.
+ * Responds with the highest sequence number of the batch, as all updates up to it are stored,
+ * or with 409 if the update that the first one is based on is unknown. */
+export async function updateBatch(request: Request, env: Env, ctx: ExecutionContext): Promise<Response> {
+    const res = await ensureRequest(request, "POST", DataPushBatchSchema);
+    if (res.success === false) {
+        return res.response;
+    }
+    const data = res.data;
+
+    const authRes = await verifyJWT(request, env, "apiKey", data.instanceId);
+    if (authRes.success === false) {
+        return authRes.response;
+    }
+
+    const updates = [...data.updates].sort((a, b) => a.seq - b.seq);
+    let snapshot: Snapshot | null = null;
+    if (updates[0].base !== undefined) {
+        // Updates without changes are not stored, so the last stored one has the same values
+        const { data: rows, error } = await supabase
+            .from("value_history")
+            .select("goods, actions")
+            .eq("instance_id", data.instanceId)
+            .eq("stream_id", data.streamId)
+            .lte("seq", updates[0].base)
+            .order("seq", { ascending: false })
+            .limit(1);
+        if (error) {
+            console.error("Error fetching the base update:", error);
+            return errorResponse("Failed to store values", 500);
+        }
+        if (rows.length === 0) {
+            return errorResponse("Keyframe required", 409);
+        }
+        snapshot = { goods: rows[0].goods as Record<string, Good>, actions: rows[0].actions as Action[] };
+    }
+
+    const rows = [];
+    for (const update of updates) {
+        let changed: boolean;
+        if (update.base === undefined) {
+            snapshot = { goods: update.goods ?? {}, actions: update.actions ?? [] };
+            changed = true;
+        } else {
+            const base = snapshot!;
+            const goods = update.goods ?? {};
+            const sent = update.actions ?? [];
+            // A good that is still past its threshold keeps its action until it changes
+            const kept = base.actions.filter(action =>
+                action.type.startsWith("still_") && !(action.symbol in goods)
+                && !sent.some(other => other.symbol === action.symbol)
+            );
+            snapshot = { goods: { ...base.goods, ...goods }, actions: [...kept, ...sent] };
+            changed = Object.keys(goods).length > 0 || !sameActions(base.actions, snapshot.actions);
+        }
+        if (changed) {
+            rows.push({
+                instance_id: data.instanceId,
+                stream_id: data.streamId,
+                seq: update.seq,
+                timestamp: update.timestamp,
+                goods: snapshot.goods,
+                actions: snapshot.actions,
+            });
+        }
+    }
+
+    const latest = updates[updates.length - 1];
+    if (rows.length === 0) {
+        return successResponse({ acked: latest.seq });
+    }
+    const { data: inserted, error } = await supabase
+        .from("value_history")
+        .upsert(rows, { onConflict: "instance_id,stream_id,seq", ignoreDuplicates: true })
+        .select("seq");
+    if (error) {
+        console.error("Error inserting data:", error);
+        return errorResponse("Failed to store values", 500);
+    }
+
+    // Older actions of a backlog are outdated, so only the newest update notifies,
+    // only with the actions it contains, and only the first time it is stored
+    const isNew = inserted.some(row => row.seq === latest.seq);
+    if (isNew && latest.actions !== undefined && latest.actions.length > 0) {
+        const response = await sendPushNotification(data.instanceId, latest.actions);
+        if (response !== undefined) {
+            return response;
+        }
+    }
+    return successResponse({ acked: latest.seq });
+}
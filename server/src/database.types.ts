@@ -95,18 +95,24 @@ export type Database = {
           actions: Json
           goods: Json
           instance_id: string
+          seq: number | null
+          stream_id: string | null
           timestamp: string
         }
         Insert: {
           actions: Json
           goods: Json
           instance_id: string
+          seq?: number | null
+          stream_id?: string | null
           timestamp: string
         }
         Update: {
           actions?: Json
           goods?: Json
           instance_id?: string
+          seq?: number | null
+          stream_id?: string | null
           timestamp?: string
         }
         Relationships: [
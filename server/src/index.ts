@@ -13,6 +13,7 @@
 
 import { errorResponse, initSupabaseClient } from "./utils";
 import { update } from "./api/update";
+import { updateBatch } from "./api/updateBatch";
 import { processImg } from "./api/process";
 import { goodHistory } from "./api/goodHistory";
 import { createInstance } from "./api/auth/instance";
@@ -22,6 +23,7 @@ import { actions } from "./api/actions";
 
 const routeMap = new Map([
     ["/api/update", update],
+    ["/api/updateBatch", updateBatch],
     ["/api/token", addDeviceToken],
     ["/api/process", processImg],
     ["/api/goodHistory", goodHistory],
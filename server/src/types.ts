@@ -18,18 +18,28 @@ export const SYMBOLS = [
 ] as const;
 export const SymbolEnum = z.enum(SYMBOLS);
 
+// Forecast of whether a stock will be past the threshold within the next ticks
+export const ForecastSchema = z.object({
+    probability: z.number().min(0).max(1), // Fraction of simulated futures that reach the threshold
+    expectedTicks: z.number().positive().nullable(), // Average ticks until the threshold is reached, if it is
+    horizon: z.number().int().nonnegative(), // Number of forecast ticks
+});
+
 // Action schema for stock recommendations
 export const ActionSchema = z.object({
     symbol: SymbolEnum,
     value: z.number().min(GOOD_MIN), // Current value of the stock
     thresh: z.number().min(GOOD_MIN), // Threshold value (buy or sell threshold)
     type: z.enum(['buy', 'sell', 'missed_buy', 'missed_sell', 'still_buy', 'still_sell']),
+    forecast: ForecastSchema.optional(),
 });
 
 // Good item schema combining value and bought status
 export const GoodSchema = z.object({
     value: z.number().min(GOOD_MIN), // Current value of the stock
-    bought: z.boolean() // Whether the stock is bought or not
+    bought: z.boolean(), // Whether the stock is bought or not
+    percentile: z.number().min(0).max(1).optional(), // Fraction of simulated values below the current value
+    forecast: ForecastSchema.optional(), // Forecast of reaching the threshold of the next action, unless it is past it
 });
 
 export const TokenSendSchema = z.object({
@@ -45,8 +55,28 @@ export const DataPushSchema = z.object({
     instanceId: InstanceIdSchema,
 });
 
+// One update of a batch, numbered by the analyzer. With a base, it only contains the goods
+// that changed since the update with that sequence number, and its actions except still_*
+// actions of unchanged goods that the base already had. Without a base, it is a keyframe
+// with all goods and actions.
+export const SequencedUpdateSchema = z.object({
+    seq: z.number().int().positive(),
+    base: z.number().int().nonnegative().optional(),
+    timestamp: z.string().datetime({ offset: true }),
+    goods: z.record(SymbolEnum, GoodSchema).optional(),
+    actions: z.array(ActionSchema).max(GOOD_COUNT).optional(),
+});
+
+// Updates that the analyzer could not send yet, oldest first
+export const DataPushBatchSchema = z.object({
+    instanceId: InstanceIdSchema,
+    streamId: z.string().uuid(),
+    updates: z.array(SequencedUpdateSchema).min(1).max(100),
+});
+
 export const ImageProcessSchema = z.object({
     image: z.string().min(1), // Base64 encoded image string
+    mimeType: z.enum(["image/png", "image/webp"]).default("image/png"),
     instanceId: InstanceIdSchema,
 });
 
@@ -72,6 +102,7 @@ export type ValidationResult<T> = { success: true; data: T } | { success: false;
 
 // Infer TypeScript types from Zod schemas
 export type Action = z.infer<typeof ActionSchema>;
+export type Good = z.infer<typeof GoodSchema>;
 
 export interface ErrorResponse {
     success: false;
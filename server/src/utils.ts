@@ -52,6 +52,15 @@ export function ensureMethod(request: Request, method: string): ValidationResult
     return { success: true, data: null };
 }
 
+/** Parses the JSON body of a request, which the analyzer may compress with gzip. */
+export async function readJsonBody(request: Request): Promise<unknown> {
+    if (request.headers.get("Content-Encoding") === "gzip" && request.body) {
+        const body = request.body.pipeThrough(new DecompressionStream("gzip"));
+        return await new Response(body).json();
+    }
+    return await request.json();
+}
+
 /** Ensures the request method matches the expected method,
  * and validates the request body against the provided schema.
  * Returns a type-safe result, or an appropriate response if validation fails. */
@@ -61,7 +70,7 @@ export async function ensureRequest<T>(request: Request, method: string, schema:
         return methodResult;
     }
     try {
-        const data = await request.json();
+        const data = await readJsonBody(request);
         return ensureSchema(schema, data);
     } catch (error) {
         console.error("Error parsing request body:", error);
@@ -0,0 +1,9 @@
+-- Number every update of an analyzer, so that updates that are sent again
+-- (after the analyzer did not get the response) are only stored once
+alter table public.value_history
+add column stream_id uuid,
+add column seq bigint;
+
+-- Updates from before have no stream and are never sent again
+alter table public.value_history
+add constraint value_history_stream_seq_key unique (instance_id, stream_id, seq);